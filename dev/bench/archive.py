@@ -0,0 +1,93 @@
+##############################################################################
+# Throughput of writing an image archive the way `archive_image` used to
+# (2,048 byte chunks, text mode) versus `ArchiveWriter`, with and without
+# compression.
+#
+#     PYTHONPATH=lib/python python dev/bench/archive.py [megabytes]
+#
+# The "image" is a temp file of semi-compressible data read back as a binary
+# file, which stands in for the daemon's response (it supports `readinto`
+# like urllib3's does). Page cache means this mostly measures CPU and
+# syscalls, which is the part we control.
+#
+# Legacy mode writes `bytes` to a text mode file, so this only runs on
+# Python 2 (like the module).
+##############################################################################
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from qb.ansible.modules.docker.archive import ArchiveWriter, lzma
+
+
+def make_image(path, megabytes):
+    # Random blocks repeated a bit, so compressors have something to do
+    block = os.urandom(64 * 1024)
+    with open(path, 'wb') as file:
+        for index in range(megabytes * 16):
+            file.write(block if index % 4 else os.urandom(64 * 1024))
+
+
+def legacy(image_path, archive_path):
+    with open(image_path, 'rb') as source:
+        with open(archive_path, 'w') as fd:
+            for chunk in iter(lambda: source.read(2048), b''):
+                fd.write(chunk)
+
+
+def report(label, seconds, megabytes):
+    print("{:<28} {:>8.2f} s {:>10.1f} MB/s".format(
+        label,
+        seconds,
+        megabytes * 1024 * 1024 / seconds / 1e6,
+    ))
+
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    directory = tempfile.mkdtemp(prefix='qb-bench-archive')
+    image_path = os.path.join(directory, 'image.tar')
+
+    try:
+        make_image(image_path, megabytes)
+
+        start = time.time()
+        legacy(image_path, os.path.join(directory, 'legacy.tar'))
+        report('legacy (2 KiB, text mode)', time.time() - start, megabytes)
+
+        compressions = [None, 'gzip']
+        if lzma is not None:
+            compressions.append('xz')
+
+        runs = [(None, False)] + [
+            (compression, True) for compression in compressions
+        ]
+
+        for compression, checksum in runs:
+            writer = ArchiveWriter(
+                os.path.join(directory, "writer.tar.{}".format(compression)),
+                compression = compression,
+                checksum = checksum,
+            )
+            with open(image_path, 'rb') as source:
+                stats = writer.write_from(source)
+            report(
+                "ArchiveWriter ({}{})".format(
+                    compression or 'none',
+                    ', sha256' if checksum else '',
+                ),
+                stats['seconds'],
+                megabytes,
+            )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+##############################################################################
+# Cold-start cost of connecting to the Docker daemon the way
+# `QBAnsibleDockerClient` does, with `api_version: auto` negotiated every
+# time versus read from `qb.ansible.modules.docker.daemon_cache`.
+#
+#     PYTHONPATH=lib/python python dev/bench/daemon_cache.py [runs]
+#
+# Each run is a fresh Python process (like a module invocation) that imports
+# docker-py and makes an `APIClient`. Talks to the daemon at `DOCKER_HOST` if
+# that's set, otherwise to a stand-in daemon started here that answers
+# `/version` after `BENCH_DAEMON_LATENCY_MS` (default 5) - a busy daemon or a
+# remote one is slower than an idle local one.
+#
+# Needs docker-py; says so and exits if it isn't installed.
+##############################################################################
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import SocketServer as socketserver
+    import BaseHTTPServer as http_server
+except ImportError:
+    import socketserver
+    import http.server as http_server
+
+try:
+    import docker
+except ImportError:
+    docker = None
+
+
+VERSION_INFO = dict(
+    ApiVersion = '1.37',
+    MinAPIVersion = '1.12',
+    Version = '18.03.1-ce',
+    Os = 'linux',
+    Arch = 'amd64',
+)
+
+# What each run does. `cached` mirrors `QBAnsibleDockerClient`: look in the
+# cache, connect with the version from there or negotiate and fill it in
+# with the `/version` response negotiating got.
+RUN_SCRIPT = '''
+import sys, time
+start = time.time()
+import docker
+from qb.ansible.modules.docker import daemon_cache
+base_url = sys.argv[1]
+entry = daemon_cache.load(base_url) if sys.argv[2] == 'cached' else None
+negotiated = {}
+class Client(docker.APIClient):
+    def _retrieve_server_version(self):
+        negotiated.update(self.version(api_version=False))
+        return negotiated['ApiVersion']
+client = Client(
+    base_url = base_url,
+    version = entry['api_version'] if entry else 'auto',
+)
+if sys.argv[2] == 'cached' and entry is None:
+    daemon_cache.dump(base_url, client.api_version, negotiated)
+sys.stdout.write(str(time.time() - start))
+'''
+
+
+class Handler(http_server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests += 1
+        time.sleep(self.server.latency)
+        body = json.dumps(VERSION_INFO).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = self.socket.accept()
+        # BaseHTTPRequestHandler wants a client address to log
+        return request, ('local', 0)
+
+
+def start_server(path):
+    server = Server(path, Handler)
+    server.latency = float(
+        os.environ.get('BENCH_DAEMON_LATENCY_MS', '5')
+    ) / 1000
+    server.requests = 0
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def run(base_url, mode, env):
+    output = subprocess.check_output(
+        [sys.executable, '-c', RUN_SCRIPT, base_url, mode],
+        env = env,
+    )
+    return float(output)
+
+
+def report(label, timings):
+    timings = sorted(timings)
+    print("{:<30} median {:>7.2f} ms   min {:>7.2f} ms".format(
+        label,
+        timings[len(timings) // 2] * 1000,
+        timings[0] * 1000,
+    ))
+
+
+def main():
+    if docker is None:
+        print("docker-py isn't installed, nothing to do")
+        return
+
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    directory = tempfile.mkdtemp(prefix='qb-bench-daemon-cache')
+    server = None
+
+    env = dict(os.environ)
+    env['QB_CACHE_DIR'] = os.path.join(directory, 'cache')
+
+    try:
+        base_url = os.environ.get('DOCKER_HOST')
+
+        if base_url is None:
+            socket_path = os.path.join(directory, 'docker.sock')
+            server = start_server(socket_path)
+            base_url = 'unix://' + socket_path
+            print("stand-in daemon at {} ({:.0f} ms / request)".format(
+                base_url,
+                server.latency * 1000,
+            ))
+        else:
+            print("daemon at {}".format(base_url))
+
+        report(
+            'negotiate (auto)',
+            [run(base_url, 'auto', env) for _ in range(runs)],
+        )
+
+        first = run(base_url, 'cached', env)
+        print("{:<30} {:>14.2f} ms".format('cache miss (first run)', first * 1000))
+
+        report(
+            'cached',
+            [run(base_url, 'cached', env) for _ in range(runs)],
+        )
+
+        if server is not None:
+            print("daemon requests: {}".format(server.requests))
+    finally:
+        if server is not None:
+            server.shutdown()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+##############################################################################
+# Cost of a `logger.debug(..., payload=...)` call that the master is going to
+# drop, before and after loggers picked up the master's level.
+#
+#     PYTHONPATH=lib/python python dev/bench/disabled_log.py [iterations]
+#
+# "Before" is a `DEBUG` logger that formats and serializes every record
+# (what `getLogger` always did); "after" is a logger at the master's `info`
+# level, so the call is dropped before `Adapter.process`.
+##############################################################################
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import logging
+import sys
+import timeit
+
+import qb.ipc.stdio.logging
+
+
+class NullConnection:
+    connected = True
+
+    def println(self, line):
+        pass
+
+
+class NullClient:
+    log = NullConnection()
+
+
+def debug_call(logger):
+    logger.debug(
+        "Found existing image `{name}:{tag}`",
+        payload = dict(name='nrser/qb', tag='0.1.2', size=123456789),
+    )
+
+
+def report(label, seconds, number):
+    print("{:<28} {:>10.3f} us/call".format(label, seconds / number * 1e6))
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    io_client = NullClient()
+
+    before = qb.ipc.stdio.logging.getLogger(
+        'bench.before',
+        level = logging.DEBUG,
+        io_client = io_client,
+    )
+
+    after = qb.ipc.stdio.logging.getLogger(
+        'bench.after',
+        level = qb.ipc.stdio.logging.master_level(
+            'bench.after',
+            {qb.ipc.stdio.logging.LEVEL_ENV_VAR_NAME: 'info'},
+        ),
+        io_client = io_client,
+    )
+
+    report(
+        'before (always DEBUG)',
+        timeit.timeit(lambda: debug_call(before), number=number),
+        number,
+    )
+
+    report(
+        'after (master level info)',
+        timeit.timeit(lambda: debug_call(after), number=number),
+        number,
+    )
+
+
+if __name__ == '__main__':
+    main()
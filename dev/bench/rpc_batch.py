@@ -0,0 +1,84 @@
+##############################################################################
+# 1,000 sequential `qb.ipc.rpc.client.send` calls versus the same calls sent
+# through `Client.batch()` (one `/batch` request per batch).
+#
+# Needs a running `QB::IPC::RPC::Server` to talk to, which you can get with:
+#
+#     PYTHONPATH=lib/python bundle exec ruby -Ilib \
+#       -e "require 'qb'; require 'qb/ipc/rpc/server'" \
+#       -e "QB::IPC::RPC::Server.run_around { system 'python', *ARGV }" \
+#       dev/bench/rpc_batch.py [count] [batch_size]
+#
+##############################################################################
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import sys
+import time
+
+from qb.ipc.rpc import client
+
+
+RECEIVER = 'QB::Package::Version'
+METHOD = 'from'
+
+
+def versions(count):
+    return ["0.1.{}".format(i) for i in range(count)]
+
+
+def run_sequential(strings):
+    return [client.send(RECEIVER, METHOD, string) for string in strings]
+
+
+def run_batched(strings, batch_size):
+    calls = []
+    for start in range(0, len(strings), batch_size):
+        with client.batch() as batch:
+            for string in strings[start:start + batch_size]:
+                calls.append(batch.send(RECEIVER, METHOD, string))
+    return [call.result() for call in calls]
+
+
+def report(label, seconds, count):
+    print("{:<28} {:>8.3f} s total {:>10.1f} us/call".format(
+        label,
+        seconds,
+        seconds / count * 1e6,
+    ))
+
+
+def main():
+    if client.RPC_SOCKET_ENV_VAR_NAME not in os.environ:
+        print("{} not set - need a running QB RPC server, see header".format(
+            client.RPC_SOCKET_ENV_VAR_NAME
+        ))
+        sys.exit(1)
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else count
+    strings = versions(count)
+
+    # Warm up the connection and the server
+    client.send(RECEIVER, METHOD, '0.0.0')
+
+    start = time.time()
+    sequential = run_sequential(strings)
+    report('sequential send', time.time() - start, count)
+
+    start = time.time()
+    batched = run_batched(strings, batch_size)
+    report(
+        "batched ({} per request)".format(batch_size),
+        time.time() - start,
+        count,
+    )
+
+    if sequential != batched:
+        print("WARNING - sequential and batched results differ!")
+
+
+if __name__ == '__main__':
+    main()
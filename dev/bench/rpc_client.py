@@ -0,0 +1,151 @@
+##############################################################################
+# Import time and per-call latency of the RPC clients in
+# `qb.ipc.rpc.client`: the default `SocketClient` versus the
+# `requests_unixsocket`-based `Client`.
+#
+#     PYTHONPATH=lib/python python dev/bench/rpc_client.py [calls]
+#
+# Talks to the QB master if `QB_RPC_SOCKET` is set (see `rpc_batch.py` for how
+# to get one running), otherwise to a stand-in server started here that
+# answers every request with `{"data": ...}` - which is fine for comparing
+# client overhead. The `Client` side is skipped if `requests_unixsocket`
+# isn't installed.
+##############################################################################
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import SocketServer as socketserver
+    import BaseHTTPServer as http_server
+except ImportError:
+    import socketserver
+    import http.server as http_server
+
+from qb.ipc.rpc import client
+
+
+class Handler(http_server.BaseHTTPRequestHandler):
+    '''
+    Echoes `/send` args back as the data, keeping the connection alive like
+    a well-behaved HTTP/1.1 server would (Unicorn doesn't).
+    '''
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length).decode('utf-8'))
+        self.respond(dict(data=payload.get('args')))
+
+    def do_GET(self):
+        self.respond(dict(data={}))
+
+    def respond(self, values):
+        body = json.dumps(values).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    # `BaseHTTPRequestHandler` wants a (host, port) client address
+    def get_request(self):
+        request, _ = self.socket.accept()
+        return request, ('localhost', 0)
+
+
+def start_server():
+    socket_dir = tempfile.mkdtemp(prefix='qb-bench-rpc')
+    socket_path = os.path.join(socket_dir, 'socket')
+    server = Server(socket_path, Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, socket_dir, socket_path
+
+
+def import_time(statement):
+    '''
+    Best of 5 wall-clock times to run `statement` in a fresh interpreter,
+    minus an empty one.
+    '''
+    def best(code):
+        times = []
+        for _ in range(5):
+            start = time.time()
+            subprocess.check_call([sys.executable, '-c', code])
+            times.append(time.time() - start)
+        return min(times)
+    return best(statement) - best('pass')
+
+
+def per_call(rpc_client, calls):
+    rpc_client.send('QB::Package::Version', 'from', '0.0.0')
+    start = time.time()
+    for i in range(calls):
+        rpc_client.send('QB::Package::Version', 'from', "0.1.{}".format(i))
+    return (time.time() - start) / calls
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    try:
+        import requests_unixsocket
+        has_requests = True
+    except ImportError:
+        has_requests = False
+
+    print("Import time (fresh interpreter):")
+    print("  {:<36} {:>8.1f} ms".format(
+        'import qb.ipc.rpc.client',
+        import_time('import qb.ipc.rpc.client') * 1e3,
+    ))
+    if has_requests:
+        print("  {:<36} {:>8.1f} ms".format(
+            'import requests_unixsocket',
+            import_time('import requests_unixsocket') * 1e3,
+        ))
+
+    server = None
+    socket_path = os.environ.get(client.RPC_SOCKET_ENV_VAR_NAME)
+    if socket_path is None:
+        server, socket_dir, socket_path = start_server()
+        print("Using stand-in server at {}".format(socket_path))
+
+    try:
+        print("Per-call latency ({} calls):".format(calls))
+        print("  {:<36} {:>8.1f} us".format(
+            'SocketClient.send',
+            per_call(client.SocketClient(socket_path), calls) * 1e6,
+        ))
+        if has_requests:
+            print("  {:<36} {:>8.1f} us".format(
+                'Client.send (requests_unixsocket)',
+                per_call(client.Client(socket_path), calls) * 1e6,
+            ))
+    finally:
+        if server is not None:
+            server.shutdown()
+            shutil.rmtree(socket_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+##############################################################################
+# Per-call latency of `qb.semver` versus forking Node's `semver`, which is
+# what the `semver_inc` / `semver_parse` filters used to do.
+#
+#     PYTHONPATH=lib/python python dev/bench/semver.py [iterations]
+#
+# The Node side needs `node` and `//node_modules/semver` (`yarn install`).
+##############################################################################
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+import os
+import subprocess
+import sys
+import timeit
+
+import qb
+import qb.semver
+
+
+VERSION = '1.2.3-dev.4'
+SEMVER_BIN = os.path.join(qb.ROOT, 'node_modules', 'semver', 'bin', 'semver')
+
+
+def node_inc():
+    subprocess.check_output(
+        [SEMVER_BIN, '--increment', 'prerelease', '--preid', 'dev', VERSION]
+    )
+
+
+def node_parse():
+    subprocess.check_output(
+        [
+            'node',
+            '--eval',
+            "console.log(JSON.stringify(require('semver')(%s)))" %
+            json.dumps(VERSION),
+        ],
+        cwd = qb.ROOT,
+    )
+
+
+def report(label, seconds, number):
+    print("{:<24} {:>12.3f} us/call  ({} calls)".format(
+        label,
+        seconds / number * 1e6,
+        number,
+    ))
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    report(
+        'qb.semver.inc',
+        timeit.timeit(
+            lambda: qb.semver.inc(VERSION, 'prerelease', preid='dev'),
+            number = number,
+        ),
+        number,
+    )
+
+    report(
+        'qb.semver.parse',
+        timeit.timeit(lambda: qb.semver.parse(VERSION), number=number),
+        number,
+    )
+
+    if not os.path.isfile(SEMVER_BIN):
+        print("{} not found, skipping node".format(SEMVER_BIN))
+        return
+
+    # Forking is *way* slower, don't need nearly as many
+    node_number = max(1, number // 1000)
+
+    report(
+        'node semver --increment',
+        timeit.timeit(node_inc, number=node_number),
+        node_number,
+    )
+
+    report(
+        'node --eval semver()',
+        timeit.timeit(node_parse, number=node_number),
+        node_number,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -28,9 +28,32 @@ options:
       - Use with state C(present) to archive an image to a .tar file.
     required: false
     version_added: "2.1"
+  archive_compression:
+    description:
+      - Compress the archive written to C(archive_path) on the fly. Either way, the SHA-256 of the file is written
+        next to it as C(<archive_path>.sha256) and returned in C(archive) (see C(archive_checksum)). Added by QB.
+      - C(xz) needs the C(lzma) module (C(backports.lzma) on Python 2).
+    choices:
+      - none
+      - gzip
+      - xz
+    default: none
+    required: false
+  archive_checksum:
+    description:
+      - Compute the SHA-256 of the archive as it's written and put it in C(<archive_path>.sha256). Turn off to save
+        the CPU on big uncompressed archives. Added by QB.
+      - With it on, the image ID, size and digest also go in C(<archive_path>.meta.json), and later runs skip the
+        export (and report no change) when the image ID matches and the archive's size and digest check out.
+    default: true
+    required: false
+    type: bool
   load_path:
     description:
       - Use with state C(present) to load an image from a .tar file.
+      - QB - can also be gzip or xz compressed. The file is streamed to the daemon with progress output, and if it
+        has a C(<load_path>.meta.json) sidecar (see C(archive_checksum)) that the file still matches and the daemon
+        already has that image, it isn't loaded again.
     required: false
     version_added: "2.2"
   dockerfile:
@@ -57,7 +80,80 @@ options:
     description:
       - "Image name. Name format will be one of: name, repository/name, registry_server:port/name.
         When pushing or pulling an image the name can optionally include the tag by appending ':tag_name'."
-    required: true
+      - Required unless C(images) is given.
+    required: false
+  incremental:
+    description:
+      - When building, hash the build inputs - context (honoring C(.dockerignore)), Dockerfile, C(buildargs) and base
+        image IDs - and skip the build if there's already an image built from the same inputs, either at C(name:tag),
+        locally under another name (it's tagged as C(name:tag)), or in the repository (it's pulled, if
+        C(try_to_pull) is on). Added by QB.
+      - The hash is stored in the C(com.github.nrser.qb.build-input-hash) label of built images and returned as
+        C(input_hash).
+    default: false
+    required: false
+    type: bool
+  build_log_lines:
+    description:
+      - Most lines of build output to keep in memory for the failure message. The full output is written to a temp
+        file, which is removed when the build succeeds, and returned as C(build_log_path) when it fails. Added by QB.
+    default: 200
+    required: false
+  build_log_bytes:
+    description:
+      - Most bytes of build output to keep in memory for the failure message (see C(build_log_lines)). Added by QB.
+    default: 65536
+    required: false
+  progress_interval:
+    description:
+      - Seconds between the status lines written for pull and push progress, which is coalesced across layers
+        instead of writing every update from the daemon. A summary of each layer's size and time is written at the
+        end. Added by QB.
+    default: 0.25
+    required: false
+  images:
+    description:
+      - List of images to manage in one go, instead of C(name). Each entry is either a name or a dict of any of this
+        module's options, with the top-level options as defaults. Added by QB.
+      - Entry options are checked and converted like top-level ones, and unknown options fail the module. The Docker
+        connection options, C(images) and C(max_workers) can't be set per entry, and an entry's C(state) can only be
+        C(present), C(absent) or C(build).
+      - Entries are worked on concurrently (see C(max_workers)) sharing one connection to the Docker daemon, and
+        their results are returned in C(images), in order.
+    required: false
+  max_workers:
+    description:
+      - Most C(images) to work on (or prefetch) at once. Added by QB.
+    default: 4
+    required: false
+  prune_keep_last:
+    description:
+      - With state C(prune), keep this many of the newest tags of each repository matching C(name), which is
+        required with it. Added by QB.
+    required: false
+  prune_older_than:
+    description:
+      - With state C(prune), only remove tags of images older than this - a number of seconds, or with a unit like
+        C(12h), C(7d) or C(2w). When given with C(prune_keep_last), tags have to be outside both to go. Tags are
+        only removed when at least one of the two is given, and C(name) is required with either. Added by QB.
+    required: false
+  prune_dangling:
+    description:
+      - With state C(prune), also remove untagged images. These are removed host-wide, whatever C(name) is, so
+        this has to be turned on explicitly. Added by QB.
+    default: false
+    required: false
+    type: bool
+  prefetch_path:
+    description:
+      - Status file for state C(prefetch) and C(prefetched). Defaults to one in the QB cache directory named for the
+        images, so a C(prefetched) task with the same C(images) (or C(name) and C(tag)) finds it. Added by QB.
+    required: false
+  prefetch_timeout:
+    description:
+      - Seconds state C(prefetched) waits for the prefetch to finish. Added by QB.
+    default: 600
+    required: false
   path:
     description:
       - Use with state 'present' to build an image. Will be the path to a directory containing the context and
@@ -96,8 +192,25 @@ options:
     description:
       - Full path to a repository. Use with state C(present) to tag the image into the repository. Expects
         format I(repository:tag). If no tag is provided, will use the value of the C(tag) parameter or I(latest).
+      - Can be a list, to tag the image into several repositories. With C(push), the pushes happen concurrently
+        (see C(push_concurrency)) and their results are returned in C(pushes). Added by QB.
     required: false
     version_added: "2.1"
+  result_detail:
+    description:
+      - How much of the image inspection to return in C(image). C(full) is everything C(docker inspect) gives;
+        C(summary) is just C(Id), C(RepoTags), C(RepoDigests), C(Created), C(Metadata) and C(Size), which is a lot
+        less to ship back and keep in registered variables. Added by QB.
+    default: full
+    choices:
+      - full
+      - summary
+    required: false
+  push_concurrency:
+    description:
+      - Most C(repository) pushes to run at once. Added by QB.
+    default: 4
+    required: false
   state:
     description:
       - Make assertions about the state of an image.
@@ -110,12 +223,25 @@ options:
         repository, provide a repository path. If the name contains a repository path, it will be pushed.
       - "NOTE: C(build) is DEPRECATED and will be removed in release 2.3. Specifying C(build) will behave the
          same as C(present)."
+      - When C(prefetch), start pulling C(images) (or C(name)) in a detached background process and return right
+        away, so the pulls overlap with the rest of the play. Images that are already local aren't pulled. Progress
+        is recorded in a status file (see C(prefetch_path)). Added by QB.
+      - When C(prune), remove images in bulk by the C(prune_keep_last), C(prune_older_than) and C(prune_dangling)
+        policies, C(max_workers) at a time. Tags are only removed from repositories matching C(name) - a glob
+        like C(nrser/*), without a tag - which is required with C(prune_keep_last) or C(prune_older_than). Use
+        C(*) to mean every repository on the host, base images and all. Images used by containers, running or not,
+        are never removed. Check mode reports what would be removed without removing it. Added by QB.
+      - When C(prefetched), wait for a C(prefetch) of the same images to finish (see C(prefetch_timeout)) and fail
+        if any of them didn't make it. Added by QB.
     required: false
     default: present
     choices:
       - absent
       - present
       - build
+      - prefetch
+      - prefetched
+      - prune
   tag:
     description:
       - Used to select an image when pulling. Will be added to the image when pushing, tagging or building. Defaults to
@@ -177,6 +303,13 @@ requirements:
   - "docker-py >= 1.7.0"
   - "Docker API >= 1.20"
 
+notes:
+  - When run by QB with C(QB_DOCKER_BROKER=1) set, tasks are handed to a long-lived Docker broker process started
+    for the run, which keeps docker-py loaded, a client set up and image inspections cached between tasks for as
+    long as it's following the daemon's image events. The broker runs tasks as the user running QB, so tasks that
+    run as someone else (C(become)), with another Python, or with different Docker C(environment) run in their own
+    process as usual. Added by QB.
+
 author:
   - Pavel Antonov (@softzilla)
   - Chris Houseknecht (@chouseknecht)
@@ -204,6 +337,16 @@ EXAMPLES = '''
      tag: 7
      push: yes
 
+- name: Tag and push to a few registries at once
+  qb_docker_image:
+    name: nrser/qb
+    tag: 0.1.2
+    repository:
+      - registry.staging.example.com/nrser/qb
+      - registry.example.com/nrser/qb
+      - registry.dr.example.com/nrser/qb
+    push: yes
+
 - name: Remove image
   docker_image:
     state: absent
@@ -230,6 +373,46 @@ EXAMPLES = '''
     push: yes
     load_path: my_sinatra.tar
 
+- name: Pull, tag and push a bunch of images at once
+  qb_docker_image:
+    images:
+      - nrser/base:0.1.0
+      - name: nrser/app
+        path: ./app
+      - name: nrser/old
+        state: absent
+    tag: 0.1.0
+    push: yes
+    max_workers: 8
+
+- name: Start pulling images the play needs later...
+  qb_docker_image:
+    state: prefetch
+    images:
+      - redis:4
+      - postgres:10
+
+# ...other tasks...
+
+- name: ...and make sure they're here before using them
+  qb_docker_image:
+    state: prefetched
+    images:
+      - redis:4
+      - postgres:10
+
+- name: Keep the 5 newest tags of each nrser image, as long as they're under a week old
+  qb_docker_image:
+    state: prune
+    name: nrser/*
+    prune_keep_last: 5
+    prune_older_than: 7d
+
+- name: Remove untagged images left behind by builds
+  qb_docker_image:
+    state: prune
+    prune_dangling: yes
+
 - name: Build image and with buildargs
   docker_image:
      path: /path/to/build/dir
@@ -241,80 +424,88 @@ EXAMPLES = '''
 
 RETURN = '''
 image:
-    description: Image inspection results for the affected image.
+    description: Image inspection results for the affected image - just the summary fields with
+      C(result_detail=summary).
     returned: success
     type: dict
     sample: {}
+archive:
+    description: When an archive was written - it's C(path), C(compression), C(sha256) and C(sha256_path) (the
+      sidecar), C(size) written, C(image_size) read from the daemon, C(seconds) and C(mb_per_sec). When the archive
+      was already an intact export of the image (per it's C(<archive_path>.meta.json) sidecar) it isn't written
+      again, and this is the sidecar's contents with C(skipped) set.
+    returned: when C(archive_path) and the image was archived
+    type: dict
+    sample: {}
+load:
+    description: When an image was loaded - C(path), C(compression), C(size), C(seconds) and C(mb_per_sec).
+    returned: when an image was loaded from C(load_path)
+    type: dict
+    sample: {}
+build_profile:
+    description: When an image was built - it's C(steps) (each with the step C(number), C(instruction), C(cached) and
+      C(seconds)), C(cache_hits), C(cache_misses) and total C(seconds). C(cached) is null for steps that can't be
+      cached, like C(FROM).
+    returned: when an image was built, or a build failed
+    type: dict
+    sample: {}
+build_log_path:
+    description: Temp file with the full output of a failed build (the failure message only has the tail).
+    returned: when a build fails
+    type: str
+    sample: /tmp/qb-docker-build-3x9k2m.log
+input_hash:
+    description: Hash of the build inputs, when C(incremental) and building.
+    returned: when C(incremental)
+    type: str
+    sample: 9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08
+pushes:
+    description: When C(repository) was pushed to - for each target, it's C(repository), C(tag), C(status) (the last
+      one from the daemon), C(seconds) and C(error) if it failed.
+    returned: when C(push) and C(repository) were given and tags were made
+    type: list
+    sample: []
+prefetch:
+    description: For states C(prefetch) and C(prefetched), the prefetch status - C(path) (of the status file),
+      C(pid) of the worker, C(started_at), C(finished_at), and C(images), a dict of C(name:tag) to their C(state)
+      (C(pending), C(pulling), C(pulled), C(present) or C(failed)), C(progress), C(image_id), C(bytes),
+      C(seconds), C(error) and C(reported) (a C(prefetched) task already reported the pull as a change).
+      C(prefetched) adds C(timed_out) and C(worker_died).
+    returned: when state is C(prefetch) or C(prefetched)
+    type: dict
+    sample: {}
+prune:
+    description: For state C(prune) - C(removed) (refs removed, or that would be in check mode), C(failed) (with
+      their C(error)), C(in_use) (refs the policies picked that containers use), C(kept) (count of tags kept),
+      C(dry_run) and C(reclaimed_bytes). C(reclaimed_bytes) is the size of the images deleted, including layers
+      they share with images that are still around, so it's an upper bound.
+    returned: when state is C(prune)
+    type: dict
+    sample: {}
+images:
+    description: Results for each entry in C(images), in order - C(name), C(changed), C(actions), C(image),
+      C(warnings), and C(failed) and C(msg) if it failed.
+    returned: when C(images) is given
+    type: list
+    sample: []
 '''
 
-import json
-
 # WTF This is some weird trigger?!?!? If this line is *gone*, can't read
 # params... but commented out is fine :/
 # from ansible.module_utils.docker_common import HAS_DOCKER_PY_2
 
-import qb.ipc.stdio
-import qb.ipc.stdio.logging
-
-from qb.ansible.modules.docker.client import QBAnsibleDockerClient
-from qb.ansible.modules.docker.image_manager import ImageManager
-
-logger = qb.ipc.stdio.logging.getLogger('qb_docker_image')
+from qb.ansible.modules.docker import broker
 
 
 def main():
-    argument_spec = dict(
-        archive_path=dict(type='path'),
-        container_limits=dict(type='dict'),
-        dockerfile=dict(type='str'),
-        force=dict(type='bool', default=False),
-        http_timeout=dict(type='int'),
-        load_path=dict(type='path'),
-        name=dict(type='str', required=True),
-        nocache=dict(type='bool', default=False),
-        path=dict(type='path', aliases=['build_path']),
-        pull=dict(type='bool', default=True),
-        push=dict(type='bool', default=False),
-        repository=dict(type='str'),
-        rm=dict(type='bool', default=True),
-        state=dict(
-            type='str',
-            choices=['absent', 'present', 'build'],
-            default='present'
-        ),
-        tag=dict(type='str', default='latest'),
-        use_tls=dict(
-            type='str',
-            default='no',
-            choices=['no', 'encrypt', 'verify']
-        ),
-        buildargs=dict(type='dict', default=None),
-        
-        # QB additions
-        try_to_pull=dict( type='bool', default=True ),
-    )
-
-    client = QBAnsibleDockerClient(
-        argument_spec=argument_spec,
-        supports_check_mode=True,
-        mutually_exclusive=[
-            # Don't tell me to build *and* load an image
-            ['path', 'load_path'],
-        ]
-    )
-
-    results = dict(
-        changed=False,
-        actions=[],
-        # NOTE IDK why this is an empty dict...?
-        image={},
-        warnings=[],
-    )
-    
-    qb.ipc.stdio.client.connect(results['warnings'])
+    # When the QB master is running a Docker broker, hand the args to it -
+    # it's already got docker-py loaded and a client set up - and just
+    # relay what it says. Otherwise, do it all here.
+    if broker.forward():
+        return
     
-    ImageManager(client, results)
-    client.module.exit_json(**results)
+    from qb.ansible.modules.docker.image_module import main as module_main
+    module_main()
 
 
 if __name__ == '__main__':
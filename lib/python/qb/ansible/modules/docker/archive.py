@@ -0,0 +1,442 @@
+##############################################################################
+# Writing image archives (what `docker save` gives you) to disk fast: big
+# reused buffers, binary mode, optional gzip / xz compression and a SHA-256 of
+# what was written, all in one pass over the stream from the daemon.
+#
+# The digest is also written next to the archive in `sha256sum` format
+# (`<archive_path>.sha256`), so
+#
+#     sha256sum -c image.tar.gz.sha256
+#
+# works.
+#
+# When we know what image was archived, that goes in a JSON metadata sidecar
+# (`<archive_path>.meta.json`) along with the size and digest, so the next run
+# can tell the archive is already current (see {is_current}) and skip the
+# export.
+#
+# Going the other way, {read_chunks} streams an archive off disk for loading
+# with progress reports. Compressed archives are sent as they are - the daemon
+# decompresses `docker load` input itself.
+##############################################################################
+
+# Imports
+# ============================================================================
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import time
+import gzip
+import json
+import hashlib
+
+try:
+    import lzma
+except ImportError:
+    try:
+        # Python 2 backport
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+
+# Constants
+# ============================================================================
+
+# Compression values we handle, to the extension they usually get.
+#
+COMPRESSIONS = {
+    'gzip': '.gz',
+    'xz': '.xz',
+}
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+SIDECAR_EXTENSION = '.sha256'
+
+METADATA_EXTENSION = '.meta.json'
+
+# Leading bytes of the compressed formats we know, to their names.
+#
+MAGIC_NUMBERS = {
+    b'\x1f\x8b': 'gzip',
+    b'\xfd7zXZ\x00': 'xz',
+}
+
+# Tar files have this at offset 257 (POSIX / GNU).
+#
+TAR_MAGIC = b'ustar'
+
+# Seconds between progress reports from {read_chunks}.
+#
+PROGRESS_INTERVAL = 0.25
+
+
+# Functions
+# ============================================================================
+
+def metadata_path(path):
+    return path + METADATA_EXTENSION
+
+
+def read_metadata(path):
+    '''
+    Metadata sidecar for the archive at `path`.
+
+    :rtype:     dict or `None`
+    :return:    `None` if there isn't one (or it's unreadable).
+    '''
+    try:
+        with open(metadata_path(path), 'r') as file:
+            metadata = json.load(file)
+    except (IOError, OSError, ValueError):
+        return None
+    return metadata if isinstance(metadata, dict) else None
+
+
+def write_metadata(path, metadata):
+    with open(metadata_path(path), 'w') as file:
+        json.dump(metadata, file, indent=2, sort_keys=True)
+
+
+def clear_metadata(path):
+    if os.path.exists(metadata_path(path)):
+        os.remove(metadata_path(path))
+
+
+def file_sha256(path, buffer_size=DEFAULT_BUFFER_SIZE):
+    digest = hashlib.sha256()
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with open(path, 'rb') as file:
+        while True:
+            count = file.readinto(buffer)
+            if not count:
+                return digest.hexdigest()
+            digest.update(view[:count])
+
+
+def is_current(path, image_id, compression=None):
+    '''
+    Is the archive at `path` an intact export of image `image_id` with
+    `compression`?
+
+    Checks the metadata sidecar, then the file size and finally the SHA-256
+    of the file, so a missing, truncated or otherwise changed archive is
+    never considered current. Archives written without a checksum never are
+    either.
+
+    :rtype:     bool
+    '''
+    if compression == 'none':
+        compression = None
+
+    metadata = read_metadata(path)
+
+    if (
+        metadata is None or
+        metadata.get('image_id') != image_id or
+        metadata.get('compression') != compression or
+        not metadata.get('sha256')
+    ):
+        return False
+
+    try:
+        if os.path.getsize(path) != metadata.get('size'):
+            return False
+        return file_sha256(path) == metadata['sha256']
+    except (IOError, OSError):
+        return False
+
+
+def detect_compression(path):
+    '''
+    Figure out what an archive is from it's first bytes.
+
+    :rtype:     str or `None`
+    :return:    `'gzip'`, `'xz'`, `'tar'` for an uncompressed tar, or `None`
+                if it's none of those.
+    '''
+    with open(path, 'rb') as file:
+        head = file.read(512)
+
+    for magic, compression in MAGIC_NUMBERS.items():
+        if head.startswith(magic):
+            return compression
+
+    if head[257:257 + len(TAR_MAGIC)] == TAR_MAGIC:
+        return 'tar'
+
+    return None
+
+
+def read_chunks(
+    path,
+    buffer_size=DEFAULT_BUFFER_SIZE,
+    progress=None,
+    interval=PROGRESS_INTERVAL,
+):
+    '''
+    Iterate over the contents of the file at `path`, `buffer_size` bytes at a
+    time - suitable as a streaming request body.
+
+    :param progress:    Optional function called with `(sent, total,
+                        seconds)` at most every `interval` seconds, and once
+                        more at the end.
+    '''
+    total = os.path.getsize(path)
+    sent = 0
+    start = time.time()
+    last_report = start
+
+    with open(path, 'rb') as file:
+        while True:
+            chunk = file.read(buffer_size)
+            if not chunk:
+                break
+
+            sent += len(chunk)
+            yield chunk
+
+            now = time.time()
+            if progress is not None and now - last_report >= interval:
+                progress(sent, total, now - start)
+                last_report = now
+
+    if progress is not None:
+        progress(sent, total, time.time() - start)
+
+
+def format_progress(label, sent, total, seconds):
+    '''
+    >>> format_progress('Loading x.tar.gz', 52428800, 104857600, 2.0)
+    'Loading x.tar.gz: 50.0% (52.4 / 104.9 MB) 26.2 MB/s'
+    '''
+    return "{}: {:.1f}% ({:.1f} / {:.1f} MB) {:.1f} MB/s".format(
+        label,
+        100 * sent / total if total else 100.0,
+        sent / 1e6,
+        total / 1e6,
+        sent / seconds / 1e6 if seconds > 0 else 0.0,
+    )
+
+
+# Classes
+# ============================================================================
+
+class DigestFile:
+    '''
+    Write-only file wrapper that hashes and counts everything written
+    through it (so compressors can write to it like a file).
+
+    Pass `checksum=False` to only count - SHA-256 is usually the slowest part
+    of an uncompressed archive.
+    '''
+
+    def __init__(self, file, checksum=True):
+        self.file = file
+        self.digest = hashlib.sha256() if checksum else None
+        self.size = 0
+
+
+    def write(self, data):
+        if self.digest is not None:
+            self.digest.update(data)
+        self.size += len(data)
+        self.file.write(data)
+
+
+    def flush(self):
+        self.file.flush()
+
+
+    def tell(self):
+        return self.size
+
+
+class ArchiveWriter:
+    '''
+    Writes an image archive stream to `path`.
+
+    Goes to `<path>.part` first and gets renamed into place once it's all
+    there, so a failed archive never looks like a good one.
+
+    Usage:
+
+        writer = ArchiveWriter('image.tar.gz', compression='gzip')
+        stats = writer.write_from(client.get_image('nrser/qb:0.1.2'))
+    '''
+
+    def __init__(
+        self,
+        path,
+        compression=None,
+        buffer_size=DEFAULT_BUFFER_SIZE,
+        compresslevel=6,
+        checksum=True,
+    ):
+        if compression not in (None, 'none') and \
+                compression not in COMPRESSIONS:
+            raise ValueError(
+                "Unknown compression {!r}, expected one of {}".format(
+                    compression,
+                    ', '.join(sorted(COMPRESSIONS)),
+                )
+            )
+
+        if compression == 'xz' and lzma is None:
+            raise ValueError(
+                "xz compression needs the `lzma` module " +
+                "(`backports.lzma` on Python 2)"
+            )
+
+        self.path = path
+        self.compression = None if compression == 'none' else compression
+        self.buffer_size = buffer_size
+        self.compresslevel = compresslevel
+        self.checksum = checksum
+
+
+    @property
+    def sidecar_path(self):
+        return self.path + SIDECAR_EXTENSION
+
+
+    def open_compressor(self, file):
+        if self.compression == 'gzip':
+            return gzip.GzipFile(
+                filename = '',
+                mode = 'wb',
+                compresslevel = self.compresslevel,
+                fileobj = file,
+            )
+        if self.compression == 'xz':
+            return lzma.LZMAFile(file, mode='wb', preset=self.compresslevel)
+        return None
+
+
+    def chunks(self, source):
+        '''
+        Iterate over the source in chunks of up to :attr:`buffer_size`.
+
+        Sources that can `readinto` (a raw HTTP response) are read into one
+        reused buffer; otherwise we take what `stream` (or iterating) gives
+        us.
+        '''
+        if hasattr(source, 'readinto'):
+            buffer = bytearray(self.buffer_size)
+            view = memoryview(buffer)
+            while True:
+                count = source.readinto(buffer)
+                if not count:
+                    return
+                yield view[:count]
+
+        elif hasattr(source, 'stream'):
+            for chunk in source.stream(
+                self.buffer_size,
+                decode_content = False,
+            ):
+                yield chunk
+
+        else:
+            for chunk in source:
+                yield chunk
+
+
+    def write_from(self, source, image_id=None):
+        '''
+        Write everything from `source` - a response from
+        `client.get_image`, or any iterable of byte strings.
+
+        If you give the `image_id` (and we're checksumming) it's recorded
+        with the results in the metadata sidecar (see :func:`is_current`).
+
+        :rtype:     dict
+        :return:    `path`, `compression`, `sha256` (of the file written),
+                    `sha256_path` (the sidecar) - both `None` without
+                    :attr:`checksum` - `size` (bytes written),
+                    `image_size` (bytes read), `seconds` and `mb_per_sec`
+                    (of `image_size`).
+        '''
+        part_path = self.path + '.part'
+        start = time.time()
+
+        # Whatever's there is about to not be what it describes
+        clear_metadata(self.path)
+
+        image_size = 0
+
+        try:
+            with open(part_path, 'wb') as file:
+                output = DigestFile(file, checksum=self.checksum)
+                compressor = self.open_compressor(output)
+                target = output if compressor is None else compressor
+
+                try:
+                    for chunk in self.chunks(source):
+                        image_size += len(chunk)
+                        target.write(chunk)
+                finally:
+                    if compressor is not None:
+                        compressor.close()
+
+            os.rename(part_path, self.path)
+
+        except:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+
+        seconds = time.time() - start
+        sha256 = None
+        sha256_path = None
+
+        if output.digest is not None:
+            sha256 = output.digest.hexdigest()
+            sha256_path = self.sidecar_path
+
+            with open(sha256_path, 'w') as file:
+                file.write(
+                    "{}  {}\n".format(sha256, os.path.basename(self.path))
+                )
+
+        elif os.path.exists(self.sidecar_path):
+            # Left from an earlier archive, and wrong now
+            os.remove(self.sidecar_path)
+
+        stats = dict(
+            path = self.path,
+            compression = self.compression,
+            sha256 = sha256,
+            sha256_path = sha256_path,
+            size = output.size,
+            image_size = image_size,
+            seconds = round(seconds, 3),
+            mb_per_sec = (
+                round(image_size / seconds / 1e6, 1) if seconds > 0 else None
+            ),
+        )
+
+        if image_id is not None and sha256 is not None:
+            write_metadata(
+                self.path,
+                dict(
+                    image_id = image_id,
+                    compression = self.compression,
+                    sha256 = sha256,
+                    size = output.size,
+                    image_size = image_size,
+                ),
+            )
+            stats['metadata_path'] = metadata_path(self.path)
+
+        return stats
+
+
+# testing - run the doctests
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,619 @@
+##############################################################################
+# Long-lived process that runs `qb_docker_image` for module invocations, so
+# each docker task doesn't pay for a fresh Python process importing
+# docker-py and Ansible's docker support and setting up a client.
+#
+# The QB master starts one for the run when asked to (`QB::IPC::DockerBroker`,
+# it's off by default) and tells modules where it is in the
+# {SOCKET_ENV_VAR_NAME} ENV var. The module then just {forward}s it's args:
+#
+#     POST /run   {"args": ..., "cwd": ..., "env": ...}
+#
+# and the broker runs the module (see {qb.ansible.modules.docker.image_module})
+# in a thread, and responds with what it would have written to STDOUT and
+# it's exit status, which the module writes and exits with.
+#
+# The broker keeps image inspections (see {QBAnsibleDockerClient.find_image})
+# between tasks, for as long as it's following the daemon's image events -
+# any image change, by us or anyone else, drops them.
+#
+# The broker runs modules as the master's user, with the master's Python, so
+# a module running as someone else - `become`, or a `remote_user` the
+# connection honors - runs itself, as does one whose Python, user or group
+# differs from the broker's ({identity}), which is what a `delegate_to` host
+# with it's own connection settings looks like from here. (Delegating
+# anywhere that isn't this machine never sees the socket at all.)
+#
+# Requests with different Docker ENV (a task's `environment:`) are declined,
+# and the module runs itself like it always has. Same if there's no broker,
+# or it can't be reached. Modules run in the playbook's directory, which the
+# broker moves to when it's idle; requests from somewhere else while it's
+# busy are declined too.
+##############################################################################
+
+# Imports
+# ============================================================================
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import sys
+import json
+import time
+import socket
+import threading
+
+# NOTE  Module side ({forward}) only needs this, so keep the heavy stuff -
+#       docker-py, Ansible - imported on demand in the broker side.
+from qb.ipc.rpc.client import SocketClient, RPCError
+
+
+# Constants
+# ============================================================================
+
+# Where the master's broker is listening.
+#
+SOCKET_ENV_VAR_NAME = 'QB_DOCKER_BROKER_SOCKET'
+
+# ENV vars that change what the module does (Docker connection fallbacks and
+# our own knobs) - requests are only run by the broker if they match it's
+# own.
+#
+ENV_VAR_NAMES = (
+    'DOCKER_HOST',
+    'DOCKER_API_VERSION',
+    'DOCKER_TIMEOUT',
+    'DOCKER_CERT_PATH',
+    'DOCKER_SSL_VERSION',
+    'DOCKER_TLS',
+    'DOCKER_TLS_VERIFY',
+    'DOCKER_TLS_HOSTNAME',
+    'QB_CACHE_DIR',
+    'QB_DOCKER_DAEMON_CACHE_TTL',
+)
+
+# Seconds between checks that the master's still there.
+#
+PARENT_CHECK_INTERVAL = 2.0
+
+# Seconds to wait before following the daemon's events again after losing
+# them.
+#
+EVENTS_RETRY_INTERVAL = 5.0
+
+
+# Module Side
+# ============================================================================
+
+def relevant_env(env=os.environ):
+    '''
+    >>> relevant_env({'DOCKER_HOST': 'tcp://x:2376', 'HOME': '/root'})['DOCKER_HOST']
+    'tcp://x:2376'
+    >>> relevant_env({})['DOCKER_HOST'] is None
+    True
+    '''
+    return dict((name, env.get(name)) for name in ENV_VAR_NAMES)
+
+
+def identity():
+    '''
+    Who's running, as far as running a module goes - the broker only runs
+    requests from modules with the same.
+
+    >>> identity()['uid'] == os.geteuid()
+    True
+    '''
+    return dict(
+        uid = os.geteuid(),
+        gid = os.getegid(),
+        python = os.path.realpath(sys.executable),
+    )
+
+
+def owns(path, uid=None):
+    '''
+    Does user `uid` (us, by default) own `path`? The broker owns it's
+    socket, so if we don't we're some other user - `become` and all that -
+    and need to run the module ourselves.
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile() as file:
+    ...     owns(file.name), owns(file.name, uid=os.geteuid() + 1)
+    (True, False)
+    '''
+    if uid is None:
+        uid = os.geteuid()
+
+    try:
+        return os.stat(path).st_uid == uid
+    except OSError:
+        return False
+
+
+def forward(env=os.environ):
+    '''
+    Have the broker run the module, if there is one, and write out it's
+    result.
+
+    Without a broker - or not as it's user - the module runs itself:
+
+    >>> forward({})
+    False
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'socket')
+    >>> forward({SOCKET_ENV_VAR_NAME: path})
+    False
+
+    Otherwise it's up to the broker. Here's one that declines, then runs one:
+
+    >>> from ansible.module_utils import basic
+    >>> basic._ANSIBLE_ARGS = json.dumps(
+    ...     dict(ANSIBLE_MODULE_ARGS = dict(name = 'nrser/qb'))
+    ... ).encode('utf-8')
+    >>> listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    >>> listener.bind(path)
+    >>> listener.listen(1)
+    >>> requests = []
+    >>> def respond(*responses):
+    ...     for values in responses:
+    ...         connection = listener.accept()[0]
+    ...         data = b''
+    ...         while b'\\r\\n\\r\\n' not in data:
+    ...             chunk = connection.recv(65536)
+    ...             if not chunk:
+    ...                 return
+    ...             data += chunk
+    ...         head, body = data.split(b'\\r\\n\\r\\n', 1)
+    ...         length = int(head.split(b'Content-Length: ')[1].split(b'\\r')[0])
+    ...         while len(body) < length:
+    ...             body += connection.recv(65536)
+    ...         requests.append(json.loads(body.decode('utf-8')))
+    ...         body = json.dumps(values).encode('utf-8')
+    ...         connection.sendall(
+    ...             b'HTTP/1.1 200 OK\\r\\nContent-Length: ' +
+    ...             str(len(body)).encode('ascii') + b'\\r\\n\\r\\n' + body
+    ...         )
+    ...         connection.close()
+    >>> server = threading.Thread(target = respond, args = (
+    ...     dict(handled = False, reason = "Docker ENV differs"),
+    ...     dict(handled = True, rc = 0, output = '{"changed": false}'),
+    ... ))
+    >>> server.start()
+    >>> forward({SOCKET_ENV_VAR_NAME: path})
+    False
+    >>> forward({SOCKET_ENV_VAR_NAME: path})
+    {"changed": false}True
+    >>> server.join()
+    >>> requests[0]['args'] == dict(name = 'nrser/qb')
+    True
+    >>> requests[0]['identity'] == identity()
+    True
+    >>> listener.close()
+
+    :rtype:     bool
+    :return:    `True` if the broker ran it - the module should exit (with
+                :data:`sys.exit` already raised for failures), `False` if it
+                should run itself.
+    '''
+    path = env.get(SOCKET_ENV_VAR_NAME)
+
+    if not path or not os.path.exists(path):
+        return False
+
+    # Running as someone other than the broker - it can't do that for us
+    if not owns(path):
+        return False
+
+    client = SocketClient(path)
+
+    # Connecting tells us if the broker's there. After that, a fresh socket
+    # never has it's request resent (see {SocketClient.request}) - we don't
+    # want the broker building and pushing twice.
+    try:
+        client.connect()
+    except socket.error:
+        return False
+
+    from ansible.module_utils.basic import _load_params
+
+    try:
+        response = client.post_values(
+            '/run',
+            args = _load_params(),
+            cwd = os.getcwd(),
+            env = relevant_env(env),
+            identity = identity(),
+        )
+    except (socket.error, EOFError, ValueError, RPCError) as error:
+        # It may have done some (or all) of the work, so don't do it again
+        response = dict(
+            handled = True,
+            rc = 1,
+            output = json.dumps(dict(
+                failed = True,
+                msg = "Lost the Docker broker at {} - {}".format(path, error),
+            )),
+        )
+    finally:
+        client.close()
+
+    if not response.get('handled'):
+        return False
+
+    sys.stdout.write(response['output'])
+    sys.stdout.flush()
+
+    if response['rc']:
+        sys.exit(response['rc'])
+
+    return True
+
+
+# Broker Side
+# ============================================================================
+
+class ThreadOutput:
+    '''
+    Stands in for `sys.stdout` in the broker: threads running a module (see
+    :meth:`capture`) write to their own buffer, which is how we get the
+    module's result - everything else goes to the real stream.
+    '''
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+
+    def capture(self):
+        self.local.chunks = []
+
+
+    def captured(self):
+        chunks = getattr(self.local, 'chunks', None)
+        self.local.chunks = None
+        return ''.join(chunks or [])
+
+
+    def write(self, data):
+        chunks = getattr(self.local, 'chunks', None)
+        if chunks is None:
+            self.stream.write(data)
+        else:
+            chunks.append(data)
+
+
+    def flush(self):
+        if getattr(self.local, 'chunks', None) is None:
+            self.stream.flush()
+
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class SharedInspections:
+    '''
+    Image inspections kept between requests for one daemon, good for as long
+    as we're following it's image events (see :meth:`watch`).
+    '''
+
+    def __init__(self, connect_params):
+        self.connect_params = connect_params
+        self.inspections = {}
+        self.lock = threading.Lock()
+        self.counts = dict(hits=0, misses=0, invalidations=0)
+        self.watching = False
+
+        thread = threading.Thread(
+            target = self.watch,
+            name = 'qb_docker_broker:events',
+        )
+        thread.daemon = True
+        thread.start()
+
+
+    def invalidate(self):
+        with self.lock:
+            self.inspections.clear()
+            self.counts['invalidations'] += 1
+
+
+    def attach(self, client):
+        '''
+        Have `client` use the shared inspections, if we can vouch for them.
+        '''
+        if self.watching:
+            client.inspections = self.inspections
+            client.inspections_lock = self.lock
+            client.inspection_counts = self.counts
+
+
+    def watch(self):
+        import docker
+
+        while True:
+            try:
+                api = docker.APIClient(**self.connect_params)
+                events = api.events(
+                    decode = True,
+                    filters = dict(type = 'image'),
+                )
+                # We're subscribed once `events` returns
+                self.watching = True
+
+                for _ in events:
+                    self.invalidate()
+
+            except Exception:
+                pass
+
+            self.watching = False
+            self.invalidate()
+            time.sleep(EVENTS_RETRY_INTERVAL)
+
+
+class Broker:
+    '''
+    The broker server - see the top of the file.
+    '''
+
+    def __init__(self, socket_path):
+        # Loading these is the whole point - do it once, up front, and find
+        # out now if we can't
+        from ansible.module_utils import basic
+        from qb.ansible.modules.docker import image_module
+
+        self.basic = basic
+        self.image_module = image_module
+        self.socket_path = socket_path
+        self.started_at = time.time()
+        self.counts = dict(requests=0, declined=0)
+        self.env = relevant_env()
+        self.identity = identity()
+
+        # The working directory is process-wide, so only move when there's
+        # nothing running - see {enter}
+        self.cwd = os.getcwd()
+        self.active = 0
+        self.cwd_lock = threading.Lock()
+
+        # Constructing a client reads the args from a global, so one at a
+        # time
+        self.construct_lock = threading.Lock()
+
+        # {SharedInspections} by daemon URL
+        self.shared = {}
+        self.shared_lock = threading.Lock()
+
+        self.output = ThreadOutput(sys.stdout)
+        sys.stdout = self.output
+
+        self.server = None
+
+
+    def enter(self, payload):
+        '''
+        Start handling a request, if we can.
+
+        :rtype:     str or `None`
+        :return:    Why not, if we can't.
+        '''
+        if payload.get('identity') != self.identity:
+            return "user, group or Python differs"
+
+        if payload.get('env') != self.env:
+            return "Docker ENV differs"
+
+        with self.cwd_lock:
+            if payload['cwd'] != self.cwd:
+                if self.active:
+                    return "busy in another working directory"
+                try:
+                    os.chdir(payload['cwd'])
+                except OSError as error:
+                    return "can't change directory - {}".format(error)
+                self.cwd = payload['cwd']
+            self.active += 1
+
+        return None
+
+
+    def leave(self):
+        with self.cwd_lock:
+            self.active -= 1
+
+
+    def shared_inspections(self, client):
+        key = client._connect_params.get('base_url')
+        with self.shared_lock:
+            if key not in self.shared:
+                connect_params = dict(client._connect_params)
+                connect_params['version'] = client.api_version
+                self.shared[key] = SharedInspections(connect_params)
+            return self.shared[key]
+
+
+    def run(self, payload):
+        '''
+        Run the module for a `/run` request.
+
+        :rtype:     dict
+        :return:    `handled`, and if it was, `rc` and `output` (what the
+                    module wrote to STDOUT).
+        '''
+        reason = self.enter(payload)
+        if reason is not None:
+            self.counts['declined'] += 1
+            return dict(handled = False, reason = reason)
+
+        self.counts['requests'] += 1
+        self.output.capture()
+        rc = 0
+        client = None
+
+        try:
+            with self.construct_lock:
+                self.basic._ANSIBLE_ARGS = json.dumps(
+                    dict(ANSIBLE_MODULE_ARGS = payload['args'])
+                ).encode('utf-8')
+                client = self.image_module.new_client()
+
+            self.shared_inspections(client).attach(client)
+            self.image_module.run(client)
+
+        except SystemExit as exit:
+            rc = exit.code or 0
+
+        except Exception as error:
+            import traceback
+            rc = 1
+            print(json.dumps(dict(
+                failed = True,
+                msg = "Docker broker error - {}".format(error),
+                exception = traceback.format_exc(),
+            )))
+
+        finally:
+            # A module would have sent everything on it's way out - do it now,
+            # so the task's output gets to the master before it's result
+            import qb.ipc.stdio
+            qb.ipc.stdio.client.flush()
+
+            # The client is the module's - args, results, it's own connection
+            # pool - so it can't be shared with the next request, but it's
+            # sockets shouldn't outlive this one
+            if client is not None:
+                client.close()
+
+            self.leave()
+
+        return dict(
+            handled = True,
+            rc = rc,
+            output = self.output.captured(),
+        )
+
+
+    def status(self):
+        return dict(
+            pid = os.getpid(),
+            started_at = self.started_at,
+            watching = dict(
+                (key, shared.watching) for key, shared in self.shared.items()
+            ),
+            inspections = dict(
+                (key, shared.counts) for key, shared in self.shared.items()
+            ),
+            **self.counts
+        )
+
+
+    def serve(self):
+        try:
+            import SocketServer as socketserver
+            import BaseHTTPServer as http_server
+        except ImportError:
+            import socketserver
+            import http.server as http_server
+
+        broker = self
+
+        class Handler(http_server.BaseHTTPRequestHandler):
+
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                if self.path == '/status':
+                    self.respond(200, dict(data = broker.status()))
+                else:
+                    self.respond(404, dict(message = 'Not found'))
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length).decode('utf-8'))
+
+                if self.path == '/run':
+                    self.respond(200, broker.run(payload))
+                else:
+                    self.respond(404, dict(message = 'Not found'))
+
+            def respond(self, code, values):
+                body = json.dumps(values).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+            daemon_threads = True
+
+            def get_request(self):
+                request, _ = self.socket.accept()
+                # BaseHTTPRequestHandler wants a client address to log
+                return request, ('local', 0)
+
+        self.server = Server(self.socket_path, Handler)
+        self.server.serve_forever()
+
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+
+
+def watch_parent(broker, parent_pid):
+    '''
+    Shut `broker` down if the master goes away without stopping it.
+    '''
+    while os.getppid() == parent_pid:
+        time.sleep(PARENT_CHECK_INTERVAL)
+    broker.shutdown()
+
+
+def main(argv=sys.argv[1:]):
+    import signal
+    import argparse
+
+    import qb.ipc.stdio
+
+    parser = argparse.ArgumentParser(
+        description = "Run qb_docker_image for module invocations",
+    )
+    parser.add_argument('--socket', required=True, help="Path to listen on")
+    args = parser.parse_args(argv)
+
+    broker = Broker(args.socket)
+
+    # Docker output and logs go to the master, like they do from modules
+    qb.ipc.stdio.client.multiplex().buffer()
+    qb.ipc.stdio.client.connect()
+
+    signal.signal(
+        signal.SIGTERM,
+        lambda signum, frame: threading.Thread(target=broker.shutdown).start(),
+    )
+
+    parent = threading.Thread(
+        target = watch_parent,
+        args = (broker, os.getppid()),
+        name = 'qb_docker_broker:parent',
+    )
+    parent.daemon = True
+    parent.start()
+
+    try:
+        broker.serve()
+    finally:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        qb.ipc.stdio.client.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+##############################################################################
+# Hashing everything that goes into a Docker build - the context (minus what
+# `.dockerignore` leaves out), the Dockerfile, build args and the base images
+# - so {ImageManager} can tell an image built from the same inputs when it
+# sees one and skip the build.
+#
+# The hash is stored on built images as the {LABEL} label.
+##############################################################################
+
+# Imports
+# ============================================================================
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import re
+import json
+import hashlib
+
+try:
+    from docker.utils.build import exclude_paths
+except ImportError:
+    try:
+        # docker-py 1.x
+        from docker.utils.utils import exclude_paths
+    except ImportError:
+        # missing docker-py handled in docker_common
+        pass
+
+
+# Constants
+# ============================================================================
+
+# Image label the input hash is stored in.
+#
+LABEL = 'com.github.nrser.qb.build-input-hash'
+
+# Bump to invalidate every hash if what goes into them changes.
+#
+VERSION = '1'
+
+FROM_RE = re.compile(r'^\s*FROM\s+(?:--\S+\s+)*(\S+)', re.IGNORECASE)
+
+READ_SIZE = 64 * 1024
+
+
+# Functions
+# ============================================================================
+
+def dockerignore_patterns(path):
+    '''
+    Patterns from `.dockerignore` in the context directory `path`, if there
+    is one.
+
+    :rtype: list
+    '''
+    ignore_path = os.path.join(path, '.dockerignore')
+
+    if not os.path.isfile(ignore_path):
+        return []
+
+    with open(ignore_path, 'r') as file:
+        return [
+            line.strip()
+            for line in file.read().splitlines()
+            if line.strip() and not line.strip().startswith('#')
+        ]
+
+
+def context_files(path, dockerfile=None):
+    '''
+    Relative paths of the files that would be sent to the daemon for a build
+    of `path`, sorted, using the same `.dockerignore` handling as the Docker
+    client (`docker.utils.exclude_paths`).
+
+    :rtype: list
+    '''
+    return sorted(
+        relative_path
+        for relative_path in exclude_paths(
+            path,
+            dockerignore_patterns(path),
+            dockerfile = dockerfile,
+        )
+        if not os.path.isdir(os.path.join(path, relative_path))
+    )
+
+
+def base_images(dockerfile_contents):
+    '''
+    Images named in `FROM` lines, skipping earlier build stages.
+
+    >>> base_images(
+    ...     "FROM node:8 AS assets\\n"
+    ...     "RUN npm run build\\n"
+    ...     "from --platform=linux/amd64 ruby:2.5\\n"
+    ...     "COPY --from=assets /build /app\\n"
+    ...     "FROM assets\\n"
+    ... )
+    ['node:8', 'ruby:2.5']
+
+    :rtype: list
+    '''
+    images = []
+    stages = set()
+
+    for line in dockerfile_contents.splitlines():
+        match = FROM_RE.match(line)
+        if match is None:
+            continue
+
+        image = match.group(1)
+        if image.lower() not in stages:
+            images.append(image)
+
+        alias = re.search(r'\s+AS\s+(\S+)\s*$', line, re.IGNORECASE)
+        if alias is not None:
+            stages.add(alias.group(1).lower())
+
+    return images
+
+
+def input_hash(
+    path,
+    files,
+    dockerfile,
+    dockerfile_contents,
+    buildargs,
+    base_image_ids,
+):
+    '''
+    SHA-256 over the build inputs.
+
+    :param path:            Context directory.
+    :param files:           Context file paths, relative to `path` (see
+                            :func:`context_files`).
+    :param dockerfile:      Dockerfile path, relative to `path`.
+    :param dockerfile_contents:
+                            The Dockerfile itself (it doesn't have to be in
+                            the context).
+    :param buildargs:       Dict of build args (or `None`).
+    :param base_image_ids:  Dict of base image names (see :func:`base_images`)
+                            to their IDs (or `None` when they're not
+                            available locally).
+
+    :rtype: str
+    '''
+    digest = hashlib.sha256()
+
+    def update(*parts):
+        for part in parts:
+            if not isinstance(part, bytes):
+                part = part.encode('utf-8')
+            digest.update(part)
+            digest.update(b'\0')
+
+    update('qb-build-inputs', VERSION)
+    update(dockerfile_contents)
+    update(
+        json.dumps(
+            dict(
+                dockerfile = dockerfile,
+                buildargs = buildargs or {},
+                base_images = base_image_ids,
+            ),
+            sort_keys = True,
+        )
+    )
+
+    for relative_path in files:
+        full_path = os.path.join(path, relative_path)
+
+        if os.path.islink(full_path):
+            update('link', relative_path, os.readlink(full_path))
+            continue
+
+        update(
+            'file',
+            relative_path,
+            'x' if os.access(full_path, os.X_OK) else '-',
+        )
+
+        with open(full_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(READ_SIZE), b''):
+                digest.update(chunk)
+
+        digest.update(b'\0')
+
+    return digest.hexdigest()
+
+
+def image_input_hash(image):
+    '''
+    The input hash an image was labeled with, if any.
+
+    >>> image_input_hash({'Config': {'Labels': {LABEL: 'abc'}}})
+    'abc'
+    >>> image_input_hash({'Config': {'Labels': None}}) is None
+    True
+    >>> image_input_hash(None) is None
+    True
+    '''
+    if not image:
+        return None
+
+    labels = (image.get('Config') or {}).get('Labels') or {}
+    return labels.get(LABEL)
+
+
+# testing - run the doctests
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,119 @@
+##############################################################################
+# Keeping build output around for error reporting without keeping *all* of
+# it in memory: the last few lines go in a bounded ring buffer, and the whole
+# thing is spooled to a temp file that's kept if the build fails.
+##############################################################################
+
+# Imports
+# ============================================================================
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import tempfile
+from collections import deque
+
+
+# Constants
+# ============================================================================
+
+DEFAULT_MAX_LINES = 200
+
+DEFAULT_MAX_BYTES = 64 * 1024
+
+
+# Classes
+# ============================================================================
+
+class BuildLog:
+    '''
+    Build output, with only the tail - at most `max_lines` lines and
+    `max_bytes` bytes - held in memory.
+
+    >>> log = BuildLog(max_lines=2, spool=False)
+    >>> for line in ['Step 1/3\\n', 'Step 2/3\\n', 'Step 3/3\\n']:
+    ...     log.append(line)
+    >>> log.tail()
+    'Step 2/3\\nStep 3/3\\n'
+    >>> log.dropped_lines
+    1
+
+    >>> log = BuildLog(max_bytes=10, spool=False)
+    >>> for line in ['12345\\n', '67890\\n']:
+    ...     log.append(line)
+    >>> log.tail()
+    '67890\\n'
+
+    With `spool` on (the default), every line also goes to a temp file at
+    :attr:`path`, which :meth:`close` removes unless told to keep it.
+
+    >>> log = BuildLog(max_lines=1)
+    >>> log.append('a\\n'); log.append('b\\n')
+    >>> log.close(keep=True)
+    >>> open(log.path).read()
+    'a\\nb\\n'
+    >>> os.remove(log.path)
+    '''
+
+    def __init__(
+        self,
+        max_lines=DEFAULT_MAX_LINES,
+        max_bytes=DEFAULT_MAX_BYTES,
+        spool=True,
+        prefix='qb-docker-build-',
+    ):
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.lines = deque()
+        self.size = 0
+        self.dropped_lines = 0
+        self.file = None
+        self.path = None
+
+        if spool:
+            fd, self.path = tempfile.mkstemp(prefix=prefix, suffix='.log')
+            self.file = os.fdopen(fd, 'w')
+
+
+    def append(self, line):
+        if self.file is not None:
+            self.file.write(
+                line.encode('utf-8') if not isinstance(line, str) else line
+            )
+
+        self.lines.append(line)
+        self.size += len(line)
+
+        while self.lines and (
+            len(self.lines) > self.max_lines or self.size > self.max_bytes
+        ):
+            self.size -= len(self.lines.popleft())
+            self.dropped_lines += 1
+
+
+    def tail(self):
+        '''
+        :rtype:     str
+        :return:    The lines we still have, joined.
+        '''
+        return ''.join(self.lines)
+
+
+    def close(self, keep=False):
+        '''
+        Close the spool file, removing it unless `keep` is `True`.
+        '''
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+            if not keep:
+                os.remove(self.path)
+                self.path = None
+
+
+# testing - run the doctests
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
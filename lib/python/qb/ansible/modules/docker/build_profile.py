@@ -0,0 +1,217 @@
+##############################################################################
+# Timing the steps of a Docker build and noting which ones came from the
+# layer cache, from the `stream` messages the daemon sends back - the
+# `Step N/M : ...`, ` ---> Using cache` and ` ---> Running in ...` lines.
+##############################################################################
+
+# Imports
+# ============================================================================
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import re
+import time
+
+
+# Constants
+# ============================================================================
+
+# `Step 2/5 : RUN make`, or `Step 2 : RUN make` from older daemons.
+#
+STEP_RE = re.compile(r'^Step\s+(\d+)(?:/(\d+))?\s*:\s*(.*)$')
+
+USING_CACHE_RE = re.compile(r'^\s*--->\s+Using cache\s*$')
+
+RUNNING_IN_RE = re.compile(r'^\s*--->\s+Running in\s+(\S+)')
+
+# Steps whose output hasn't got a cache line either way - a `FROM` is never
+# "cached", it just is the base image.
+#
+UNCACHEABLE_INSTRUCTIONS = ('FROM',)
+
+
+# Classes
+# ============================================================================
+
+class BuildProfile:
+    '''
+    Feed it the build's log messages and it keeps the wall time of each step
+    and whether it was a cache hit.
+
+    >>> now = [0.0]
+    >>> profile = BuildProfile(clock=lambda: now[0])
+    >>> for at, stream in (
+    ...     (0.0, 'Step 1/3 : FROM alpine:3.7\\n'),
+    ...     (0.1, ' ---> 3fd9065eaf02\\n'),
+    ...     (0.1, 'Step 2/3 : COPY . /app\\n'),
+    ...     (0.2, ' ---> Using cache\\n ---> 5c4e3bd0a5f1\\n'),
+    ...     (0.2, 'Step 3/3 : RUN make'),
+    ...     (0.2, '\\n'),
+    ...     (0.3, ' ---> Running in 9b1c5e4a2d7f\\n'),
+    ...     (4.5, 'Successfully built 7d2f9e0b1a3c\\n'),
+    ... ):
+    ...     now[0] = at
+    ...     profile.feed({'stream': stream})
+    >>> summary = profile.finish()
+    >>> [
+    ...     (step['number'], step['instruction'], step['cached'],
+    ...         step['seconds'])
+    ...     for step in summary['steps']
+    ... ]
+    [(1, 'FROM alpine:3.7', None, 0.1), (2, 'COPY . /app', True, 0.1), (3, 'RUN make', False, 4.3)]
+    >>> summary['cache_hits'], summary['cache_misses'], summary['seconds']
+    (1, 1, 4.5)
+    >>> [step['number'] for step in profile.slowest(1)]
+    [3]
+    '''
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.started_at = clock()
+        self.finished_at = None
+        self.steps = []
+        # A `stream` message doesn't always end on a line break
+        self.partial = ''
+
+
+    @property
+    def current(self):
+        if self.steps and self.steps[-1]['finished_at'] is None:
+            return self.steps[-1]
+        return None
+
+
+    def feed(self, log):
+        '''
+        Take a (decoded) message from the build stream. Anything without a
+        `stream` is ignored.
+        '''
+        stream = log.get('stream') if isinstance(log, dict) else None
+
+        if not stream:
+            return
+
+        lines = (self.partial + stream).split('\n')
+        self.partial = lines.pop()
+
+        for line in lines:
+            self.feed_line(line)
+
+
+    def feed_line(self, line):
+        now = self.clock()
+        match = STEP_RE.match(line)
+
+        if match is not None:
+            self.end_step(now)
+
+            instruction = match.group(3).strip()
+
+            self.steps.append(dict(
+                number = int(match.group(1)),
+                total = int(match.group(2)) if match.group(2) else None,
+                instruction = instruction,
+                cached = (
+                    None
+                    if instruction.split(' ', 1)[0].upper()
+                        in UNCACHEABLE_INSTRUCTIONS
+                    else False
+                ),
+                container = None,
+                started_at = now,
+                finished_at = None,
+            ))
+            return
+
+        step = self.current
+
+        if step is None:
+            return
+
+        if USING_CACHE_RE.match(line):
+            step['cached'] = True
+            return
+
+        match = RUNNING_IN_RE.match(line)
+        if match is not None:
+            step['cached'] = False
+            step['container'] = match.group(1)
+
+
+    def end_step(self, now):
+        step = self.current
+        if step is not None:
+            step['finished_at'] = now
+
+
+    def finish(self):
+        '''
+        End the last step (if there's one going) and summarize.
+
+        :rtype:     dict
+        :return:    See :meth:`summary`.
+        '''
+        if self.partial:
+            self.feed_line(self.partial)
+            self.partial = ''
+
+        now = self.clock()
+        self.end_step(now)
+        self.finished_at = now
+
+        return self.summary()
+
+
+    def step_summary(self, step):
+        finished_at = step['finished_at']
+        if finished_at is None:
+            finished_at = self.clock()
+
+        return dict(
+            number = step['number'],
+            total = step['total'],
+            instruction = step['instruction'],
+            cached = step['cached'],
+            seconds = round(finished_at - step['started_at'], 3),
+        )
+
+
+    def slowest(self, count=3):
+        '''
+        The `count` slowest steps, slowest first (as in :meth:`summary`).
+
+        :rtype: list
+        '''
+        return sorted(
+            (self.step_summary(step) for step in self.steps),
+            key = lambda step: step['seconds'],
+            reverse = True,
+        )[:count]
+
+
+    def summary(self):
+        '''
+        :rtype:     dict
+        :return:    `steps` (list of dicts with the step `number`, `total`,
+                    `instruction`, `cached` - `True`, `False`, or `None` for
+                    steps that can't be, like `FROM` - and `seconds`),
+                    `cache_hits`, `cache_misses` and total `seconds`.
+        '''
+        steps = [self.step_summary(step) for step in self.steps]
+        finished_at = self.finished_at
+        if finished_at is None:
+            finished_at = self.clock()
+
+        return dict(
+            steps = steps,
+            cache_hits = sum(1 for step in steps if step['cached'] is True),
+            cache_misses = sum(1 for step in steps if step['cached'] is False),
+            seconds = round(finished_at - self.started_at, 3),
+        )
+
+
+# testing - run the doctests
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
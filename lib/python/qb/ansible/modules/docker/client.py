@@ -6,13 +6,45 @@
 from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 
+import copy
 import json
+import threading
+import types
+from contextlib import contextmanager
 
 from ansible.module_utils.docker_common import AnsibleDockerClient
 
+try:
+    from docker.errors import DockerException
+except ImportError:
+    # missing docker-py handled in docker_common
+    pass
+
 import qb.ipc.stdio
 import qb.ipc.stdio.logging
 
+from qb.ansible.modules.docker import daemon_cache
+from qb.ansible.modules.docker.progress import (
+    DEFAULT_INTERVAL,
+    ProgressAggregator,
+)
+
+
+class ModuleFailure(Exception):
+    '''
+    Raised by :meth:`QBAnsibleDockerClient.fail` inside
+    :meth:`QBAnsibleDockerClient.raise_failures` instead of exiting the module,
+    so one image out of many can fail without taking the rest down with it.
+    
+    :attr values:   The `values` passed to `fail`.
+    :attr result:   The `result` passed to `fail`.
+    '''
+    
+    def __init__(self, msg, values=None, result=None):
+        Exception.__init__(self, msg)
+        self.values = values or {}
+        self.result = result or {}
+
 
 class QBAnsibleDockerClient(AnsibleDockerClient):
     
@@ -21,11 +53,122 @@ class QBAnsibleDockerClient(AnsibleDockerClient):
     
     def __init__(self, *args, **kwds):
         self.logger = qb.ipc.stdio.logging.getLogger(
-            'qb.ansible.modules.docker.client.QBAnsibleDockerClient'
+            'qb.ansible.modules.docker.client.QBAnsibleDockerClient',
+            queued = True,
         )
         
+        # Per-thread state, so worker threads managing different images can
+        # share the client (see :meth:`raise_failures`)
+        self.local = threading.local()
+        
+        # Image inspection cache - see {find_image}
+        self.inspections = {}
+        self.inspections_lock = threading.Lock()
+        self.inspection_counts = dict(hits=0, misses=0, invalidations=0)
+        
+        # What we know about the daemon - see {_get_connect_params}
+        self.daemon = None
+        self.daemon_cache_status = None
+        # `/version` response from negotiating - see
+        # {_retrieve_server_version}
+        self.daemon_info = None
+        
         AnsibleDockerClient.__init__(self, *args, **kwds)
         
+        if self.daemon_cache_status == 'miss':
+            self.cache_daemon()
+        
+        self.logger.debug(
+            "Docker daemon cache {status}",
+            payload = dict(
+                status = self.daemon_cache_status,
+                base_url = self._connect_params.get('base_url'),
+                api_version = self.api_version,
+            ),
+        )
+        
+        # Seconds between pull / push progress lines (see {progress})
+        self.progress_interval = self.module.params.get('progress_interval')
+        if self.progress_interval is None:
+            self.progress_interval = DEFAULT_INTERVAL
+        
+    
+    def _get_connect_params(self):
+        '''
+        Overrides :meth:`AnsibleDockerClient._get_connect_params` to use the
+        API version cached from last time we connected to the daemon (see
+        :mod:`qb.ansible.modules.docker.daemon_cache`) instead of having
+        docker-py negotiate it with a `/version` round trip.
+        
+        Only applies when the API version is `auto` - an explicit version is
+        used as given.
+        '''
+        params = AnsibleDockerClient._get_connect_params(self)
+        
+        version = params.get('version')
+        
+        if version is not None and str(version).lower() != 'auto':
+            self.daemon_cache_status = 'off'
+            return params
+        
+        if not daemon_cache.enabled():
+            self.daemon_cache_status = 'off'
+            return params
+        
+        self.daemon = daemon_cache.load(params.get('base_url'))
+        
+        if self.daemon is None:
+            self.daemon_cache_status = 'miss'
+        else:
+            self.daemon_cache_status = 'hit'
+            params['version'] = self.daemon['api_version']
+        
+        return params
+    
+    
+    def _retrieve_server_version(self):
+        '''
+        Overrides docker-py's API version negotiation to hang on to the whole
+        `/version` response, so :meth:`cache_daemon` doesn't need to ask for
+        it again.
+        '''
+        try:
+            self.daemon_info = self.version(api_version=False)
+        except Exception as error:
+            raise DockerException(
+                'Error while fetching server API version: {0}'.format(error)
+            )
+        
+        if 'ApiVersion' not in self.daemon_info:
+            raise DockerException(
+                'Invalid response from docker daemon: key "ApiVersion"'
+                ' is missing.'
+            )
+        
+        return self.daemon_info['ApiVersion']
+    
+    
+    def cache_daemon(self):
+        '''
+        Write the negotiated API version and daemon `/version` info to the
+        daemon cache. Failing to get the info just means there's nothing
+        cached for next time.
+        '''
+        base_url = self._connect_params.get('base_url')
+        
+        try:
+            # Only not there if docker-py didn't negotiate
+            info = self.daemon_info or self.version(api_version=False)
+        except Exception as error:
+            self.logger.debug(
+                "Failed to get daemon version info - {error}",
+                payload = dict(error = str(error), base_url = base_url),
+            )
+            return
+        
+        self.daemon = dict(api_version = self.api_version, info = info)
+        daemon_cache.dump(base_url, self.api_version, info)
+    
     
     # Instance Methods
     # ============================================================================
@@ -33,7 +176,7 @@ class QBAnsibleDockerClient(AnsibleDockerClient):
     # Logging and Output
     # ----------------------------------------------------------------------------
     
-    def out(self, msg):
+    def out(self, msg, label=None):
         '''
         Write output from the Docker daemon to STDOUT for the user to see
         what's going on.
@@ -46,6 +189,13 @@ class QBAnsibleDockerClient(AnsibleDockerClient):
         `QB::IPC::STDOUT`, assuming that's present.
         
         :param msg  - A string or dict.
+        Layer progress from pulls and pushes in a :meth:`progress` block is
+        handed to it's :class:`ProgressAggregator` instead of being written
+        line-by-line.
+        
+        :param label:   Optional label (image name) to prefix each line with,
+                        so output from concurrent operations can be told
+                        apart. Defaults to the :meth:`labeled` label.
         
         :return:    None
         '''
@@ -54,6 +204,13 @@ class QBAnsibleDockerClient(AnsibleDockerClient):
         if not qb.ipc.stdio.client.stdout.connected:
             return None
         
+        if label is None:
+            label = getattr(self.local, 'label', None)
+        
+        aggregator = getattr(self.local, 'progress', None)
+        if aggregator is not None and aggregator.feed(msg):
+            return None
+        
         # What we're gonna write
         string = None
         
@@ -97,6 +254,11 @@ class QBAnsibleDockerClient(AnsibleDockerClient):
             )
         
         if string is not None:
+            if label is not None:
+                string = ''.join(
+                    "[{}] {}".format(label, line)
+                    for line in string.splitlines(True)
+                )
             qb.ipc.stdio.client.stdout.println(string)
     
     
@@ -126,7 +288,7 @@ class QBAnsibleDockerClient(AnsibleDockerClient):
             )
     
     
-    def fail(self, msg, **values):
+    def fail(self, msg, result=None, **values):
         '''
         Overrides :class:`AnsibleDockerClient.fail` to log the failure first
         (as `critical`/`fatal`).
@@ -136,19 +298,255 @@ class QBAnsibleDockerClient(AnsibleDockerClient):
         
         :param msg:     String message, which may have `{key}` template markers
                         in it to be subsititued from `values`.
+        :param result:  Optional dict of keys to return in the failure result
+                        (along with `msg`).
         :param values:  Optional dict of values to interpolate and log.
         
         :return:        See :class:`AnsibleDockerClient.fail`
+        :raises:        :class:`ModuleFailure` when called in
+                        :meth:`raise_failures`.
         '''
         
         self.logger.critical(msg, payload=values)
         
-        return super(QBAnsibleDockerClient, self).fail(msg)
+        if values:
+            msg = msg.format(**values)
+        
+        if getattr(self.local, 'raise_failures', False):
+            raise ModuleFailure(msg, values, result)
+        
+        return self.module.fail_json(msg=msg, **(result or {}))
+    
+    
+    @contextmanager
+    def labeled(self, label):
+        '''
+        Context manager that makes `label` the default for :meth:`out` in the
+        current thread.
+        '''
+        previous = getattr(self.local, 'label', None)
+        self.local.label = label
+        try:
+            yield
+        finally:
+            self.local.label = previous
+    
+    
+    @contextmanager
+    def progress(self, title, label=None):
+        '''
+        Context manager that coalesces layer progress written through
+        :meth:`out` in the current thread into a status line every
+        :attr:`progress_interval` seconds, and writes a summary of each
+        layer's size and time at the end.
+        
+        Everything else written through :meth:`out` goes straight through.
+        
+        :param title:   Start of the status lines, like
+                        `Pulling nrser/qb:0.1.2`.
+        
+        :rtype:     :class:`ProgressAggregator`
+        '''
+        aggregator = ProgressAggregator(
+            title,
+            lambda string: self.out(string, label=label),
+            interval = self.progress_interval,
+        )
+        
+        previous = getattr(self.local, 'progress', None)
+        self.local.progress = aggregator
+        
+        try:
+            yield aggregator
+        finally:
+            self.local.progress = previous
+            aggregator.finish()
+            
+            if aggregator.layers:
+                self.logger.debug(
+                    "{title} layer summary",
+                    payload = dict(title=title, **aggregator.summary()),
+                )
+    
+    
+    @contextmanager
+    def raise_failures(self):
+        '''
+        Context manager that has :meth:`fail` raise :class:`ModuleFailure`
+        instead of exiting the module, for the current thread only.
+        
+        Exiting from a worker thread would just end that thread (after writing
+        the module's result JSON from it), so workers run in this and report
+        failures back themselves.
+        '''
+        previous = getattr(self.local, 'raise_failures', False)
+        self.local.raise_failures = True
+        try:
+            yield
+        finally:
+            self.local.raise_failures = previous
+    
+    
+    # Image Inspection Cache
+    # ------------------------------------------------------------------------
+    # 
+    # {ImageManager} looks up the same image over and over (before and after
+    # building, archiving, tagging, pushing...), and each lookup is a list and
+    # an inspect request to the daemon. Results are cached here by `repo:tag`
+    # (and image ID), and the whole cache is dropped whenever this client
+    # does something that could change what's in the daemon - tags move
+    # between images, so there's no point being clever about it.
+    # 
+    # Changes made by anything else during the run won't be seen, but that
+    # was never something the module could count on.
+    # 
+    # With `images` worker threads sharing the client, the cache can be
+    # dropped while another thread's inspect is in flight - that result may
+    # be from before the change, so it isn't stored.
+    # 
+    # Under the Docker broker ({qb.ansible.modules.docker.broker}) the cache
+    # is shared between tasks and also dropped on every image event from the
+    # daemon.
+    # 
+    
+    def find_image(self, name, tag):
+        '''
+        Cached :meth:`AnsibleDockerClient.find_image`. Not finding the image
+        is cached too.
+        
+        :return:    Copy of the inspection dict, or `None`.
+        '''
+        return self.cached_inspection(
+            ('name', "{}:{}".format(name, tag)),
+            lambda: AnsibleDockerClient.find_image(self, name, tag),
+        )
+    
+    
+    def find_image_by_id(self, image_id):
+        '''
+        Cached :meth:`AnsibleDockerClient.find_image_by_id` (when the Ansible
+        version has it).
+        '''
+        return self.cached_inspection(
+            ('id', image_id),
+            lambda: AnsibleDockerClient.find_image_by_id(self, image_id),
+        )
+    
+    
+    def cached_inspection(self, key, inspect):
+        with self.inspections_lock:
+            if key in self.inspections:
+                self.inspection_counts['hits'] += 1
+                return copy.deepcopy(self.inspections[key])
+            self.inspection_counts['misses'] += 1
+            invalidations = self.inspection_counts['invalidations']
+        
+        image = inspect()
+        
+        with self.inspections_lock:
+            if self.inspection_counts['invalidations'] == invalidations:
+                self.inspections[key] = copy.deepcopy(image)
+                if image is not None and image.get('Id'):
+                    self.inspections[('id', image['Id'])] = \
+                        copy.deepcopy(image)
+        
+        return image
+    
+    
+    def invalidate_inspections(self):
+        with self.inspections_lock:
+            self.inspections.clear()
+            self.inspection_counts['invalidations'] += 1
+    
+    
+    def invalidating(self, result):
+        '''
+        Drop the inspection cache again once `result` is done with - when
+        it's a generator (streamed daemon output) that's when it's been
+        consumed, otherwise it's now.
+        '''
+        if not isinstance(result, types.GeneratorType):
+            self.invalidate_inspections()
+            return result
+        
+        def stream():
+            try:
+                for item in result:
+                    yield item
+            finally:
+                self.invalidate_inspections()
+        
+        return stream()
+    
+    
+    # Mutating daemon calls, which all drop the cache before and after
+    
+    def build(self, *args, **kwds):
+        self.invalidate_inspections()
+        return self.invalidating(
+            AnsibleDockerClient.build(self, *args, **kwds)
+        )
+    
+    
+    def load_image(self, *args, **kwds):
+        self.invalidate_inspections()
+        return self.invalidating(
+            AnsibleDockerClient.load_image(self, *args, **kwds)
+        )
+    
+    
+    def tag(self, *args, **kwds):
+        self.invalidate_inspections()
+        return self.invalidating(AnsibleDockerClient.tag(self, *args, **kwds))
+    
+    
+    def pull(self, *args, **kwds):
+        self.invalidate_inspections()
+        return self.invalidating(
+            AnsibleDockerClient.pull(self, *args, **kwds)
+        )
+    
+    
+    def push(self, *args, **kwds):
+        # Pushing adds the registry's digest to the image's `RepoDigests`
+        self.invalidate_inspections()
+        return self.invalidating(
+            AnsibleDockerClient.push(self, *args, **kwds)
+        )
+    
+    
+    def remove_image(self, *args, **kwds):
+        self.invalidate_inspections()
+        return self.invalidating(
+            AnsibleDockerClient.remove_image(self, *args, **kwds)
+        )
+    
+    
+    def inspection_cache_stats(self):
+        '''
+        :rtype:     dict
+        :return:    Image inspection cache stats - `hits`, `misses`,
+                    `invalidations` and current `size`.
+        '''
+        with self.inspections_lock:
+            return dict(
+                size = len(self.inspections),
+                **self.inspection_counts
+            )
     
     
     # Actions
     # ------------------------------------------------------------------------
 
+    def pull_image(self, name, tag="latest"):
+        '''
+        :meth:`AnsibleDockerClient.pull_image`, with it's progress coalesced
+        (see :meth:`progress`).
+        '''
+        with self.progress("Pulling {}:{}".format(name, tag)):
+            return AnsibleDockerClient.pull_image(self, name, tag=tag)
+    
+    
     def try_pull_image(self, name, tag="latest"):
         '''
         Try to pull an image (before building or loading)
@@ -159,14 +557,15 @@ class QBAnsibleDockerClient(AnsibleDockerClient):
         )
         
         try:
-            for line in self.pull(name, tag=tag, stream=True, decode=True):
-                self.out(line)
-                
-                if line.get('error'):
-                    self.logger.info(
-                        "Attempt to pull {}:{} failed".format(name, tag)
-                    )
-                    return None
+            with self.progress("Pulling {}:{}".format(name, tag)):
+                for line in self.pull(name, tag=tag, stream=True, decode=True):
+                    self.out(line)
+                    
+                    if line.get('error'):
+                        self.logger.info(
+                            "Attempt to pull {}:{} failed".format(name, tag)
+                        )
+                        return None
                     
         except Exception as exc:
             self.logger.warning(
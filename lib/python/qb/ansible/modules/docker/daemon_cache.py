@@ -0,0 +1,161 @@
+##############################################################################
+# On-disk cache of what we learn about a Docker daemon when connecting - the
+# API version docker-py negotiates (`api_version: auto` costs a `/version`
+# round trip every time a client is made) and the rest of `/version` - so
+# module runs after the first can skip the negotiation.
+#
+# Entries are keyed by the daemon's URL (see {qb.cache}) and hold when the
+# daemon started, as far as we can tell without asking it: for local
+# `unix://` daemons that's when the socket was created, which changes every
+# time the daemon (re)starts, so upgrades are picked up. Daemons we can't
+# stat (TCP) are re-negotiated after {DEFAULT_TTL} seconds (or
+# `QB_DOCKER_DAEMON_CACHE_TTL`).
+##############################################################################
+
+# Imports
+# ============================================================================
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import time
+
+from qb import cache
+
+
+# Constants
+# ============================================================================
+
+NAMESPACE = 'docker_daemon'
+
+# Seconds entries for daemons without a start time are good for. Set the ENV
+# var to `0` to turn the cache off entirely.
+#
+TTL_ENV_VAR_NAME = 'QB_DOCKER_DAEMON_CACHE_TTL'
+
+DEFAULT_TTL = 60 * 60
+
+UNIX_SCHEMES = ('unix://', 'http+unix://')
+
+
+# Functions
+# ============================================================================
+
+def ttl(env=os.environ):
+    '''
+    >>> ttl({})
+    3600
+    >>> ttl({'QB_DOCKER_DAEMON_CACHE_TTL': '0'})
+    0
+    '''
+    try:
+        return int(env.get(TTL_ENV_VAR_NAME, DEFAULT_TTL))
+    except ValueError:
+        return DEFAULT_TTL
+
+
+def enabled(env=os.environ):
+    return ttl(env) > 0
+
+
+def socket_path(base_url):
+    '''
+    The socket path of a local daemon URL, if that's what it is.
+
+    >>> socket_path('unix://var/run/docker.sock')
+    '/var/run/docker.sock'
+    >>> socket_path('unix:///var/run/docker.sock')
+    '/var/run/docker.sock'
+    >>> socket_path('tcp://127.0.0.1:2376') is None
+    True
+    '''
+    if not base_url:
+        return None
+
+    for scheme in UNIX_SCHEMES:
+        if base_url.startswith(scheme):
+            return '/' + base_url[len(scheme):].lstrip('/')
+
+    return None
+
+
+def daemon_started_at(base_url):
+    '''
+    When the daemon at `base_url` started, or `None` if we can't tell (it's
+    not local, or the socket isn't there).
+
+    :rtype:     float or `None`
+    '''
+    path = socket_path(base_url)
+
+    if path is None:
+        return None
+
+    try:
+        return os.stat(path).st_ctime
+    except OSError:
+        return None
+
+
+def load(base_url, now=None):
+    '''
+    The cached entry for the daemon at `base_url`, if there is one and it's
+    still good.
+
+    :rtype:     dict or `None`
+    :return:    With `api_version` and `info` (the `/version` response).
+    '''
+    if not enabled():
+        return None
+
+    entry = cache.load(NAMESPACE, base_url)
+
+    if not isinstance(entry, dict) or not entry.get('api_version'):
+        return None
+
+    started_at = daemon_started_at(base_url)
+
+    if started_at is not None:
+        return entry if entry.get('started_at') == started_at else None
+
+    if now is None:
+        now = time.time()
+
+    if now - (entry.get('cached_at') or 0) >= ttl():
+        return None
+
+    return entry
+
+
+def dump(base_url, api_version, info=None):
+    '''
+    Cache what we found out connecting to the daemon at `base_url`.
+
+    :rtype:     bool
+    :return:    `False` if the cache is off or we couldn't write it.
+    '''
+    if not enabled():
+        return False
+
+    return cache.dump(
+        NAMESPACE,
+        base_url,
+        dict(
+            base_url = base_url,
+            api_version = api_version,
+            info = info,
+            started_at = daemon_started_at(base_url),
+            cached_at = time.time(),
+        ),
+    )
+
+
+def clear(base_url):
+    return cache.clear(NAMESPACE, base_url)
+
+
+# testing - run the doctests
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -14,8 +14,16 @@ import os
 import re
 import json
 import logging
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 
 from ansible.module_utils.docker_common import (
+    DOCKER_COMMON_ARGS,
     HAS_DOCKER_PY_2,
     AnsibleDockerClient,
     DockerBaseClass
@@ -37,11 +45,39 @@ except ImportError:
 import qb.ipc.stdio
 import qb.ipc.stdio.logging
 
+from qb.ansible.modules.docker.client import ModuleFailure
+from qb.ansible.modules.docker import build_inputs
+from qb.ansible.modules.docker import archive
+from qb.ansible.modules.docker import prefetch
+from qb.ansible.modules.docker import prune
+from qb.ansible.modules.docker.archive import ArchiveWriter
+from qb.ansible.modules.docker.build_profile import BuildProfile
+from qb.ansible.modules.docker.build_log import (
+    BuildLog,
+    DEFAULT_MAX_BYTES,
+    DEFAULT_MAX_LINES,
+)
+
 
 # Globals
 # ============================================================================
 
-logger = qb.ipc.stdio.logging.getLogger('qb_docker_image')
+logger = qb.ipc.stdio.logging.getLogger('qb_docker_image', queued=True)
+
+# How many images {manage_images} works on at once, unless the module gets a
+# `max_workers` parameter.
+DEFAULT_MAX_WORKERS = 4
+
+# How many `repository` pushes go at once, unless the module gets a
+# `push_concurrency` parameter.
+DEFAULT_PUSH_CONCURRENCY = 4
+
+# States an `images` entry can have - the rest (`prune`, `prefetch`,
+# `prefetched`) are about the whole run, not an image.
+ENTRY_STATES = ('absent', 'present', 'build')
+
+# Names for Docker Hub that the daemon leaves out of `RepoTags`.
+DOCKER_HUB_REGISTRIES = ('docker.io', 'index.docker.io', 'registry-1.docker.io')
 
 
 # Casses
@@ -56,16 +92,33 @@ class ImageManager(DockerBaseClass):
     # Construction
     # ========================================================================
 
-    def __init__(self, client, results):
+    def __init__(self, client, results, parameters=None, label=None):
+        '''
+        Manage an image, running the requested state right away.
+        
+        :param client:      :class:`QBAnsibleDockerClient`.
+        :param results:     Dict to record results in (see :func:`new_results`).
+        :param parameters:  Module parameters to use instead of the client's,
+                            for one of several `images` (see
+                            :func:`manage_images`).
+        :param label:       When given, prefixed to output lines and added to
+                            the logger name, so output from concurrent
+                            managers can be told apart.
+        '''
 
         super(ImageManager, self).__init__()
 
         self.client = client
         self.results = results
-        parameters = self.client.module.params
+        self.label = label
+        
+        if parameters is None:
+            parameters = self.client.module.params
         self.check_mode = self.client.check_mode
 
         self.archive_path = parameters.get('archive_path')
+        self.archive_compression = parameters.get('archive_compression')
+        self.archive_checksum = parameters.get('archive_checksum', True)
         self.container_limits = parameters.get('container_limits')
         self.dockerfile = parameters.get('dockerfile')
         self.force = parameters.get('force')
@@ -75,19 +128,42 @@ class ImageManager(DockerBaseClass):
         self.path = parameters.get('path')
         self.pull = parameters.get('pull')
         self.repository = parameters.get('repository')
+        # `repository` can be a list, to tag into (and push to) many
+        if isinstance(self.repository, (list, tuple)):
+            self.repositories = list(self.repository)
+        elif self.repository:
+            self.repositories = [self.repository]
+        else:
+            self.repositories = []
+        self.push_concurrency = (
+            parameters.get('push_concurrency') or DEFAULT_PUSH_CONCURRENCY
+        )
+        self.result_detail = parameters.get('result_detail') or 'full'
         self.rm = parameters.get('rm')
         self.state = parameters.get('state')
         self.tag = parameters.get('tag')
         self.http_timeout = parameters.get('http_timeout')
         self.push = parameters.get('push')
         self.buildargs = parameters.get('buildargs')
+        self.build_log_lines = (
+            parameters.get('build_log_lines') or DEFAULT_MAX_LINES
+        )
+        self.build_log_bytes = (
+            parameters.get('build_log_bytes') or DEFAULT_MAX_BYTES
+        )
         
         # QB additions
         self.try_to_pull = parameters.get('try_to_pull')
+        self.incremental = parameters.get('incremental')
         
-        self.logger = qb.ipc.stdio.logging.getLogger(
-            'qb_docker_image:ImageManager',
-        )
+        # Set by {build_input_hash} when we're building incrementally
+        self.input_hash = None
+        
+        logger_name = 'qb_docker_image:ImageManager'
+        if label is not None:
+            logger_name = "{}[{}]".format(logger_name, label)
+        
+        self.logger = qb.ipc.stdio.logging.getLogger(logger_name, queued=True)
 
         # If name contains a tag, it takes precedence over tag parameter.
         repo, repo_tag = parse_repository_tag(self.name)
@@ -100,6 +176,11 @@ class ImageManager(DockerBaseClass):
         elif self.state == 'absent':
             self.absent()
         
+        # Full inspections are big, and Ansible has to ship them around (and
+        # template any registered vars with them in on every task)
+        if self.result_detail == 'summary' and self.results['image']:
+            self.results['image'] = self.compact_image(self.results['image'])
+        
     # END __init__
     
     
@@ -120,7 +201,7 @@ class ImageManager(DockerBaseClass):
         
         :return:    None
         '''
-        self.client.out(msg)
+        self.client.out(msg, label=self.label)
         
     
     def warn(self, warning, **values):
@@ -133,11 +214,11 @@ class ImageManager(DockerBaseClass):
         self.logger.warning(warning, payload=values)
     
     
-    def fail(self, msg, **values):
+    def fail(self, msg, result=None, **values):
         '''
         Proxy to :attr:`client.fail`.
         '''
-        self.client.fail(msg, **values)
+        self.client.fail(msg, result=result, **values)
     
     
     def append_action(self, msg, **values):
@@ -163,6 +244,33 @@ class ImageManager(DockerBaseClass):
         )
     
     
+    def compact_image(self, image):
+        '''
+        What `result_detail: summary` returns for an image: the
+        :meth:`image_summary` fields, digests and size, and what we add to
+        inspections (`push_status`, `state`).
+        
+        :rtype: dict
+        '''
+        if 'Id' not in image:
+            return image
+        
+        compact = dict(
+            Id          = image['Id'],
+            RepoTags    = image.get('RepoTags'),
+            RepoDigests = image.get('RepoDigests'),
+            Created     = image.get('Created'),
+            Metadata    = image.get('Metadata'),
+            Size        = image.get('Size'),
+        )
+        
+        for key in ('push_status', 'state'):
+            if key in image:
+                compact[key] = image[key]
+        
+        return compact
+    
+    
     # States
     # ------------------------------------------------------------------------
 
@@ -198,10 +306,31 @@ class ImageManager(DockerBaseClass):
         built_image = None
         loaded_image = None
         
-        if not existing_image or self.force:
+        # Building incrementally takes care of trying to pull itself, since
+        # it only wants images built from the same inputs
+        incremental_build = bool(self.incremental and self.path)
+        reused_image = None
+        
+        if incremental_build and (not existing_image or self.force):
+            reused_image, source = self.reuse_build(existing_image)
+            
+            if source == 'pulled':
+                pulled_image = reused_image
+            elif reused_image is not None:
+                # Same as if we built it, as far as pushing goes
+                built_image = reused_image
+            
+            if reused_image is not None:
+                self.results['image'] = reused_image
+        
+        if reused_image is None and (not existing_image or self.force):
             # Try to pull if we're not forcing (which means we want to
             # re-build/load regardless) and `self.try_to_pull` is `True`
-            if not self.force and self.try_to_pull:
+            if (
+                not self.force and
+                self.try_to_pull and
+                not incremental_build
+            ):
                 self.append_action(
                     'Tried to pull image `{name}:{tag}`',
                     name    = self.name,
@@ -274,17 +403,71 @@ class ImageManager(DockerBaseClass):
                     if self.tag:
                         image_name = "%s:%s" % (self.name, self.tag)
                     
-                    self.append_action(
-                        "Loaded image `{image_name}` from `{load_path}`",
-                        image_name  = image_name,
-                        load_path   = self.load_path,
-                    )
+                    # If the archive's sidecar says which image it is and
+                    # we have it, there's nothing to load
+                    archived_image = self.find_archived_image()
                     
-                    self.results['changed'] = True
+                    if archived_image is None:
+                        self.append_action(
+                            "Loaded image `{image_name}` from `{load_path}`",
+                            image_name  = image_name,
+                            load_path   = self.load_path,
+                        )
+                        
+                        self.results['changed'] = True
+                        
+                        if not self.check_mode:
+                            loaded_image = self.load_image()
+                            self.results['image'] = loaded_image
                     
-                    if not self.check_mode:
-                        loaded_image = self.load_image()
-                        self.results['image'] = loaded_image
+                    elif (
+                        existing_image and
+                        existing_image['Id'] == archived_image['Id']
+                    ):
+                        self.logger.info(
+                            "Image `{image_name}` is already `{image_id}` " +
+                            "from `{load_path}`, not loading",
+                            payload = dict(
+                                image_name  = image_name,
+                                image_id    = archived_image['Id'],
+                                load_path   = self.load_path,
+                            )
+                        )
+                        self.results['image'] = existing_image
+                    
+                    else:
+                        self.append_action(
+                            "Tagged image `{image_id}` from `{load_path}` " +
+                            "(already loaded) as `{image_name}`",
+                            image_id    = archived_image['Id'],
+                            load_path   = self.load_path,
+                            image_name  = image_name,
+                        )
+                        
+                        self.results['changed'] = True
+                        
+                        if not self.check_mode:
+                            try:
+                                self.client.tag(
+                                    archived_image['Id'],
+                                    self.name,
+                                    tag = self.tag,
+                                    force = True,
+                                )
+                            except Exception as exc:
+                                self.fail(
+                                    "Error tagging image `{image_id}` as " +
+                                    "`{image_name}` - {error}",
+                                    image_id    = archived_image['Id'],
+                                    image_name  = image_name,
+                                    error       = str(exc),
+                                )
+                            
+                            loaded_image = self.client.find_image(
+                                self.name,
+                                self.tag,
+                            )
+                            self.results['image'] = loaded_image
                         
                 else:
                     # pull the image
@@ -316,12 +499,12 @@ class ImageManager(DockerBaseClass):
         if self.archive_path:
             self.archive_image(self.name, self.tag)
         
-        # Tag the image to a repository if we have one
-        if self.repository:
-            self.tag_image(
+        # Tag the image to the repositories if we have any
+        if self.repositories:
+            self.tag_images(
                 self.name,
                 self.tag,
-                self.repository,
+                self.repositories,
                 force   = self.force,
                 push    = self.push,
             )
@@ -430,6 +613,156 @@ class ImageManager(DockerBaseClass):
             self.results['image']['state'] = 'Deleted'
     
     
+    # Incremental Builds
+    # ------------------------------------------------------------------------
+    
+    def build_input_hash(self):
+        '''
+        Hash the build's inputs (see
+        :mod:`qb.ansible.modules.docker.build_inputs`) and store it in
+        :attr:`input_hash` and the results.
+        
+        Base images are identified by their local image ID; ones we don't
+        have locally only contribute their name (the build would pull them).
+        
+        :rtype: str
+        '''
+        if self.input_hash is not None:
+            return self.input_hash
+        
+        dockerfile = self.dockerfile or 'Dockerfile'
+        dockerfile_path = os.path.join(self.path, dockerfile)
+        
+        try:
+            with open(dockerfile_path, 'r') as file:
+                dockerfile_contents = file.read()
+        except (IOError, OSError) as exc:
+            self.fail(
+                "Error reading Dockerfile `{dockerfile_path}` - {error}",
+                dockerfile_path = dockerfile_path,
+                error = str(exc),
+            )
+        
+        base_image_ids = {}
+        for base_image in build_inputs.base_images(dockerfile_contents):
+            repo, repo_tag = parse_repository_tag(base_image)
+            image = self.client.find_image(name=repo, tag=repo_tag or 'latest')
+            base_image_ids[base_image] = image['Id'] if image else None
+        
+        files = build_inputs.context_files(self.path, dockerfile=dockerfile)
+        
+        self.input_hash = build_inputs.input_hash(
+            path = self.path,
+            files = files,
+            dockerfile = dockerfile,
+            dockerfile_contents = dockerfile_contents,
+            buildargs = self.buildargs,
+            base_image_ids = base_image_ids,
+        )
+        
+        self.results['input_hash'] = self.input_hash
+        
+        self.logger.debug(
+            "Hashed build inputs",
+            payload = dict(
+                input_hash  = self.input_hash,
+                file_count  = len(files),
+                base_images = base_image_ids,
+            ),
+        )
+        
+        return self.input_hash
+    
+    
+    def reuse_build(self, existing_image):
+        '''
+        Look for an image built from the same inputs as the one we're about
+        to build, in order:
+        
+        1.  `existing_image` (the one at our `name:tag`).
+        2.  Any other local image with our input hash label, which gets tagged
+            as `name:tag`.
+        3.  Our `name:tag` in the repository, if `try_to_pull` is on and we're
+            not in check mode. If the pulled image is from different inputs
+            it's just built over.
+        
+        :rtype:     tuple
+        :return:    `(image, source)` where `source` is `'existing'`,
+                    `'local'` or `'pulled'`, or `(None, None)` if we need to
+                    build.
+        '''
+        input_hash = self.build_input_hash()
+        image_name = "{}:{}".format(self.name, self.tag)
+        
+        if build_inputs.image_input_hash(existing_image) == input_hash:
+            self.append_action(
+                "Image `{image_name}` is up to date with it's build inputs",
+                image_name  = image_name,
+            )
+            return (existing_image, 'existing')
+        
+        matches = self.client.images(
+            filters = dict(label="{}={}".format(build_inputs.LABEL, input_hash))
+        )
+        
+        if matches:
+            self.append_action(
+                "Tagged image `{image_id}` built from the same inputs as " +
+                "`{image_name}`",
+                image_id    = matches[0]['Id'],
+                image_name  = image_name,
+            )
+            
+            self.results['changed'] = True
+            
+            if self.check_mode:
+                return (matches[0], 'local')
+            
+            try:
+                self.client.tag(
+                    matches[0]['Id'],
+                    self.name,
+                    tag = self.tag,
+                    force = True,
+                )
+            except Exception as exc:
+                self.fail(
+                    "Error tagging image `{image_id}` as `{image_name}` " +
+                    "- {error}",
+                    image_id    = matches[0]['Id'],
+                    image_name  = image_name,
+                    error       = str(exc),
+                )
+            
+            return (self.client.find_image(self.name, self.tag), 'local')
+        
+        if self.try_to_pull and not self.check_mode:
+            pulled_image = self.client.try_pull_image(self.name, tag=self.tag)
+            
+            if build_inputs.image_input_hash(pulled_image) == input_hash:
+                self.append_action(
+                    "Pulled image `{image_name}` built from the same inputs",
+                    image_name  = image_name,
+                )
+                self.results['changed'] = True
+                return (pulled_image, 'pulled')
+            
+            if pulled_image is not None:
+                self.logger.info(
+                    "Pulled image `{image_name}` is from different build " +
+                    "inputs, building",
+                    payload = dict(
+                        image_name  = image_name,
+                        input_hash  = input_hash,
+                        pulled_hash = build_inputs.image_input_hash(
+                            pulled_image
+                        ),
+                    ),
+                )
+        
+        return (None, None)
+    
+    
     # Actions
     # ------------------------------------------------------------------------
     
@@ -457,6 +790,28 @@ class ImageManager(DockerBaseClass):
 
         image_name = "%s:%s" % (name, tag)
         
+        if archive.is_current(
+            self.archive_path,
+            image['Id'],
+            compression = self.archive_compression,
+        ):
+            self.logger.info(
+                "Archive `{archive_path}` is already image `{image_name}` " +
+                "(`{image_id}`), not exporting",
+                payload = dict(
+                    archive_path    = self.archive_path,
+                    image_name      = image_name,
+                    image_id        = image['Id'],
+                )
+            )
+            self.results['archive'] = dict(
+                archive.read_metadata(self.archive_path),
+                path = self.archive_path,
+                skipped = True,
+            )
+            self.results['image'] = image
+            return
+        
         self.append_action(
             'Archived image `{image_name}` to `{archive_path}`',
             image_name      = image_name,
@@ -475,16 +830,18 @@ class ImageManager(DockerBaseClass):
             )
             
             try:
-                image = self.client.get_image(image_name)
+                export = self.client.get_image(image_name)
             except Exception as exc:
                 self.fail(
                     "Error getting image `%s` - %s" % (image_name, str(exc))
                 )
-
+            
             try:
-                with open(self.archive_path, 'w') as fd:
-                    for chunk in image.stream(2048, decode_content=False):
-                        fd.write(chunk)
+                archive_stats = ArchiveWriter(
+                    self.archive_path,
+                    compression = self.archive_compression,
+                    checksum = self.archive_checksum,
+                ).write_from(export, image_id=image['Id'])
             except Exception as exc:
                 self.fail(
                     "Error writing image archive `%s` - %s" % (
@@ -492,6 +849,13 @@ class ImageManager(DockerBaseClass):
                         str(exc)
                     )
                 )
+            
+            self.results['archive'] = archive_stats
+            
+            self.logger.info(
+                "Archived image `{image_name}` at {mb_per_sec} MB/s",
+                payload = dict(image_name=image_name, **archive_stats)
+            )
 
         image = self.client.find_image(name=name, tag=tag)
         if image:
@@ -535,45 +899,11 @@ class ImageManager(DockerBaseClass):
             self.results['changed'] = True
             
             if not self.check_mode:
-                status = None
                 try:
-                    for line in self.client.push(
-                        repository,
-                        tag     = tag,
-                        stream  = True,
-                        decode  = True
-                    ):
-                        self.out(line)
-                        
-                        if line.get('errorDetail'):
-                            raise Exception(line['errorDetail']['message'])
-                            
-                        status = line.get('status')
-                        
+                    status = self.stream_push(repository, tag)
                 except Exception as exc:
-                    if re.search('unauthorized', str(exc)):
-                        if re.search('authentication required', str(exc)):
-                            self.fail(
-                                "Error pushing image %s/%s:%s - %s. Try logging into %s first." % (
-                                    registry,
-                                    repo_name,
-                                    tag,
-                                    str(exc),
-                                    registry
-                                )
-                            )
-                        else:
-                            self.fail(
-                                "Error pushing image %s/%s:%s - %s. Does the repository exist?" % (
-                                    registry,
-                                    repo_name,
-                                    tag,
-                                    str(exc)
-                                )
-                            )
-                    
                     self.fail(
-                        "Error pushing image %s: %s" % (repository, str(exc))
+                        self.push_error_message(repository, tag, exc)
                     )
                     
                 self.results['image'] = self.client.find_image(
@@ -587,6 +917,66 @@ class ImageManager(DockerBaseClass):
                 self.results['image']['push_status'] = status
     
     
+    def stream_push(self, repository, tag):
+        '''
+        Push `repository:tag`, writing the (coalesced) progress out.
+        
+        :rtype:     str
+        :return:    The last status from the daemon.
+        :raises:    :class:`Exception` if the daemon reports an error.
+        '''
+        status = None
+        
+        with self.client.progress(
+            "Pushing {}:{}".format(repository, tag),
+            label = self.label,
+        ):
+            for line in self.client.push(
+                repository,
+                tag     = tag,
+                stream  = True,
+                decode  = True
+            ):
+                self.out(line)
+                
+                if line.get('errorDetail'):
+                    raise Exception(
+                        line['errorDetail']['message']
+                    )
+                
+                status = line.get('status')
+        
+        return status
+    
+    
+    def push_error_message(self, repository, tag, exc):
+        '''
+        What to say when pushing `repository:tag` failed with `exc`.
+        
+        :rtype: str
+        '''
+        registry, repo_name = resolve_repository_name(repository)
+        
+        if re.search('unauthorized', str(exc)):
+            if re.search('authentication required', str(exc)):
+                return "Error pushing image %s/%s:%s - %s. Try logging into %s first." % (
+                    registry,
+                    repo_name,
+                    tag,
+                    str(exc),
+                    registry
+                )
+            else:
+                return "Error pushing image %s/%s:%s - %s. Does the repository exist?" % (
+                    registry,
+                    repo_name,
+                    tag,
+                    str(exc)
+                )
+        
+        return "Error pushing image %s: %s" % (repository, str(exc))
+    
+    
     def tag_image(self, name, tag, repository, force=False, push=False):
         '''
         Tag an image into a repository.
@@ -598,26 +988,68 @@ class ImageManager(DockerBaseClass):
         :param push: bool. push the image once it's tagged.
         :return: None
         '''
-        repo, repo_tag = parse_repository_tag(repository)
+        self.tag_images(name, tag, [repository], force=force, push=push)
+    
+    
+    def tag_images(self, name, tag, repositories, force=False, push=False):
+        '''
+        Tag an image into each of `repositories`, and push them - up to
+        :attr:`push_concurrency` at a time - if `push` is on.
         
-        if not repo_tag:
-            repo_tag = "latest"
-            if tag:
-                repo_tag = tag
+        Whether the image already has a tag is read off the image itself
+        (one inspection), comparing references the way the daemon writes
+        them (see :func:`normalize_reference`), and it's inspected once more
+        at the end for `results['image']`, however many repositories there
+        are.
         
-        image = self.client.find_image(name=repo, tag=repo_tag)
+        Each target's push goes in `results['pushes']` - it's `repository`,
+        `tag`, `status` (the last one from the daemon), `seconds` and
+        `error` if it failed. Any failures fail the module, after all the
+        pushes are done.
         
-        found = 'found' if image else 'not found'
+        :param name:            Name of the image.
+        :param tag:             Image tag.
+        :param repositories:    List of repository paths, which can have
+                                tags (`repo:tag`), otherwise `tag` is used.
+        :param force:           Tag even if the image already has the tag.
+        :param push:            Push each tag once it's made.
         
-        self.logger.info(
-            "image `{repo}` was `{found}`",
-            payload = dict(
-                repo    = repo,
-                found   = found
-            )
+        :return: None
+        '''
+        image_name = name
+        if tag and not re.search(tag, name):
+            image_name = "%s:%s" % (name, tag)
+        
+        image = self.client.find_image(name=name, tag=tag)
+        existing_tags = set(
+            normalize_reference(*parse_repository_tag(repo_tag))
+            for repo_tag in ((image or {}).get('RepoTags') or [])
         )
-
-        if not image or force:
+        
+        targets = []
+        
+        for repository in repositories:
+            repo, repo_tag = parse_repository_tag(repository)
+            
+            if not repo_tag:
+                repo_tag = "latest"
+                if tag:
+                    repo_tag = tag
+            
+            found = normalize_reference(repo, repo_tag) in existing_tags
+            
+            self.logger.info(
+                "image `{repo}:{repo_tag}` was `{found}`",
+                payload = dict(
+                    repo        = repo,
+                    repo_tag    = repo_tag,
+                    found       = 'found' if found else 'not found',
+                )
+            )
+            
+            if found and not force:
+                continue
+            
             self.logger.info(
                 "tagging {name}:{tag} to {repo}:{repo_tag}",
                 payload=dict(name=name, tag=tag, repo=repo, repo_tag=repo_tag)
@@ -625,7 +1057,7 @@ class ImageManager(DockerBaseClass):
             
             self.results['changed'] = True
             
-            append_action(
+            self.append_action(
                 "Tagged image {name}:{tag} to {repo}:{repo_tag}",
                 name=name, tag=tag, repo=repo, repo_tag=repo_tag
             )
@@ -634,17 +1066,92 @@ class ImageManager(DockerBaseClass):
                 try:
                     # Finding the image does not always work, especially running a localhost registry. In those
                     # cases, if we don't set force=True, it errors.
-                    image_name = name
-                    if tag and not re.search(tag, name):
-                        image_name = "%s:%s" % (name, tag)
                     tag_status = self.client.tag(image_name, repo, tag=repo_tag, force=True)
                     if not tag_status:
                         raise Exception("Tag operation failed.")
                 except Exception as exc:
                     self.fail("Error: failed to tag image - %s" % str(exc))
-                self.results['image'] = self.client.find_image(name=repo, tag=repo_tag)
-                if push:
-                    self.push_image(repo, repo_tag)
+                
+                targets.append((repo, repo_tag))
+        
+        if push and targets:
+            self.push_images(targets)
+        
+        if targets:
+            self.results['image'] = self.client.find_image(name=name, tag=tag)
+    
+    
+    def push_images(self, targets):
+        '''
+        Push `(repository, tag)` `targets`, up to :attr:`push_concurrency` at
+        a time. See :meth:`tag_images`.
+        
+        :return: None
+        '''
+        pushes = [None] * len(targets)
+        pending = queue.Queue()
+        
+        for index in range(len(targets)):
+            pending.put(index)
+        
+        def work():
+            while True:
+                try:
+                    index = pending.get_nowait()
+                except queue.Empty:
+                    return
+                
+                repository, tag = targets[index]
+                push = dict(repository=repository, tag=tag, status=None)
+                start = time.time()
+                
+                try:
+                    push['status'] = self.stream_push(repository, tag)
+                except Exception as exc:
+                    push['error'] = self.push_error_message(
+                        repository,
+                        tag,
+                        exc,
+                    )
+                
+                push['seconds'] = round(time.time() - start, 3)
+                pushes[index] = push
+        
+        workers = [
+            threading.Thread(
+                target = work,
+                name = "qb_docker_image:push:{}".format(number),
+            )
+            for number in range(min(self.push_concurrency, len(targets)))
+        ]
+        
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        
+        for worker in workers:
+            worker.join()
+        
+        self.results['pushes'] = pushes
+        
+        for push in pushes:
+            if 'error' not in push:
+                self.append_action(
+                    "Pushed image `{name}` to `{repository}:{tag}` in {seconds}s",
+                    name = self.name,
+                    **push
+                )
+        
+        errors = [push['error'] for push in pushes if 'error' in push]
+        
+        if errors:
+            self.fail(
+                "{count} of {total} pushes failed: {errors}",
+                count = len(errors),
+                total = len(pushes),
+                errors = '; '.join(errors),
+                pushes = pushes,
+            )
     
     
     def build_image(self):
@@ -666,7 +1173,6 @@ class ImageManager(DockerBaseClass):
             dockerfile=self.dockerfile,
             decode=True
         )
-        build_output = []
         if self.tag:
             params['tag'] = "%s:%s" % (self.name, self.tag)
         if self.container_limits:
@@ -675,6 +1181,10 @@ class ImageManager(DockerBaseClass):
             for key, value in self.buildargs.items():
                 self.buildargs[key] = to_native(value)
             params['buildargs'] = self.buildargs
+        if self.incremental:
+            params['labels'] = {
+                build_inputs.LABEL: self.build_input_hash(),
+            }
         
         self.logger.info(
             "Building",
@@ -685,70 +1195,752 @@ class ImageManager(DockerBaseClass):
         
         # self.logger.info("build result", payload=dict(result=result))
         
-        for log in logs:
-            
-            self.out(log)
-            
-            if "stream" in log:
-                build_output.append(log["stream"])
+        # Only the tail of the output is kept in memory (for the failure
+        # message); all of it goes to a temp file that we keep if the build
+        # fails, and return the path of as `build_log_path`.
+        build_log = BuildLog(
+            max_lines = self.build_log_lines,
+            max_bytes = self.build_log_bytes,
+        )
+        
+        # Per-step timing and cache hits, returned as `build_profile`
+        profile = BuildProfile()
+        
+        try:
+            for log in logs:
                 
-            if log.get('error'):
-                if log.get('errorDetail'):
-                    errorDetail = log.get('errorDetail')
-                    self.fail(
-                        "Error building %s - code: %s, message: %s, logs: %s" % (
-                            self.name,
-                            errorDetail.get('code'),
-                            errorDetail.get('message'),
-                            build_output
-                        )
-                    )
-                else:
+                self.out(log)
+                profile.feed(log)
+                
+                if "stream" in log:
+                    build_log.append(log["stream"])
+                    
+                if log.get('error'):
+                    build_log.close(keep=True)
+                    
+                    errorDetail = log.get('errorDetail') or {}
+                    
                     self.fail(
-                        "Error building %s - message: %s, logs: %s" % (
-                            self.name,
-                            log.get('error'),
-                            build_output
-                        )
+                        "Error building {name} - code: {code}, " +
+                        "message: {message}, logs (last {line_count} " +
+                        "lines, full log at {build_log_path}): {logs}",
+                        name            = self.name,
+                        code            = errorDetail.get('code'),
+                        message         = (
+                            errorDetail.get('message') or log.get('error')
+                        ),
+                        line_count      = len(build_log.lines),
+                        build_log_path  = build_log.path,
+                        logs            = build_log.tail(),
+                        result          = dict(
+                            build_log_path  = build_log.path,
+                            build_profile   = profile.finish(),
+                        ),
                     )
+        except:
+            build_log.close(keep=True)
+            raise
+        
+        build_log.close()
+        
+        self.results['build_profile'] = profile.finish()
+        
+        self.logger.info(
+            "Build profile for {name}",
+            payload = dict(
+                name = self.name,
+                cache_hits = self.results['build_profile']['cache_hits'],
+                cache_misses = self.results['build_profile']['cache_misses'],
+                seconds = self.results['build_profile']['seconds'],
+                slowest_steps = profile.slowest(),
+            ),
+        )
+        
         return self.client.find_image(name=self.name, tag=self.tag)
     
     
+    def find_archived_image(self):
+        '''
+        The image the archive at :attr:`load_path` holds, going by it's
+        metadata sidecar (see :mod:`qb.ansible.modules.docker.archive`), if
+        the daemon already has it.
+        
+        The sidecar is only trusted if the archive still matches it (size and
+        SHA-256, see :func:`archive.is_current`) - another archive copied
+        over the same path has to be loaded.
+        
+        :rtype:     dict or `None`
+        '''
+        metadata = archive.read_metadata(self.load_path)
+        
+        if not metadata or not metadata.get('image_id'):
+            return None
+        
+        if not archive.is_current(
+            self.load_path,
+            metadata['image_id'],
+            metadata.get('compression'),
+        ):
+            return None
+        
+        try:
+            return self.client.inspect_image(metadata['image_id'])
+        except Exception:
+            # Not found (or can't tell) - load it
+            return None
+    
+    
     def load_image(self):
         '''
-        Load an image from a .tar archive
+        Load an image from a `.tar`, `.tar.gz` or `.tar.xz` archive.
+        
+        The file is streamed to the daemon in chunks (the daemon handles
+        decompressing), with progress written to the STDIO `out` channel.
+        Throughput and such go in `results['load']`.
 
         :return: image dict
         '''
         try:
-            self.logger.info(
-                "Opening image `{load_path}`",
-                payload = dict(load_path=self.load_path)
-            )
-            
-            image_tar = open(self.load_path, 'r')
-            
+            compression = archive.detect_compression(self.load_path)
         except Exception as exc:
             self.fail(
                 "Error opening image `{load_path}` - `{error}`",
                 load_path   = self.load_path,
                 error       = str(exc)
             )
-
+        
+        if compression is None:
+            self.fail(
+                "Image archive `{load_path}` isn't a tar file (compressed " +
+                "with gzip or xz or not)",
+                load_path   = self.load_path,
+            )
+        
+        stats = dict(
+            path        = self.load_path,
+            compression = None if compression == 'tar' else compression,
+        )
+        
+        def progress(sent, total, seconds):
+            stats.update(
+                size        = total,
+                seconds     = round(seconds, 3),
+                mb_per_sec  = (
+                    round(sent / seconds / 1e6, 1) if seconds > 0 else None
+                ),
+            )
+            self.out(
+                archive.format_progress(
+                    "Loading `{}`".format(self.load_path),
+                    sent,
+                    total,
+                    seconds,
+                )
+            )
+        
+        self.logger.info(
+            "Loading image from `{load_path}`",
+            payload = dict(load_path=self.load_path, compression=compression)
+        )
+        
         try:
-            self.logger.info(
-                "Loading image from `{load_path}`",
-                payload = dict(load_path=self.load_path)
+            response = self.client.load_image(
+                archive.read_chunks(self.load_path, progress=progress)
             )
             
-            self.client.load_image(image_tar)
+            # Newer docker-py versions hand back the daemon's output as a
+            # stream, which needs to be read for the load to finish
+            if response is not None and not isinstance(response, dict):
+                for line in response:
+                    self.out(line)
+                    if isinstance(line, dict) and line.get('error'):
+                        raise Exception(line['error'])
             
         except Exception as exc:
             self.fail("Error loading image %s - %s" % (self.name, str(exc)))
-
-        try:
-            image_tar.close()
-        except Exception as exc:
-            self.fail("Error closing image %s - %s" % (self.name, str(exc)))
+        
+        self.results['load'] = stats
+        
+        self.logger.info(
+            "Loaded image from `{load_path}` at {mb_per_sec} MB/s",
+            payload = dict(load_path=self.load_path, **stats),
+        )
 
         return self.client.find_image(self.name, self.tag)
+
+
+# Functions
+# ============================================================================
+
+def new_results():
+    '''
+    Fresh results dict for the module, or for one of it's `images`.
+    
+    :rtype: dict
+    '''
+    return dict(
+        changed=False,
+        actions=[],
+        # NOTE IDK why this is an empty dict...?
+        image={},
+        warnings=[],
+    )
+
+
+def image_parameters(parameters, image):
+    '''
+    Module parameters for one entry of the `images` list: the top-level
+    parameters are defaults, and whatever the entry sets wins.
+    
+    Entries can also just be a name string.
+    
+    >>> sorted(image_parameters(
+    ...     dict(images=['a', 'b'], name=None, tag='latest', push=True),
+    ...     'nrser/qb:0.1.2',
+    ... ).items())
+    [('name', 'nrser/qb:0.1.2'), ('push', True), ('tag', 'latest')]
+    
+    :rtype: dict
+    '''
+    if not isinstance(image, dict):
+        image = dict(name=image)
+    
+    merged = dict(parameters)
+    del merged['images']
+    merged.update(image)
+    return merged
+
+
+def check_image_entry(image, argument_spec, type_checkers):
+    '''
+    Check and convert a dict entry of the `images` list against the module's
+    argument spec, like Ansible does for the top-level parameters: aliases
+    are resolved, values are converted to their type and checked against
+    their choices. Defaults are *not* filled in - that's what the top-level
+    parameters are for (see :func:`image_parameters`).
+    
+    The Docker connection options, `images` and `max_workers` apply to the
+    whole module run, so they're not accepted in entries, and neither is a
+    `state` other than one of :data:`ENTRY_STATES`.
+    
+    >>> spec = dict(
+    ...     name=dict(type='str'),
+    ...     push=dict(type='bool', default=False),
+    ...     path=dict(type='path', aliases=['build_path']),
+    ...     state=dict(type='str', choices=['absent', 'present', 'prune']),
+    ... )
+    >>> checkers = dict(
+    ...     str=str,
+    ...     path=str,
+    ...     bool=lambda value: value in (True, 'yes', 'true'),
+    ... )
+    >>> sorted(check_image_entry(
+    ...     dict(name='nrser/qb', push='no', build_path='./qb'),
+    ...     spec,
+    ...     checkers,
+    ... ).items())
+    [('name', 'nrser/qb'), ('path', './qb'), ('push', False)]
+    >>> check_image_entry(dict(name='nrser/qb', pussh=True), spec, checkers)
+    Traceback (most recent call last):
+        ...
+    ValueError: unsupported parameter `pussh`
+    >>> check_image_entry(dict(name='nrser/qb', state='gone'), spec, checkers)
+    Traceback (most recent call last):
+        ...
+    ValueError: value of `state` must be one of absent, present, prune, got 'gone'
+    >>> check_image_entry(dict(name='nrser/qb', state='prune'), spec, checkers)
+    Traceback (most recent call last):
+        ...
+    ValueError: `state` can't be 'prune' in an entry, only absent, present, build
+    
+    :param image:           The entry.
+    :param argument_spec:   The module's (`module.argument_spec`).
+    :param type_checkers:   Type name to conversion function - the module's
+                            `_CHECK_ARGUMENT_TYPES_DISPATCHER`.
+    
+    :rtype:     dict
+    :raises:    :class:`ValueError` or :class:`TypeError` if the entry has a
+                parameter we don't know (or take), or one that won't convert.
+    '''
+    aliases = {}
+    for name, options in argument_spec.items():
+        for alias in options.get('aliases') or ():
+            aliases[alias] = name
+    
+    checked = {}
+    
+    for key, value in image.items():
+        name = aliases.get(key, key)
+        
+        if (
+            name not in argument_spec or
+            name in ('images', 'max_workers') or
+            name in DOCKER_COMMON_ARGS
+        ):
+            raise ValueError("unsupported parameter `{}`".format(key))
+        
+        options = argument_spec[name]
+        
+        if value is not None:
+            wanted = options.get('type') or 'str'
+            
+            if not callable(wanted):
+                wanted = type_checkers[wanted]
+            
+            try:
+                value = wanted(value)
+            except (TypeError, ValueError) as error:
+                raise ValueError(
+                    "can't convert `{}` value {!r} to {} - {}".format(
+                        key,
+                        value,
+                        options.get('type'),
+                        error,
+                    )
+                )
+            
+            choices = options.get('choices')
+            
+            if choices is not None and value not in choices:
+                raise ValueError(
+                    "value of `{}` must be one of {}, got {!r}".format(
+                        key,
+                        ', '.join(str(choice) for choice in choices),
+                        value,
+                    )
+                )
+            
+            if name == 'state' and value not in ENTRY_STATES:
+                raise ValueError(
+                    "`state` can't be {!r} in an entry, only {}".format(
+                        value,
+                        ', '.join(ENTRY_STATES),
+                    )
+                )
+        
+        checked[name] = value
+    
+    return checked
+
+
+def image_label(parameters):
+    '''
+    `name:tag` for an entry's parameters, used to tag it's output.
+    
+    >>> image_label(dict(name='nrser/qb', tag='0.1.2'))
+    'nrser/qb:0.1.2'
+    >>> image_label(dict(name='nrser/qb:0.1.2', tag='latest'))
+    'nrser/qb:0.1.2'
+    '''
+    repo, repo_tag = parse_repository_tag(parameters['name'])
+    return "{}:{}".format(repo, repo_tag or parameters.get('tag') or 'latest')
+
+
+def normalize_reference(repository, tag):
+    '''
+    `repository:tag` the way the daemon lists it in an image's `RepoTags` -
+    without the Docker Hub registry, or `library/` for official images.
+    
+    >>> normalize_reference('docker.io/nrser/qb', '0.1.2')
+    'nrser/qb:0.1.2'
+    >>> normalize_reference('docker.io/library/redis', 'latest')
+    'redis:latest'
+    >>> normalize_reference('index.docker.io/library/redis', 'latest')
+    'redis:latest'
+    >>> normalize_reference('localhost:5000/library/redis', 'latest')
+    'localhost:5000/library/redis:latest'
+    '''
+    registry, _, path = repository.partition('/')
+    
+    if path and registry in DOCKER_HUB_REGISTRIES:
+        repository = path
+    
+    if repository.startswith('library/') and repository.count('/') == 1:
+        repository = repository[len('library/'):]
+    
+    return "{}:{}".format(repository, tag)
+
+
+def manage_images(client, results):
+    '''
+    Run the module for each entry in the `images` parameter, up to
+    `max_workers` at a time, all sharing `client` (and it's connection to
+    the daemon).
+    
+    Each entry's results go in `results['images']`, in order, with it's
+    `name` (as `name:tag`) and `failed` / `msg` if it failed. `changed`,
+    `actions` and `warnings` are rolled up into `results` as well, with the
+    actions and warnings prefixed by the entry's name.
+    
+    :param client:  :class:`QBAnsibleDockerClient`.
+    :param results: Module results (see :func:`new_results`).
+    
+    :rtype:     list
+    :return:    The entries' results that failed.
+    '''
+    parameters = client.module.params
+    entries = []
+    
+    for index, image in enumerate(parameters['images']):
+        if isinstance(image, dict):
+            try:
+                image = check_image_entry(
+                    image,
+                    client.module.argument_spec,
+                    client.module._CHECK_ARGUMENT_TYPES_DISPATCHER,
+                )
+            except (TypeError, ValueError) as error:
+                client.fail(
+                    "Entry {index} in `images` is invalid: {error}",
+                    index = index,
+                    error = str(error),
+                )
+        
+        entries.append(image_parameters(parameters, image))
+    
+    max_workers = parameters.get('max_workers') or DEFAULT_MAX_WORKERS
+    
+    for index, entry in enumerate(entries):
+        if not entry.get('name'):
+            client.fail(
+                "Entry {index} in `images` has no `name`",
+                index = index,
+            )
+    
+    logger.info(
+        "Managing {count} images with {workers} workers",
+        payload = dict(
+            count   = len(entries),
+            workers = min(max_workers, len(entries)),
+        ),
+    )
+    
+    image_results = [None] * len(entries)
+    pending = queue.Queue()
+    
+    for index in range(len(entries)):
+        pending.put(index)
+    
+    def work():
+        while True:
+            try:
+                index = pending.get_nowait()
+            except queue.Empty:
+                return
+            
+            entry = entries[index]
+            label = image_label(entry)
+            entry_results = new_results()
+            entry_results['name'] = label
+            
+            try:
+                with client.raise_failures(), client.labeled(label):
+                    ImageManager(
+                        client,
+                        entry_results,
+                        parameters = entry,
+                        label = label,
+                    )
+            except ModuleFailure as error:
+                entry_results.update(error.result)
+                entry_results['failed'] = True
+                entry_results['msg'] = str(error)
+            except Exception as error:
+                logger.exception(
+                    "Error managing image `{name}`",
+                    payload = dict(name = label),
+                )
+                entry_results['failed'] = True
+                entry_results['msg'] = "Error managing image {} - {}".format(
+                    label,
+                    error,
+                )
+            
+            image_results[index] = entry_results
+    
+    workers = [
+        threading.Thread(
+            target = work,
+            name = "qb_docker_image:worker:{}".format(number),
+        )
+        for number in range(min(max_workers, len(entries)))
+    ]
+    
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    
+    for worker in workers:
+        worker.join()
+    
+    results['images'] = image_results
+    
+    for entry_results in image_results:
+        if entry_results['changed']:
+            results['changed'] = True
+        for key in ('actions', 'warnings'):
+            results[key].extend(
+                "[{}] {}".format(entry_results['name'], message)
+                for message in entry_results[key]
+            )
+    
+    return [
+        entry_results
+        for entry_results in image_results
+        if entry_results.get('failed')
+    ]
+
+
+def manage_prefetch(client, results):
+    '''
+    The `prefetch` and `prefetched` states: start pulling `images` (or
+    `name`) in a detached worker, or wait for that to finish and collect
+    how it went (see :mod:`qb.ansible.modules.docker.prefetch`).
+    
+    The status goes in `results['prefetch']`, with it's `path`.
+    
+    :param client:  :class:`QBAnsibleDockerClient`.
+    :param results: Module results (see :func:`new_results`).
+    
+    :rtype:     list
+    :return:    `name:tag` of the images that aren't here after waiting
+                (always empty for `prefetch`).
+    '''
+    parameters = client.module.params
+    
+    if parameters.get('images'):
+        refs = [
+            image_label(image_parameters(parameters, image))
+            for image in parameters['images']
+        ]
+    else:
+        refs = [image_label(parameters)]
+    
+    path = (
+        parameters.get('prefetch_path') or
+        prefetch.default_status_path(refs)
+    )
+    
+    if parameters['state'] == 'prefetch':
+        status = prefetch.StatusFile(path).read()
+        
+        if prefetch.is_running(status):
+            results['actions'].append(
+                "Prefetch already running (pid {})".format(status['pid'])
+            )
+        else:
+            results['changed'] = True
+            results['actions'].append(
+                "Prefetching {}".format(', '.join(refs))
+            )
+            
+            if not client.check_mode:
+                status = prefetch.start(
+                    client,
+                    refs,
+                    path,
+                    max_workers = (
+                        parameters.get('max_workers') or DEFAULT_MAX_WORKERS
+                    ),
+                )
+        
+        results['prefetch'] = dict(status or {}, path=path)
+        return []
+    
+    # `prefetched` - don't hang around in check mode, just report
+    status = prefetch.wait(
+        path,
+        timeout = 0 if client.check_mode else (
+            parameters.get('prefetch_timeout') or prefetch.DEFAULT_TIMEOUT
+        ),
+    )
+    
+    if status is None:
+        client.fail(
+            "No prefetch status at {path} - run with state `prefetch` first",
+            path = path,
+        )
+    
+    results['prefetch'] = dict(status, path=path)
+    
+    missing = []
+    reported = []
+    
+    for ref in refs:
+        image = status['images'].get(ref) or dict(state = prefetch.PENDING)
+        
+        if image['state'] == prefetch.PULLED:
+            # Only the first `prefetched` task to see a pull changed anything
+            if not image.get('reported'):
+                reported.append(ref)
+                results['changed'] = True
+                results['actions'].append(
+                    "Pulled image {} in {}s".format(ref, image.get('seconds'))
+                )
+        elif image['state'] != prefetch.PRESENT:
+            missing.append(ref)
+    
+    # Mark them in the status file, unless the worker's still writing it
+    if reported and not client.check_mode and not status['timed_out']:
+        status_file = prefetch.StatusFile(path)
+        for ref in reported:
+            status_file.update_image(ref, reported = True)
+    
+    logger.info(
+        "Prefetch of {count} images done",
+        payload = dict(
+            count = len(refs),
+            missing = missing,
+            timed_out = status['timed_out'],
+            worker_died = status['worker_died'],
+        ),
+    )
+    
+    return missing
+
+
+def manage_prune(client, results):
+    '''
+    The `prune` state: list images and containers once, pick what to remove
+    by the `prune_*` policies (see :func:`prune.select`), and remove it,
+    `max_workers` at a time. In check mode, just say what would go.
+    
+    Removal failures (another process got there first, a container started
+    using the image...) are warnings - the rest still go.
+    
+    :param client:  :class:`QBAnsibleDockerClient`.
+    :param results: Module results (see :func:`new_results`), which get
+                    `prune`.
+    
+    :rtype: None
+    '''
+    parameters = client.module.params
+    
+    # Before listing anything - it's the module args that are wrong
+    try:
+        prune.check_repository(
+            parameters.get('name'),
+            keep_last = parameters.get('prune_keep_last'),
+            older_than = parameters.get('prune_older_than'),
+        )
+    except ValueError as error:
+        client.fail(str(error))
+    
+    images = client.images()
+    used_image_ids = [
+        container['ImageID']
+        for container in client.containers(all=True)
+        if container.get('ImageID')
+    ]
+    
+    try:
+        plan = prune.select(
+            images,
+            used_image_ids = used_image_ids,
+            keep_last = parameters.get('prune_keep_last'),
+            older_than = parameters.get('prune_older_than'),
+            dangling = parameters.get('prune_dangling'),
+            repository = parameters.get('name'),
+        )
+    except ValueError as error:
+        client.fail(str(error))
+    
+    targets = plan['targets']
+    
+    logger.info(
+        "Pruning {count} of {total} images",
+        payload = dict(
+            count = len(targets),
+            total = len(images),
+            kept = plan['kept'],
+            in_use = len(plan['in_use']),
+            check_mode = client.check_mode,
+        ),
+    )
+    
+    sizes = dict((image['Id'], image.get('Size') or 0) for image in images)
+    removed = []
+    deleted_ids = set()
+    failed = []
+    lock = threading.Lock()
+    
+    if client.check_mode:
+        removed = [target['ref'] for target in targets]
+    else:
+        pending = queue.Queue()
+        
+        for target in targets:
+            pending.put(target)
+        
+        def work():
+            while True:
+                try:
+                    target = pending.get_nowait()
+                except queue.Empty:
+                    return
+                
+                try:
+                    response = client.remove_image(target['ref'])
+                except Exception as error:
+                    with lock:
+                        failed.append(dict(ref=target['ref'], error=str(error)))
+                    continue
+                
+                with lock:
+                    removed.append(target['ref'])
+                    for entry in response or []:
+                        if isinstance(entry, dict) and entry.get('Deleted'):
+                            deleted_ids.add(entry['Deleted'])
+        
+        workers = [
+            threading.Thread(
+                target = work,
+                name = "qb_docker_image:prune:{}".format(number),
+            )
+            for number in range(
+                min(
+                    parameters.get('max_workers') or DEFAULT_MAX_WORKERS,
+                    len(targets),
+                )
+            )
+        ]
+        
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        
+        for worker in workers:
+            worker.join()
+        
+        removed.sort()
+    
+    for failure in failed:
+        results['warnings'].append(
+            "Failed to remove {ref} - {error}".format(**failure)
+        )
+    
+    if removed:
+        results['changed'] = True
+        results['actions'].append(
+            "{} {} images".format(
+                'Would remove' if client.check_mode else 'Removed',
+                len(removed),
+            )
+        )
+    
+    results['prune'] = dict(
+        removed = removed,
+        failed = failed,
+        in_use = plan['in_use'],
+        kept = plan['kept'],
+        dry_run = client.check_mode,
+        reclaimed_bytes = (
+            plan['estimated_bytes']
+            if client.check_mode
+            else sum(
+                sizes[image_id]
+                for image_id in deleted_ids
+                if image_id in sizes
+            )
+        ),
+    )
@@ -0,0 +1,191 @@
+##############################################################################
+# The `qb_docker_image` module itself - argument spec and what it does with
+# them - so it can run in the module's own process or in the Docker broker
+# (see {qb.ansible.modules.docker.broker}), which the module forwards to when
+# the QB master is running one.
+##############################################################################
+
+# Imports
+# ============================================================================
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import copy
+
+import qb.ipc.stdio
+import qb.ipc.stdio.logging
+
+from qb.ansible.modules.docker.client import QBAnsibleDockerClient
+from qb.ansible.modules.docker.image_manager import (
+    ImageManager,
+    manage_images,
+    manage_prefetch,
+    manage_prune,
+    new_results,
+)
+
+
+# Globals
+# ============================================================================
+
+logger = qb.ipc.stdio.logging.getLogger('qb_docker_image', queued=True)
+
+
+# Constants
+# ============================================================================
+
+ARGUMENT_SPEC = dict(
+    archive_path=dict(type='path'),
+    archive_compression=dict(
+        type='str',
+        choices=['none', 'gzip', 'xz'],
+        default='none'
+    ),
+    archive_checksum=dict(type='bool', default=True),
+    container_limits=dict(type='dict'),
+    dockerfile=dict(type='str'),
+    force=dict(type='bool', default=False),
+    http_timeout=dict(type='int'),
+    load_path=dict(type='path'),
+    name=dict(type='str'),
+    nocache=dict(type='bool', default=False),
+    path=dict(type='path', aliases=['build_path']),
+    pull=dict(type='bool', default=True),
+    push=dict(type='bool', default=False),
+    repository=dict(type='list'),
+    rm=dict(type='bool', default=True),
+    state=dict(
+        type='str',
+        choices=[
+            'absent',
+            'present',
+            'build',
+            'prefetch',
+            'prefetched',
+            'prune',
+        ],
+        default='present'
+    ),
+    tag=dict(type='str', default='latest'),
+    use_tls=dict(
+        type='str',
+        default='no',
+        choices=['no', 'encrypt', 'verify']
+    ),
+    buildargs=dict(type='dict', default=None),
+    
+    # QB additions
+    try_to_pull=dict( type='bool', default=True ),
+    incremental=dict( type='bool', default=False ),
+    images=dict( type='list' ),
+    max_workers=dict( type='int', default=4 ),
+    push_concurrency=dict( type='int', default=4 ),
+    result_detail=dict(
+        type='str',
+        choices=['full', 'summary'],
+        default='full'
+    ),
+    progress_interval=dict( type='float', default=0.25 ),
+    build_log_lines=dict( type='int', default=200 ),
+    build_log_bytes=dict( type='int', default=65536 ),
+    prune_keep_last=dict( type='int' ),
+    prune_older_than=dict( type='str' ),
+    prune_dangling=dict( type='bool', default=False ),
+    prefetch_path=dict( type='path' ),
+    prefetch_timeout=dict( type='int', default=600 ),
+)
+
+MUTUALLY_EXCLUSIVE = [
+    # Don't tell me to build *and* load an image
+    ['path', 'load_path'],
+    # One image or many
+    ['name', 'images'],
+]
+
+
+# Functions
+# ============================================================================
+
+def new_client():
+    '''
+    Make the module's client, which parses and checks the module args.
+    
+    :rtype: QBAnsibleDockerClient
+    '''
+    return QBAnsibleDockerClient(
+        # Ansible doesn't change it, but the broker shares it between
+        # threads, so don't give it the chance
+        argument_spec = copy.deepcopy(ARGUMENT_SPEC),
+        supports_check_mode = True,
+        mutually_exclusive = MUTUALLY_EXCLUSIVE,
+    )
+
+
+def run(client):
+    '''
+    Do what the module args say, finishing with `client.module.exit_json`
+    (or `fail_json`).
+    '''
+    if client.module.params.get('state') != 'prune' and not (
+        client.module.params.get('name') or
+        client.module.params.get('images')
+    ):
+        client.fail("One of `name` or `images` is required")
+
+    results = new_results()
+    
+    # Docker builds, pulls and pushes spit out a *lot* of lines - write them
+    # from a background thread so we don't stall when the master is slow to
+    # read. Anything still queued is flushed at exit.
+    # 
+    # Multiplexing puts all the streams on one socket (if the master offers
+    # it) so logs and output stay in order.
+    qb.ipc.stdio.client.multiplex().buffer()
+    qb.ipc.stdio.client.connect(results['warnings'])
+    
+    if client.module.params.get('state') == 'prune':
+        manage_prune(client, results)
+    
+    elif client.module.params.get('state') in ('prefetch', 'prefetched'):
+        missing = manage_prefetch(client, results)
+        
+        if missing:
+            client.module.fail_json(
+                msg = "{} images were not prefetched: {}".format(
+                    len(missing),
+                    ', '.join(missing),
+                ),
+                **results
+            )
+    
+    elif client.module.params.get('images'):
+        failed = manage_images(client, results)
+        
+        if failed:
+            client.module.fail_json(
+                msg = "{} of {} images failed: {}".format(
+                    len(failed),
+                    len(results['images']),
+                    ', '.join(entry['name'] for entry in failed),
+                ),
+                **results
+            )
+    else:
+        ImageManager(client, results)
+    
+    logger.debug(
+        "Done, log stats by logger name",
+        payload = dict(stats=qb.ipc.stdio.logging.stats()),
+    )
+    
+    logger.debug(
+        "Image inspection cache stats",
+        payload = dict(stats=client.inspection_cache_stats()),
+    )
+    
+    client.module.exit_json(**results)
+
+
+def main():
+    run(new_client())
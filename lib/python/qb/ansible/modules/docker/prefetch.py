@@ -0,0 +1,577 @@
+##############################################################################
+# Pulling images in the background, so they're local by the time later tasks
+# want them instead of every pull sitting on the play's critical path.
+#
+# {start} launches a detached worker process (this file, run with
+# `python -m`) that pulls a list of images (a few at a time) and records how
+# each one is going in a JSON status file;
+# {wait} polls that file until they're all done (or it's given up) and
+# returns what happened. The `qb_docker_image` module does these as it's
+# `prefetch` and `prefetched` states.
+#
+# The status file looks like
+#
+#     {
+#       "pid": 4242,
+#       "started_at": 1529000000.0,
+#       "finished_at": null,
+#       "images": {
+#         "redis:4": {
+#           "state": "pulling",
+#           "progress": "Pulling redis:4: 3/7 layers done, ...",
+#           ...
+#         },
+#         ...
+#       }
+#     }
+#
+# and by default goes in the QB cache (see {qb.cache}) under a name derived
+# from the images, so a `prefetched` task with the same `images` as the
+# `prefetch` one finds it without being told where.
+##############################################################################
+
+# Imports
+# ============================================================================
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import sys
+import json
+import time
+import errno
+import hashlib
+import tempfile
+import threading
+import subprocess
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+try:
+    import docker
+    from docker.errors import NotFound
+    from docker.tls import TLSConfig
+    from docker.utils.utils import parse_repository_tag
+except ImportError:
+    # missing docker-py handled in docker_common
+    pass
+
+import qb
+from qb import cache
+from qb.ansible.modules.docker.progress import (
+    DEFAULT_INTERVAL,
+    ProgressAggregator,
+)
+
+
+# Constants
+# ============================================================================
+
+NAMESPACE = 'docker_prefetch'
+
+DEFAULT_MAX_WORKERS = 4
+
+# Seconds {wait} waits for before giving up, unless told otherwise.
+#
+DEFAULT_TIMEOUT = 600
+
+# Seconds between looks at the status file in {wait}.
+#
+POLL_INTERVAL = 0.5
+
+# Image states. Images start `pending`, and end up `pulled`, `present` (it
+# was already local, nothing to pull) or `failed`.
+#
+PENDING = 'pending'
+PULLING = 'pulling'
+PULLED = 'pulled'
+PRESENT = 'present'
+FAILED = 'failed'
+
+DONE_STATES = (PULLED, PRESENT, FAILED)
+
+# File descriptors {detach} closes up to, if the system won't say.
+#
+MAXFD = 2048
+
+# What {start} runs to launch the worker - the config comes on STDIN.
+#
+WORKER_MODULE = 'qb.ansible.modules.docker.prefetch'
+
+# {docker.tls.TLSConfig} attributes, and the arguments they go back in as.
+#
+TLS_ATTRS = (
+    ('cert', 'client_cert'),
+    ('ca_cert', 'ca_cert'),
+    ('verify', 'verify'),
+    ('ssl_version', 'ssl_version'),
+    ('assert_hostname', 'assert_hostname'),
+    ('assert_fingerprint', 'assert_fingerprint'),
+)
+
+
+# Functions
+# ============================================================================
+
+def default_status_path(refs):
+    '''
+    Where the status file for prefetching `refs` goes when we're not told:
+    the same place for the same images, whatever order they're listed in.
+
+    :rtype: str
+    '''
+    key = hashlib.sha256(
+        json.dumps(sorted(refs)).encode('utf-8')
+    ).hexdigest()[:16]
+
+    return cache.path_for(NAMESPACE, key)
+
+
+def pid_alive(pid):
+    '''
+    Is process `pid` still around?
+
+    >>> pid_alive(os.getpid())
+    True
+    '''
+    if not pid:
+        return False
+
+    try:
+        os.kill(pid, 0)
+    except OSError as error:
+        return error.errno == errno.EPERM
+
+    return True
+
+
+def is_running(status):
+    '''
+    Is the worker that owns `status` (from :meth:`StatusFile.read`) still
+    working?
+
+    >>> is_running(None)
+    False
+    >>> is_running(dict(pid=os.getpid(), finished_at=None))
+    True
+    >>> is_running(dict(pid=os.getpid(), finished_at=1529000000.0))
+    False
+    '''
+    return (
+        status is not None and
+        status.get('finished_at') is None and
+        pid_alive(status.get('pid'))
+    )
+
+
+def start(client, refs, path, max_workers=DEFAULT_MAX_WORKERS):
+    '''
+    Start a detached worker pulling `refs` (`name:tag` strings), recording
+    progress in the status file at `path`.
+
+    The worker is a new Python process (see :func:`main`) rather than a fork
+    of this one - which may be the Docker broker, with threads we can't take
+    along - that double-forks off, with it's standard streams on
+    `/dev/null`, so it outlives the module and Ansible doesn't wait on it.
+    It makes it's own connection to the daemon, with the same parameters as
+    `client`.
+
+    :param client:  :class:`QBAnsibleDockerClient`.
+
+    :rtype:     dict
+    :return:    The initial status.
+    '''
+    status_file = StatusFile(path)
+
+    status_file.write(dict(
+        pid = None,
+        started_at = time.time(),
+        finished_at = None,
+        images = dict(
+            (ref, dict(state = PENDING)) for ref in refs
+        ),
+    ))
+
+    config = dict(
+        path = path,
+        refs = list(refs),
+        connect_params = dump_connect_params(client),
+        max_workers = max_workers,
+        interval = (
+            getattr(client, 'progress_interval', None) or DEFAULT_INTERVAL
+        ),
+    )
+
+    with open(os.devnull, 'r+b') as devnull:
+        launcher = subprocess.Popen(
+            [sys.executable, '-m', WORKER_MODULE],
+            stdin = subprocess.PIPE,
+            stdout = devnull,
+            stderr = devnull,
+            close_fds = True,
+            cwd = '/',
+            env = worker_env(),
+        )
+
+        # Exits as soon as it's forked the worker
+        launcher.communicate(json.dumps(config).encode('utf-8'))
+
+    # Wait (briefly) for the worker to record it's PID
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        status = status_file.read()
+        if status and (status.get('pid') or status.get('finished_at')):
+            return status
+        time.sleep(0.01)
+
+    return status_file.read()
+
+
+def dump_connect_params(client):
+    '''
+    `client`'s connection parameters for the worker, as JSON-able values.
+
+    :rtype: dict
+    '''
+    connect_params = dict(client._connect_params)
+    # No need to negotiate again
+    connect_params['version'] = client.api_version
+
+    tls = connect_params.get('tls')
+    if tls is not None and not isinstance(tls, bool):
+        connect_params['tls'] = dict(
+            (arg, getattr(tls, attr, None)) for attr, arg in TLS_ATTRS
+        )
+
+    return connect_params
+
+
+def load_connect_params(connect_params):
+    '''
+    Turn what :func:`dump_connect_params` made back into
+    :class:`docker.APIClient` arguments.
+
+    >>> load_connect_params(dict(base_url='unix://var/run/docker.sock'))
+    {'base_url': 'unix://var/run/docker.sock'}
+    '''
+    connect_params = dict(connect_params)
+
+    tls = connect_params.get('tls')
+    if isinstance(tls, dict):
+        if tls.get('client_cert'):
+            tls['client_cert'] = tuple(tls['client_cert'])
+        connect_params['tls'] = TLSConfig(**tls)
+
+    return connect_params
+
+
+def worker_env(env=os.environ):
+    '''
+    ENV for the worker: ours, with `qb` sure to be importable.
+
+    >>> worker_env({})['PYTHONPATH'] == os.path.dirname(
+    ...     os.path.dirname(os.path.abspath(qb.__file__))
+    ... )
+    True
+    '''
+    env = dict(env)
+    lib_dir = os.path.dirname(os.path.dirname(os.path.abspath(qb.__file__)))
+    paths = [path for path in env.get('PYTHONPATH', '').split(os.pathsep) if path]
+
+    if lib_dir not in paths:
+        env['PYTHONPATH'] = os.pathsep.join([lib_dir] + paths)
+
+    return env
+
+
+def launch(config):
+    '''
+    What the launcher process (see :func:`start`) does with it's `config`:
+    fork off the worker, in a new session so it has no controlling terminal,
+    and exit - the worker then can never get one.
+    '''
+    os.setsid()
+
+    if os.fork():
+        os._exit(0)
+
+    status_file = StatusFile(config['path'])
+
+    try:
+        detach()
+        status_file.update(pid = os.getpid())
+        run(
+            status_file,
+            load_connect_params(config['connect_params']),
+            config['refs'],
+            config['max_workers'],
+            config['interval'],
+        )
+    except BaseException:
+        # Nowhere to report this other than the status file
+        try:
+            status_file.update(
+                finished_at = time.time(),
+                error = str(sys.exc_info()[1]),
+            )
+        except BaseException:
+            pass
+    finally:
+        os._exit(0)
+
+
+def detach():
+    '''
+    Point the standard streams at `/dev/null` (STDIN was the launcher's
+    pipe), and close anything else the worker has open.
+    '''
+    null_fd = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(null_fd, fd)
+    os.close(null_fd)
+    os.closerange(3, max_fd())
+    os.chdir('/')
+
+
+def max_fd():
+    '''
+    One more than the highest file descriptor the process could have open.
+
+    >>> max_fd() > 2
+    True
+    '''
+    try:
+        limit = os.sysconf('SC_OPEN_MAX')
+    except (AttributeError, ValueError):
+        limit = -1
+
+    return limit if limit > 0 else MAXFD
+
+
+def run(status_file, connect_params, refs, max_workers, interval):
+    '''
+    What the worker does: pull each of `refs`, up to `max_workers` at a time,
+    recording their states in `status_file`.
+    '''
+    api = docker.APIClient(**connect_params)
+    pending = queue.Queue()
+
+    for ref in refs:
+        pending.put(ref)
+
+    def work():
+        while True:
+            try:
+                ref = pending.get_nowait()
+            except queue.Empty:
+                return
+            pull(api, status_file, ref, interval)
+
+    workers = [
+        threading.Thread(target = work)
+        for _ in range(min(max_workers, len(refs)))
+    ]
+
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+
+    for worker in workers:
+        worker.join()
+
+    status_file.update(finished_at = time.time())
+
+
+def pull(api, status_file, ref, interval=DEFAULT_INTERVAL):
+    '''
+    Pull one image for the worker, unless it's already here.
+    '''
+    started_at = time.time()
+
+    try:
+        try:
+            image = api.inspect_image(ref)
+        except NotFound:
+            image = None
+
+        if image is not None:
+            status_file.update_image(
+                ref,
+                state = PRESENT,
+                image_id = image['Id'],
+                finished_at = time.time(),
+            )
+            return
+
+        status_file.update_image(ref, state = PULLING, started_at = started_at)
+
+        progress = ProgressAggregator(
+            "Pulling {}".format(ref),
+            lambda line: status_file.update_image(ref, progress = line),
+            interval = interval,
+        )
+
+        name, tag = parse_repository_tag(ref)
+
+        for msg in api.pull(name, tag=tag, stream=True, decode=True):
+            if msg.get('error'):
+                raise Exception(msg['error'])
+            progress.feed(msg)
+
+        summary = progress.summary()
+        finished_at = time.time()
+
+        status_file.update_image(
+            ref,
+            state = PULLED,
+            image_id = api.inspect_image(ref)['Id'],
+            progress = progress.render() if progress.layers else None,
+            bytes = summary['bytes'],
+            layers = len(summary['layers']),
+            finished_at = finished_at,
+            seconds = round(finished_at - started_at, 3),
+        )
+
+    except Exception as error:
+        status_file.update_image(
+            ref,
+            state = FAILED,
+            error = str(error),
+            finished_at = time.time(),
+        )
+
+
+def wait(path, timeout=DEFAULT_TIMEOUT, poll_interval=POLL_INTERVAL):
+    '''
+    Wait for the prefetch recording to `path` to finish.
+
+    Images that are still going when we run out of `timeout`, or whose
+    worker died before getting to them, are reported as they are - check
+    their `state`.
+
+    :rtype:     dict
+    :return:    The final status, with `timed_out` and `worker_died` added,
+                or `None` if there's no status file at `path`.
+    '''
+    status_file = StatusFile(path)
+    deadline = time.time() + timeout
+
+    while True:
+        status = status_file.read()
+
+        if status is None:
+            return None
+
+        finished = status.get('finished_at') is not None
+        died = not finished and status.get('pid') and \
+            not pid_alive(status['pid'])
+
+        if finished or died or time.time() >= deadline:
+            status['timed_out'] = not (finished or died)
+            status['worker_died'] = bool(died)
+            return status
+
+        time.sleep(poll_interval)
+
+
+# Classes
+# ============================================================================
+
+class StatusFile:
+    '''
+    The JSON status file. Writes go to a temp file that's renamed into place,
+    so readers never see part of one, and are serialized between the
+    worker's threads.
+
+    >>> path = os.path.join(tempfile.mkdtemp(), 'status.json')
+    >>> status_file = StatusFile(path)
+    >>> status_file.read() is None
+    True
+    >>> status_file.write(dict(images={'redis:4': dict(state=PENDING)}))
+    >>> status_file.update_image('redis:4', state=PULLED, bytes=100)
+    >>> status_file.read()['images']['redis:4'] == dict(
+    ...     bytes=100,
+    ...     state=PULLED,
+    ... )
+    True
+    >>> status_file.remove()
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # What we last wrote - the worker owns the file, so it doesn't need
+        # to read it back
+        self.status = None
+
+
+    def read(self):
+        '''
+        :rtype:     dict or `None`
+        :return:    `None` if there's no (readable) status file.
+        '''
+        try:
+            with open(self.path, 'r') as file:
+                return json.load(file)
+        except (IOError, OSError, ValueError):
+            return None
+
+
+    def write(self, status):
+        with self.lock:
+            self.status = status
+            self.flush()
+
+
+    def update(self, **values):
+        with self.lock:
+            if self.status is None:
+                self.status = self.read() or dict(images={})
+            self.status.update(values)
+            self.flush()
+
+
+    def update_image(self, ref, **values):
+        with self.lock:
+            if self.status is None:
+                self.status = self.read() or dict(images={})
+            self.status['images'].setdefault(ref, {}).update(values)
+            self.flush()
+
+
+    def flush(self):
+        directory = os.path.dirname(self.path)
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as file:
+            json.dump(self.status, file, indent=2, sort_keys=True)
+        os.rename(temp_path, self.path)
+
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def main(stdin=sys.stdin):
+    '''
+    Launch a worker from the JSON config on `stdin` (see :func:`start`).
+    Doctests run with `python -m doctest`.
+    '''
+    config = json.loads(stdin.read())
+
+    # Done with it - the worker shouldn't hold the pipe open
+    stdin.close()
+
+    launch(config)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+##############################################################################
+# Coalescing the per-layer progress messages from Docker pulls and pushes
+# into one status line every so often (plus a summary at the end), instead of
+# writing every single one of them out.
+##############################################################################
+
+# Imports
+# ============================================================================
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import re
+import time
+
+
+# Constants
+# ============================================================================
+
+# Seconds between status lines, unless told otherwise (4 Hz).
+#
+DEFAULT_INTERVAL = 0.25
+
+# Layer messages have short image IDs as their `id` (others, like
+# `Pulling from ...`, have the tag).
+#
+LAYER_ID_RE = re.compile(r'\A[0-9a-f]{12}\Z')
+
+# Statuses (prefixes) that mean a layer is done.
+#
+DONE_STATUSES = (
+    'Pull complete',
+    'Already exists',
+    'Pushed',
+    'Layer already exists',
+    'Mounted from',
+)
+
+
+# Functions
+# ============================================================================
+
+def is_layer_progress(msg):
+    '''
+    Is `msg` (from the Docker API stream) a layer progress message?
+
+    >>> is_layer_progress({'id': '3c3a4604a545', 'status': 'Downloading'})
+    True
+    >>> is_layer_progress({'id': 'latest', 'status': 'Pulling from redis'})
+    False
+    >>> is_layer_progress({'stream': 'Step 1/3 : FROM alpine'})
+    False
+    '''
+    return (
+        isinstance(msg, dict) and
+        'status' in msg and
+        'error' not in msg and
+        LAYER_ID_RE.match(msg.get('id') or '') is not None
+    )
+
+
+def format_mb(size):
+    return "{:.1f} MB".format(size / 1e6)
+
+
+# Classes
+# ============================================================================
+
+class ProgressAggregator:
+    '''
+    Tracks per-layer state from Docker pull/push progress messages and writes
+    a consolidated status line at most once per `interval` seconds through
+    `emit`, then a summary from :meth:`finish`.
+
+    >>> lines = []
+    >>> now = [0.0]
+    >>> progress = ProgressAggregator(
+    ...     'Pulling redis:4', lines.append, clock=lambda: now[0]
+    ... )
+    >>> for layer in ('aaaaaaaaaaaa', 'bbbbbbbbbbbb'):
+    ...     progress.feed({'id': layer, 'status': 'Pulling fs layer'})
+    True
+    True
+    >>> progress.feed({'id': 'aaaaaaaaaaaa', 'status': 'Downloading',
+    ...     'progressDetail': {'current': 500000, 'total': 2000000}})
+    True
+    >>> now[0] = 0.3
+    >>> progress.feed({'id': 'aaaaaaaaaaaa', 'status': 'Pull complete'})
+    True
+    >>> progress.feed({'id': 'bbbbbbbbbbbb', 'status': 'Already exists'})
+    True
+    >>> progress.feed({'status': 'Digest: sha256:abc'})
+    False
+    >>> now[0] = 2.0
+    >>> progress.finish()
+    >>> print('\\n'.join(lines))
+    Pulling redis:4: 0/1 layers done, 0.0 / 0.0 MB, pulling fs layer 1
+    Pulling redis:4: 1/2 layers done, 2.0 / 2.0 MB, pulling fs layer 1
+    Pulling redis:4: 2/2 layers done, 2.0 / 2.0 MB
+    Pulling redis:4 done: 2 layers, 2.0 MB in 2.0s (1.0 MB/s)
+      aaaaaaaaaaaa  Pull complete          2.0 MB    0.3s
+      bbbbbbbbbbbb  Already exists         0.0 MB    0.3s
+    '''
+
+    def __init__(self, title, emit, interval=DEFAULT_INTERVAL, clock=time.time):
+        self.title = title
+        self.emit = emit
+        self.interval = interval
+        self.clock = clock
+        self.started_at = clock()
+        self.last_emit_at = None
+        # Has anything changed since the last status line?
+        self.dirty = False
+        self.layers = {}
+        # Layer IDs in the order they showed up
+        self.order = []
+
+
+    def feed(self, msg):
+        '''
+        Take a message from the stream.
+
+        :rtype:     bool
+        :return:    `True` if it was layer progress that we're handling,
+                    `False` if it wasn't (and the caller should write it out
+                    as usual).
+        '''
+        if not is_layer_progress(msg):
+            return False
+
+        now = self.clock()
+        layer_id = msg['id']
+        layer = self.layers.get(layer_id)
+
+        if layer is None:
+            layer = dict(
+                status = None,
+                current = 0,
+                total = 0,
+                started_at = now,
+                finished_at = None,
+            )
+            self.layers[layer_id] = layer
+            self.order.append(layer_id)
+
+        status = msg['status']
+        layer['status'] = status
+        detail = msg.get('progressDetail') or {}
+
+        # Only the transfer counts as the layer's size - extracting reports
+        # progress too, in different units
+        if status in ('Downloading', 'Pushing') and detail:
+            layer['current'] = detail.get('current') or 0
+            layer['total'] = max(layer['total'], detail.get('total') or 0)
+
+        elif status in ('Download complete', 'Pushed'):
+            layer['current'] = layer['total']
+
+        if status.startswith(DONE_STATUSES):
+            layer['current'] = layer['total']
+            layer['finished_at'] = now
+
+        self.dirty = True
+
+        if self.last_emit_at is None or \
+                now - self.last_emit_at >= self.interval:
+            self.emit(self.render())
+            self.last_emit_at = now
+            self.dirty = False
+
+        return True
+
+
+    def done_count(self):
+        return sum(
+            1 for layer in self.layers.values()
+            if layer['finished_at'] is not None
+        )
+
+
+    def render(self):
+        '''
+        The current status, as one line.
+
+        :rtype: str
+        '''
+        in_progress = {}
+        for layer_id in self.order:
+            layer = self.layers[layer_id]
+            if layer['finished_at'] is None:
+                status = layer['status'].lower()
+                in_progress[status] = in_progress.get(status, 0) + 1
+
+        parts = [
+            "{}/{} layers done".format(self.done_count(), len(self.layers)),
+            "{:.1f} / {}".format(
+                sum(layer['current'] for layer in self.layers.values()) / 1e6,
+                format_mb(sum(layer['total'] for layer in self.layers.values())),
+            ),
+        ]
+
+        parts.extend(
+            "{} {}".format(status, count)
+            for status, count in sorted(in_progress.items())
+        )
+
+        return "{}: {}".format(self.title, ', '.join(parts))
+
+
+    def summary(self):
+        '''
+        :rtype:     dict
+        :return:    `layers` (dict of ID to `status`, `bytes` and `seconds`),
+                    total `bytes` and `seconds`.
+        '''
+        now = self.clock()
+        return dict(
+            layers = dict(
+                (
+                    layer_id,
+                    dict(
+                        status = layer['status'],
+                        bytes = layer['total'],
+                        seconds = round(
+                            (layer['finished_at'] or now) - layer['started_at'],
+                            3,
+                        ),
+                    ),
+                )
+                for layer_id, layer in self.layers.items()
+            ),
+            bytes = sum(layer['total'] for layer in self.layers.values()),
+            seconds = round(now - self.started_at, 3),
+        )
+
+
+    def finish(self):
+        '''
+        Write the last status (if anything's changed since the last one) and
+        a summary of each layer's size and time.
+        '''
+        if not self.layers:
+            return
+
+        if self.dirty:
+            self.emit(self.render())
+            self.dirty = False
+
+        summary = self.summary()
+        seconds = summary['seconds']
+
+        self.emit(
+            "{} done: {} layers, {} in {:.1f}s ({:.1f} MB/s)".format(
+                self.title,
+                len(self.layers),
+                format_mb(summary['bytes']),
+                seconds,
+                summary['bytes'] / seconds / 1e6 if seconds > 0 else 0.0,
+            )
+        )
+
+        for layer_id in self.order:
+            layer = summary['layers'][layer_id]
+            self.emit(
+                "  {}  {:<20} {:>8} {:>6.1f}s".format(
+                    layer_id,
+                    layer['status'],
+                    format_mb(layer['bytes']),
+                    layer['seconds'],
+                )
+            )
+
+
+# testing - run the doctests
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,293 @@
+##############################################################################
+# Picking which images to get rid of on hosts that pile them up (build
+# boxes, mostly), from one listing of the daemon's images and containers.
+#
+# Policies ({select}):
+#
+# -   `keep_last` - keep the N newest tags of each repository.
+# -   `older_than` - only remove tags of images created longer ago than that.
+# -   `dangling` - remove untagged images.
+#
+# Tag policies only apply to repositories matching a pattern, which has to
+# be given (`*` for all of them) - otherwise they'd take out base images and
+# anything else on the host nobody's running right now.
+#
+# Images used by containers - running or not - are never picked.
+#
+# Removing is done by `qb_docker_image`'s `prune` state; this is just the
+# deciding, so it's easy to check.
+##############################################################################
+
+# Imports
+# ============================================================================
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import re
+import time
+import fnmatch
+
+
+# Constants
+# ============================================================================
+
+NONE_TAG = '<none>:<none>'
+
+AGE_RE = re.compile(r'\A\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*\Z')
+
+AGE_UNITS = dict(
+    s = 1,
+    m = 60,
+    h = 60 * 60,
+    d = 24 * 60 * 60,
+    w = 7 * 24 * 60 * 60,
+)
+
+
+# Functions
+# ============================================================================
+
+def parse_age(value):
+    '''
+    Seconds from an age like `'12h'` or `'2w'` (units are `s`, `m`, `h`,
+    `d` and `w`; none means seconds).
+
+    >>> parse_age('7d')
+    604800
+    >>> parse_age('90')
+    90
+    >>> parse_age(3600)
+    3600
+    >>> parse_age('soon')
+    Traceback (most recent call last):
+        ...
+    ValueError: Bad age 'soon', expected a number with an optional s, m, h, d or w unit
+    '''
+    if isinstance(value, (int, float)):
+        return int(value)
+
+    match = AGE_RE.match(value)
+
+    if match is None:
+        raise ValueError(
+            (
+                "Bad age {!r}, expected a number with an optional " +
+                "s, m, h, d or w unit"
+            ).format(value)
+        )
+
+    return int(float(match.group(1)) * AGE_UNITS[match.group(2) or 's'])
+
+
+def split_ref(ref):
+    '''
+    Repository and tag of a `name:tag` ref (registry ports and all).
+
+    >>> split_ref('localhost:5000/nrser/qb:0.1.2')
+    ('localhost:5000/nrser/qb', '0.1.2')
+    >>> split_ref('redis')
+    ('redis', 'latest')
+    '''
+    repository, _, tag = ref.rpartition(':')
+
+    if not repository or '/' in tag:
+        return ref, 'latest'
+
+    return repository, tag
+
+
+def image_tags(image):
+    '''
+    Real tags of an image from the daemon's image list.
+
+    >>> image_tags({'RepoTags': ['redis:4', '<none>:<none>']})
+    ['redis:4']
+    >>> image_tags({'RepoTags': None})
+    []
+    '''
+    return [
+        tag for tag in (image.get('RepoTags') or [])
+        if tag != NONE_TAG
+    ]
+
+
+def check_repository(repository, keep_last=None, older_than=None):
+    '''
+    Make sure the `repository` pattern for :func:`select` is one it can use.
+
+    >>> check_repository('localhost:5000/nrser/*', keep_last=3)
+    >>> check_repository(None)
+
+    :raises:    :class:`ValueError` if there are tag policies and no
+                pattern, or the pattern has a tag (which would never match).
+    '''
+    if repository is None:
+        if keep_last is not None or older_than is not None:
+            raise ValueError(
+                "Tag policies (keep last, older than) need a repository " +
+                "pattern (`name`) - use '*' for every repository"
+            )
+        return
+
+    if ':' in repository.rpartition('/')[2]:
+        raise ValueError(
+            (
+                "Repository pattern (`name`) {!r} has a tag - give just " +
+                "the repository, the policies pick the tags"
+            ).format(repository)
+        )
+
+
+def select(
+    images,
+    used_image_ids=(),
+    keep_last=None,
+    older_than=None,
+    dangling=False,
+    repository=None,
+    now=None,
+):
+    '''
+    Pick what to remove.
+
+    Tags are only picked if there's a `keep_last` or `older_than` policy; a
+    tag has to fall outside both to go, and be in a repository matching
+    `repository`, which those policies need. Untagged images are picked when
+    `dangling` is on, whatever their age.
+
+    >>> day = 24 * 60 * 60
+    >>> images = [
+    ...     dict(Id='a', RepoTags=['app:1'], Created=0 * day, Size=100),
+    ...     dict(Id='b', RepoTags=['app:2', 'app:old'], Created=1 * day,
+    ...         Size=200),
+    ...     dict(Id='c', RepoTags=['app:3'], Created=2 * day, Size=300),
+    ...     dict(Id='d', RepoTags=['app:4'], Created=9 * day, Size=400),
+    ...     dict(Id='e', RepoTags=['<none>:<none>'], Created=0, Size=50),
+    ...     dict(Id='f', RepoTags=['redis:4'], Created=0, Size=500),
+    ... ]
+    >>> plan = select(images, used_image_ids=['c'], keep_last=1,
+    ...     older_than='3d', dangling=True, repository='app', now=10 * day)
+    >>> [(target['ref'], target['reason']) for target in plan['targets']]
+    [('app:1', 'tag'), ('app:2', 'tag'), ('app:old', 'tag'), ('e', 'dangling')]
+    >>> plan['in_use']
+    ['app:3']
+    >>> plan['estimated_bytes']
+    350
+    >>> select(images, keep_last=1)
+    Traceback (most recent call last):
+        ...
+    ValueError: Tag policies (keep last, older than) need a repository pattern (`name`) - use '*' for every repository
+    >>> select(images, keep_last=1, repository='app:1')
+    Traceback (most recent call last):
+        ...
+    ValueError: Repository pattern (`name`) 'app:1' has a tag - give just the repository, the policies pick the tags
+
+    :param images:          From the daemon's image list (`client.images()`).
+    :param used_image_ids:  IDs of images containers are using.
+    :param keep_last:       Newest tags to keep per repository.
+    :param older_than:      Age (see :func:`parse_age`) tags must be older
+                            than to go.
+    :param dangling:        Pick untagged images?
+    :param repository:      Only pick tags in repositories matching this
+                            (:mod:`fnmatch` pattern, without a tag).
+                            Required with `keep_last` or `older_than`.
+    :param now:             Time to measure ages from.
+
+    :rtype:     dict
+    :return:    `targets`, a list of dicts with the `ref` to remove (tag, or
+                image ID when dangling), `image_id`, `reason` (`'tag'` or
+                `'dangling'`) and `size`; `in_use`, refs we'd have picked but
+                containers use; `kept`, count of tags kept; and
+                `estimated_bytes`, the size of the images all of whose tags
+                are targets.
+    '''
+    check_repository(repository, keep_last, older_than)
+
+    if now is None:
+        now = time.time()
+
+    max_created = None
+    if older_than is not None:
+        max_created = now - parse_age(older_than)
+
+    used_image_ids = set(used_image_ids)
+    by_repository = {}
+    targets = []
+    in_use = []
+    kept = 0
+
+    for image in images:
+        tags = image_tags(image)
+
+        if not tags:
+            if dangling:
+                if image['Id'] in used_image_ids:
+                    in_use.append(image['Id'])
+                else:
+                    targets.append(dict(
+                        ref = image['Id'],
+                        image_id = image['Id'],
+                        reason = 'dangling',
+                        size = image.get('Size') or 0,
+                    ))
+            continue
+
+        for tag in tags:
+            name = split_ref(tag)[0]
+            if repository is None or fnmatch.fnmatchcase(name, repository):
+                by_repository.setdefault(name, []).append((tag, image))
+
+    if keep_last is not None or older_than is not None:
+        for name in sorted(by_repository):
+            # Newest first
+            tagged = sorted(
+                by_repository[name],
+                key = lambda pair: (-(pair[1].get('Created') or 0), pair[0]),
+            )
+
+            for index, (tag, image) in enumerate(tagged):
+                if (
+                    (keep_last is not None and index < keep_last) or
+                    (
+                        max_created is not None and
+                        (image.get('Created') or 0) >= max_created
+                    )
+                ):
+                    kept += 1
+                elif image['Id'] in used_image_ids:
+                    in_use.append(tag)
+                else:
+                    targets.append(dict(
+                        ref = tag,
+                        image_id = image['Id'],
+                        reason = 'tag',
+                        size = image.get('Size') or 0,
+                    ))
+
+    # Tags first, then dangling images
+    targets.sort(
+        key = lambda target: (target['reason'] != 'tag', target['ref'])
+    )
+
+    target_refs = set(target['ref'] for target in targets)
+
+    return dict(
+        targets = targets,
+        in_use = sorted(in_use),
+        kept = kept,
+        estimated_bytes = sum(
+            image.get('Size') or 0
+            for image in images
+            if image['Id'] in target_refs or (
+                image_tags(image) and
+                set(image_tags(image)) <= target_refs
+            )
+        ),
+    )
+
+
+# testing - run the doctests
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
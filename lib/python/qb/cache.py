@@ -0,0 +1,161 @@
+##############################################################################
+# Simple on-disk cache of JSON values, for things that are expensive to get
+# (RPC calls, daemon round trips) and stay the same across processes and
+# runs.
+#
+# Values live in
+#
+#     <cache_dir()>/<namespace>/<key>.json
+#
+# Put whatever invalidates a value (versions, digests...) in it's `key`; old
+# keys are just never read again.
+##############################################################################
+
+# Imports
+# ============================================================================
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import re
+import json
+import hashlib
+import tempfile
+
+import qb
+
+
+# Constants
+# ============================================================================
+
+# Set this ENV var to put the cache somewhere other than the default (see
+# {cache_dir}).
+#
+CACHE_DIR_ENV_VAR_NAME = 'QB_CACHE_DIR'
+
+# Characters we don't put in file names.
+#
+UNSAFE_KEY_CHARS_RE = re.compile(r'[^0-9A-Za-z._-]+')
+
+
+# Functions
+# ============================================================================
+
+def cache_dir(env=os.environ):
+    '''
+    Root directory for QB's cache: `QB_CACHE_DIR` if it's set, otherwise `qb`
+    in `XDG_CACHE_HOME` (which defaults to `~/.cache`).
+
+    >>> cache_dir({'QB_CACHE_DIR': '/tmp/qb-cache'})
+    '/tmp/qb-cache'
+    >>> cache_dir({'XDG_CACHE_HOME': '/var/cache'})
+    '/var/cache/qb'
+    '''
+    if env.get(CACHE_DIR_ENV_VAR_NAME):
+        return env[CACHE_DIR_ENV_VAR_NAME]
+
+    return os.path.join(
+        env.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+        'qb',
+    )
+
+
+def path_for(namespace, key, env=os.environ):
+    '''
+    File path for a cached value.
+
+    >>> path_for('docker', 'unix:///var/run/docker.sock',
+    ...     {'QB_CACHE_DIR': '/c'})
+    '/c/docker/unix_var_run_docker.sock.json'
+    '''
+    safe_key = UNSAFE_KEY_CHARS_RE.sub('_', key)
+    return os.path.join(cache_dir(env), namespace, safe_key + '.json')
+
+
+def load(namespace, key, default=None):
+    '''
+    Read a cached value, or `default` if there isn't one (or we can't read
+    it).
+
+    >>> load('qb.cache.doctest', 'nope') is None
+    True
+    '''
+    try:
+        with open(path_for(namespace, key), 'r') as file:
+            return json.load(file)
+    except (IOError, OSError, ValueError):
+        return default
+
+
+def dump(namespace, key, value):
+    '''
+    Write a value to the cache. Goes to a temp file first and then gets
+    renamed into place, so concurrent readers never see half of it.
+
+    Failing to write isn't an error - it's just a cache - so this returns
+    `False` instead of raising.
+
+    >>> import shutil
+    >>> os.environ['QB_CACHE_DIR'] = tempfile.mkdtemp()
+    >>> dump('qb.cache.doctest', 'x', dict(a=1))
+    True
+    >>> load('qb.cache.doctest', 'x') == {'a': 1}
+    True
+    >>> shutil.rmtree(os.environ.pop('QB_CACHE_DIR'))
+    '''
+    path = path_for(namespace, key)
+    directory = os.path.dirname(path)
+
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as file:
+            json.dump(value, file)
+        os.rename(temp_path, path)
+    except (IOError, OSError):
+        return False
+
+    return True
+
+
+def clear(namespace, key):
+    '''
+    Remove a cached value, if there is one.
+
+    :rtype:     bool
+    :return:    `True` if something was removed.
+    '''
+    try:
+        os.remove(path_for(namespace, key))
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def file_digest(*paths):
+    '''
+    SHA-256 hex digest of the contents of one or more files.
+    '''
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(64 * 1024), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def qb_version():
+    '''
+    QB's version, from the `//VERSION` file (same place the gem gets it).
+    '''
+    with open(os.path.join(qb.ROOT, 'VERSION'), 'r') as file:
+        return file.read().strip()
+
+
+# testing - run the doctests
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -19,12 +19,21 @@ import os
 # {requests_unixsocket} package.
 import urllib
 
+# {SocketClient} speaks HTTP over it's own UNIX socket
+import json
+import socket
+import threading
+
+# {CallCache} is an LRU with optional expiry
+import time
+from collections import OrderedDict
+
 # Deps
 # ----------------------------------------------------------------------------
-
-# Facilities making requests to UNIX domain sockets with the {requests}
-# package.
-import requests_unixsocket
+# 
+# {requests_unixsocket} (and {requests}) are imported on demand in {Client},
+# since they take a while to load and {SocketClient} doesn't need them.
+# 
 
 
 # Constants
@@ -36,6 +45,21 @@ import requests_unixsocket
 # 
 RPC_SOCKET_ENV_VAR_NAME = 'QB_RPC_SOCKET'
 
+# Set this ENV var to `requests` to have {client_from_env} create a {Client}
+# (using the {requests} package) instead of the default {SocketClient}.
+# 
+CLIENT_ENV_VAR_NAME = 'QB_RPC_CLIENT'
+
+# Max number of results the {CallCache} holds. Set it to `0` to turn caching
+# off.
+# 
+CACHE_SIZE_ENV_VAR_NAME = 'QB_RPC_CACHE_SIZE'
+
+# Seconds {CallCache} results are good for. Unset (the default) means they
+# don't expire.
+# 
+CACHE_TTL_ENV_VAR_NAME = 'QB_RPC_CACHE_TTL'
+
 
 # Module Variables
 # ============================================================================
@@ -65,7 +89,12 @@ _client = None
 #
 
 def client_from_env():
-    return Client(socket_path=os.environ[RPC_SOCKET_ENV_VAR_NAME])
+    socket_path = os.environ[RPC_SOCKET_ENV_VAR_NAME]
+    
+    if os.environ.get(CLIENT_ENV_VAR_NAME) == 'requests':
+        return Client(socket_path=socket_path)
+    
+    return SocketClient(socket_path=socket_path)
 
 
 def requests_path_for(socket_path):
@@ -116,13 +145,450 @@ def send(receiver, method, *args, **kwds):
     return get_client().send(receiver, method, *args, **kwds)
 
 
-class Client:
+def send_many(calls):
+    return get_client().send_many(calls)
+
+
+def batch():
+    return get_client().batch()
+
+
+def cache_stats():
+    '''
+    :rtype:     dict
+    :return:    :meth:`CallCache.stats` for the default client's cache, or
+                `None` if it doesn't have one.
+    '''
+    cache = get_client().cache
+    if cache is None:
+        return None
+    return cache.stats()
+
+
+def call_payload(receiver, method, args=(), kwds=None):
+    '''
+    Build the JSON-able dict the server expects for a call to `/send` (and
+    for each entry in a `/batch`).
+
+    :rtype:     dict
+    '''
+    return dict(
+        receiver = receiver,
+        method = method,
+        args = list(args),
+        kwds = kwds or {},
+    )
+
+
+def check_status(method, path, status, body):
+    '''
+    Raise :class:`RPCError` if `status` isn't a 2xx, with the server's
+    `message` if it sent one, and whatever it did send if not.
+
+    >>> check_status('GET', '/status', 200, b'{}')
+    >>> try:
+    ...     check_status('POST', '/send', 500, b'{"message": "boom"}')
+    ... except RPCError as error:
+    ...     print(error, error.status)
+    POST /send failed with HTTP 500 - boom 500
+    >>> try:
+    ...     check_status('POST', '/send', 502, b'<h1>Bad Gateway</h1>')
+    ... except RPCError as error:
+    ...     print(error)
+    POST /send failed with HTTP 502 - <h1>Bad Gateway</h1>
+    '''
+    if 200 <= status < 300:
+        return
+
+    text = body.decode('utf-8', 'replace').strip()
+
+    try:
+        message = json.loads(text)['message']
+    except (ValueError, KeyError, TypeError):
+        message = text or "(empty response)"
+
+    raise RPCError(
+        "{} {} failed with HTTP {} - {}".format(method, path, status, message),
+        status = status,
+        body = body,
+    )
+
+
+# Classes
+# ============================================================================
+
+class RPCError(Exception):
+    '''
+    Raised when the server reports that a call failed, or responds with an
+    HTTP error (see :func:`check_status`), in which case `status` and `body`
+    are set.
+    '''
+
+    def __init__(self, message, error_class=None, status=None, body=None):
+        Exception.__init__(self, message)
+        self.error_class = error_class
+        self.status = status
+        self.body = body
+
+
+class CallCache:
+    '''
+    Bounded LRU of `/send` results, with optional expiry.
+
+    Only calls the server says are *pure* (it sets `pure: true` in the
+    response, see `PURE_METHODS` in `//lib/qb/ipc/rpc/server.rb`) are stored,
+    so this is safe to leave on: anything else still goes to the server
+    every time.
+
+    Results are stored as their JSON, so callers can't mess up each other's
+    copies.
+
+    >>> cache = CallCache(max_size=2)
+    >>> key = cache.key_for(call_payload('QB::Package::Version', 'from', ['1']))
+    >>> cache.get(key)
+    (False, None)
+    >>> cache.set(key, dict(major=1))
+    >>> cache.get(key) == (True, {'major': 1})
+    True
+    >>> for string in ['2', '3']:
+    ...     cache.set(
+    ...         cache.key_for(
+    ...             call_payload('QB::Package::Version', 'from', [string])
+    ...         ),
+    ...         string,
+    ...     )
+    >>> cache.get(key)
+    (False, None)
+    >>> sorted(cache.stats().items())
+    [('evictions', 1), ('hits', 1), ('max_size', 2), ('misses', 2), ('size', 2), ('ttl', None)]
+    '''
+
+    DEFAULT_MAX_SIZE = 1024
+
+
+    @classmethod
+    def from_env(cls, env=os.environ):
+        '''
+        Create a cache configured by the `QB_RPC_CACHE_SIZE` and
+        `QB_RPC_CACHE_TTL` ENV vars.
+
+        :rtype:     :class:`CallCache` or `None`
+        :return:    `None` if the size is `0` (caching is off).
+
+        >>> CallCache.from_env({'QB_RPC_CACHE_SIZE': '0'}) is None
+        True
+        >>> CallCache.from_env({'QB_RPC_CACHE_TTL': '30'}).ttl
+        30.0
+        '''
+        max_size = int(env.get(CACHE_SIZE_ENV_VAR_NAME, cls.DEFAULT_MAX_SIZE))
+        if max_size <= 0:
+            return None
+
+        ttl = env.get(CACHE_TTL_ENV_VAR_NAME)
+        return cls(
+            max_size = max_size,
+            ttl = float(ttl) if ttl else None,
+        )
+
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, ttl=None, clock=time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def key_for(self, payload):
+        '''
+        :param payload:     A `/send` payload (see :func:`call_payload`).
+
+        :rtype:     str or `None`
+        :return:    Key for the call, or `None` if it's not something we
+                    could cache (receiver isn't a constant name, or the args
+                    don't serialize).
+        '''
+        if not isinstance(payload['receiver'], (str, type(u''))):
+            return None
+        try:
+            return json.dumps(
+                [
+                    payload['receiver'],
+                    payload['method'],
+                    payload['args'],
+                    payload['kwds'],
+                ],
+                sort_keys = True,
+            )
+        except (TypeError, ValueError):
+            return None
+
+
+    def get(self, key):
+        '''
+        :rtype:     tuple
+        :return:    `(True, result)` on a hit, `(False, None)` on a miss.
+        '''
+        with self.lock:
+            entry = self.entries.pop(key, None)
+
+            if entry is not None and (
+                entry[0] is None or entry[0] > self.clock()
+            ):
+                # Put it back at the most-recently-used end
+                self.entries[key] = entry
+                self.hits += 1
+                return (True, json.loads(entry[1]))
+
+            self.misses += 1
+            return (False, None)
+
+
+    def set(self, key, result):
+        expires_at = None if self.ttl is None else self.clock() + self.ttl
+
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (expires_at, json.dumps(result))
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+    def stats(self):
+        '''
+        :rtype:     dict
+        :return:    `hits`, `misses`, `evictions`, current `size`, and the
+                    `max_size` and `ttl` settings.
+        '''
+        with self.lock:
+            return dict(
+                hits = self.hits,
+                misses = self.misses,
+                evictions = self.evictions,
+                size = len(self.entries),
+                max_size = self.max_size,
+                ttl = self.ttl,
+            )
+
+
+class Call:
+    '''
+    A call queued in a :class:`Batch`, which gets it's result when the batch
+    is sent.
+    '''
+
+    def __init__(self, receiver, method, args, kwds):
+        self.payload = call_payload(receiver, method, args, kwds)
+        self.done = False
+        self.data = None
+        self.error = None
+
+
+    def resolve(self, response):
+        '''
+        Set the result from the call's entry in the `/batch` response.
+        '''
+        self.done = True
+        if 'error' in response:
+            self.error = response['error']
+        else:
+            self.data = response.get('data')
+
+
+    def result(self):
+        '''
+        :return:    The call's data.
+        :raises:    :class:`RPCError` if the call failed on the server, or
+                    :class:`RuntimeError` if the batch hasn't been sent yet.
+        '''
+        if not self.done:
+            raise RuntimeError(
+                "Batch has not been sent, no result for {}".format(
+                    self.payload
+                )
+            )
+        if self.error is not None:
+            raise RPCError(
+                self.error.get('message'),
+                error_class = self.error.get('class'),
+            )
+        return self.data
+
+
+class Batch:
+    '''
+    Collects calls and sends them to the server in a single `/batch` request.
+
+    Usage:
+
+        with client.batch() as batch:
+            calls = [
+                batch.send('QB::Package::Version', 'from', string)
+                for string in strings
+            ]
+        
+        versions = [call.result() for call in calls]
+
+    The batch is sent when the `with` block exits (unless it raised), or when
+    you call :meth:`flush`.
+    '''
+
+    def __init__(self, client):
+        self.client = client
+        self.pending = []
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        return False
+
+
+    def send(self, receiver, method, *args, **kwds):
+        '''
+        Queue a call. Same signature as :meth:`Client.send`.
+
+        :rtype:     :class:`Call`
+        '''
+        call = Call(receiver, method, args, kwds)
+        self.pending.append(call)
+        return call
+
+
+    def flush(self):
+        '''
+        Send any queued calls.
+
+        :rtype:     list
+        :return:    The :class:`Call` instances that were sent.
+        '''
+        calls = self.pending
+        self.pending = []
+
+        if calls:
+            responses = self.client.send_many(
+                [call.payload for call in calls]
+            )
+            for call, response in zip(calls, responses):
+                call.resolve(response)
+
+        return calls
+
+
+class BaseClient:
+    '''
+    The parts of the RPC client that are the same regardless of how we talk
+    HTTP. Subclasses provide `request(method, path, body=b'')`, which
+    returns the response body - raising :class:`RPCError` for HTTP errors
+    (see :func:`check_status`).
+
+    :attr cache:    :class:`CallCache` for pure `/send` calls, or `None` to
+                    not cache. Defaults to :meth:`CallCache.from_env`.
+    '''
+
+    def __init__(self, cache=None):
+        if cache is None:
+            cache = CallCache.from_env()
+        self.cache = cache
+
+
+    def get(self, path):
+        return json.loads(self.request('GET', path).decode('utf-8'))['data']
+
+
+    def post_values(self, path, **payload):
+        '''
+        :rtype:     dict
+        :return:    The whole decoded response (`data` and anything else the
+                    server sent along with it).
+        '''
+        return json.loads(
+            self.request(
+                'POST',
+                path,
+                json.dumps(payload).encode('utf-8'),
+            ).decode('utf-8')
+        )
+
+
+    def post(self, path, **payload):
+        return self.post_values(path, **payload)['data']
+
+
+    def send(self, receiver, method, *args, **kwds):
+        payload = call_payload(receiver, method, args, kwds)
+
+        key = None
+        if self.cache is not None:
+            key = self.cache.key_for(payload)
+            if key is not None:
+                hit, data = self.cache.get(key)
+                if hit:
+                    return data
+
+        values = self.post_values('/send', **payload)
+
+        if key is not None and values.get('pure'):
+            self.cache.set(key, values['data'])
+
+        return values['data']
+    
+    
+    def send_many(self, calls):
+        '''
+        Send a list of calls in one `/batch` request.
+
+        :param calls:   List of dicts with `receiver`, `method` and optional
+                        `args` and `kwds` keys (see :func:`call_payload`).
+
+        :rtype:     list
+        :return:    One dict per call, in order, with either a `data` key
+                    holding the result or an `error` key holding a dict with
+                    the `message` and `class` of what was raised.
+        '''
+        return self.post(
+            '/batch',
+            calls = [call_payload(**call) for call in calls],
+        )
+    
+    
+    def batch(self):
+        '''
+        :rtype:     :class:`Batch`
+        :return:    A new batch for this client, best used as a context manager.
+        '''
+        return Batch(self)
+
+
+class Client(BaseClient):
     '''
     RPC client for making calls to the QB master Ruby process (HTTP over 
-    a UNIX domain socket).
+    a UNIX domain socket) using :mod:`requests_unixsocket`.
+    
+    :class:`SocketClient` is the lighter-weight default; set the
+    `QB_RPC_CLIENT` ENV var to `requests` to use this one.
     '''
 
-    def __init__(self, socket_path):
+    def __init__(self, socket_path, cache=None):
+        # Facilities making requests to UNIX domain sockets with the
+        # {requests} package.
+        import requests_unixsocket
+
+        BaseClient.__init__(self, cache=cache)
         self.socket_path = socket_path
         self.session = requests_unixsocket.Session()
         self.requests_path = requests_path_for(self.socket_path)
@@ -134,37 +600,196 @@ class Client:
         return os.path.join(self.requests_path, path)
 
 
-    def handle_response(self, response):
-        return response.json()['data']
-
-
-    def get(self, path):
-        return self.handle_response(
-            self.session.get(
-                self.full_path_for(path)
-            )
+    def request(self, method, path, body=b''):
+        response = self.session.request(
+            method,
+            self.full_path_for(path),
+            data = body,
+            headers = {'Content-Type': 'application/json'},
         )
-    
+        check_status(method, path, response.status_code, response.content)
+        return response.content
 
-    def post(self, path, **payload):
-        return self.handle_response(
-            self.session.post(
-                self.full_path_for(path),
-                json = payload,
-            )
-        )
+
+class SocketClient(BaseClient):
+    '''
+    RPC client that speaks just enough HTTP/1.1 to talk to the QB master over
+    it's own UNIX socket: `Content-Length` framed requests, and responses
+    framed by `Content-Length`, chunked encoding or the server closing the
+    connection.
     
+    Keeps the socket open between calls unless the server says
+    `Connection: close` (Unicorn always does), in which case it just
+    connects again next time - still a lot cheaper than going through
+    :mod:`requests`, and nothing to import.
     
-    def send(self, receiver, method, *args, **kwds):
-        return self.handle_response(
-            self.session.post(
-                self.full_path_for('/send'),
-                json = dict(
-                    receiver = receiver,
-                    method = method,
-                    args = args,
-                    kwds = kwds,
-                )
-            )
-        )
+    Calls are serialized with a lock, so instances are safe to share between
+    threads.
+    '''
+
+    RECV_SIZE = 64 * 1024
 
+
+    def __init__(self, socket_path, timeout=None, cache=None):
+        BaseClient.__init__(self, cache=cache)
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.socket = None
+        self.buffer = b''
+        # Whether :attr:`socket` has had a response on it - only then can it
+        # have gone stale between calls, see :meth:`request`
+        self.kept_alive = False
+        self.lock = threading.Lock()
+
+
+    def connect(self):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(self.timeout)
+        self.socket.connect(self.socket_path)
+        self.buffer = b''
+        self.kept_alive = False
+
+
+    def close(self):
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            finally:
+                self.socket = None
+                self.buffer = b''
+                self.kept_alive = False
+
+
+    def request(self, method, path, body=b''):
+        '''
+        Make a request, reconnecting (once) if a kept-alive socket turns out
+        to have been closed on us before we got anything back.
+        
+        A socket that hasn't had a response on it yet (like one you just
+        :meth:`connect`-ed) is never retried - if it fails, the server may
+        well have the request, so the error is raised.
+
+        :rtype:     bytes
+        :return:    The response body.
+        
+        :raises:    :class:`RPCError` if the server responds with an HTTP
+                    error.
+        '''
+        head = (
+            "{method} {path} HTTP/1.1\r\n"
+            "Host: localhost\r\n"
+            "Content-Type: application/json\r\n"
+            "Content-Length: {length}\r\n"
+            "Connection: keep-alive\r\n"
+            "\r\n"
+        ).format(method=method, path=path, length=len(body))
+
+        data = head.encode('ascii') + body
+
+        with self.lock:
+            if self.socket is None:
+                self.connect()
+
+            reused = self.kept_alive
+
+            try:
+                self.socket.sendall(data)
+                response_head = self._read_until(b'\r\n\r\n')
+            except (socket.error, EOFError):
+                self.close()
+                if not reused:
+                    raise
+                self.connect()
+                self.socket.sendall(data)
+                response_head = self._read_until(b'\r\n\r\n')
+
+            try:
+                status, body = self._read_response(response_head)
+            except:
+                self.close()
+                raise
+
+            if self.socket is not None:
+                self.kept_alive = True
+
+        check_status(method, path, status, body)
+
+        return body
+
+
+    def _read_response(self, head):
+        lines = head.decode('latin-1').split('\r\n')
+        version, status, _ = (lines[0].split(' ', 2) + [''])[:3]
+
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+
+        if 'content-length' in headers:
+            body = self._read_exactly(int(headers['content-length']))
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = self._read_chunked()
+        else:
+            body = self._read_to_close()
+            self.close()
+
+        if (
+            headers.get('connection', '').lower() == 'close' or
+            version == 'HTTP/1.0'
+        ):
+            self.close()
+
+        return int(status), body
+
+
+    def _recv(self):
+        data = self.socket.recv(self.RECV_SIZE)
+        if not data:
+            raise EOFError("RPC server closed the connection")
+        self.buffer += data
+
+
+    def _read_until(self, marker):
+        while marker not in self.buffer:
+            self._recv()
+        data, self.buffer = self.buffer.split(marker, 1)
+        return data
+
+
+    def _read_exactly(self, length):
+        while len(self.buffer) < length:
+            self._recv()
+        data = self.buffer[:length]
+        self.buffer = self.buffer[length:]
+        return data
+
+
+    def _read_chunked(self):
+        chunks = []
+        while True:
+            size = int(self._read_until(b'\r\n').split(b';')[0], 16)
+            if size == 0:
+                # Trailers (if any), then the final blank line
+                while self._read_until(b'\r\n'):
+                    pass
+                return b''.join(chunks)
+            chunks.append(self._read_exactly(size))
+            self._read_until(b'\r\n')
+
+
+    def _read_to_close(self):
+        try:
+            while True:
+                self._recv()
+        except EOFError:
+            pass
+        data, self.buffer = self.buffer, b''
+        return data
+
+
+# testing - run the doctests
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -3,6 +3,34 @@ __metaclass__ = type
 
 import os
 import socket
+import struct
+import threading
+import time
+import atexit
+import weakref
+from collections import deque
+
+
+# Overflow policies for :class:`BufferedWriter` when it's queue is full.
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_DROP_NEWEST = 'drop_newest'
+
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST)
+
+# Live :class:`BufferedWriter` instances, so we can flush them on exit.
+_writers = weakref.WeakSet()
+
+# Seconds :func:`close_writers` gives each writer to send what it has queued,
+# so exiting doesn't hang when the master isn't reading.
+CLOSE_TIMEOUT = 10.0
+
+# Channel IDs for the multiplexed protocol. Must match
+# `QB::IPC::STDIO::Server::MuxService::CHANNELS`.
+CHANNEL_IDS = dict(out=1, err=2, log=3)
+
+# Multiplexed frame header: channel ID byte and 32-bit big-endian length.
+FRAME_HEADER = struct.Struct('>BI')
 
 
 def path_env_var_name(name):
@@ -25,9 +53,290 @@ def path_env_var_name(name):
     return "QB_STDIO_{}".format(name.upper())
 
 
+def frame(name, data):
+    '''
+    Wrap encoded `data` in a frame for the multiplexed protocol (see
+    :class:`Multiplexer`).
+    
+    >>> frame('log', b'hi\\n') == b'\\x03\\x00\\x00\\x00\\x03hi\\n'
+    True
+    '''
+    return FRAME_HEADER.pack(CHANNEL_IDS[name], len(data)) + data
+
+
+@atexit.register
+def close_writers():
+    '''
+    Flush and stop any :class:`BufferedWriter` instances that are still
+    running. Registered with :mod:`atexit` so that lines queued before a
+    module calls `exit_json` / `fail_json` (which `sys.exit`) make it out.
+    
+    Waits at most :data:`CLOSE_TIMEOUT` for each one - anything still queued
+    after that is counted as dropped.
+    '''
+    for writer in list(_writers):
+        writer.close(timeout=CLOSE_TIMEOUT)
+
+
+class BufferedWriter:
+    '''
+    Writes lines to a socket from a background thread, so the thread doing
+    the printing doesn't stall when the other end is slow to read.
+    
+    Lines go into a bounded queue, and the writer thread joins as many as it
+    can (up to `max_write_bytes`) into each `sendall`.
+    
+    When the queue is full, `overflow` decides what happens:
+    
+    -   `'block'` (default) - wait for room.
+    -   `'drop_oldest'` - throw out the oldest queued line to make room.
+    -   `'drop_newest'` - throw out the line being written.
+    
+    Dropped lines are counted in :attr:`dropped_lines` and
+    :attr:`dropped_bytes`.
+    
+    >>> a, b = socket.socketpair()
+    >>> writer = BufferedWriter(a)
+    >>> for i in range(3):
+    ...     writer.write("line {}\\n".format(i).encode('utf-8'))
+    True
+    True
+    True
+    >>> writer.close()
+    >>> b.recv(1024) == b'line 0\\nline 1\\nline 2\\n'
+    True
+    >>> writer.sent_lines, writer.dropped_lines
+    (3, 0)
+    
+    Closing with a `timeout` gives up on a reader that's stopped reading,
+    dropping what's left - including lines blocked waiting for room:
+    
+    >>> a, b = socket.socketpair()
+    >>> writer = BufferedWriter(a, max_lines=1)
+    >>> line = b'x' * (4 * 1024 * 1024) + b'\\n'
+    >>> results = []
+    >>> def write_lines():
+    ...     for _ in range(3):
+    ...         results.append(writer.write(line))
+    >>> thread = threading.Thread(target=write_lines)
+    >>> thread.start()
+    >>> time.sleep(0.5)
+    >>> writer.close(timeout=0.5)
+    >>> thread.join()
+    >>> results
+    [True, True, False]
+    >>> writer.dropped_lines >= 2
+    True
+    >>> b.close()
+    '''
+    
+    def __init__(
+        self,
+        socket,
+        max_lines=10000,
+        overflow=OVERFLOW_BLOCK,
+        max_write_bytes=64 * 1024,
+        name='qb.ipc.stdio.BufferedWriter',
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                "Bad overflow policy {!r}, must be one of {}".format(
+                    overflow,
+                    OVERFLOW_POLICIES,
+                )
+            )
+        
+        self.socket = socket
+        self.max_lines = max_lines
+        self.overflow = overflow
+        self.max_write_bytes = max_write_bytes
+        
+        self.sent_lines = 0
+        self.sent_bytes = 0
+        self.dropped_lines = 0
+        self.dropped_bytes = 0
+        self.error = None
+        
+        self._queue = deque()
+        self._writing = False
+        self._closed = False
+        self._condition = threading.Condition()
+        
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+        
+        _writers.add(self)
+    
+    
+    def stats(self):
+        '''
+        :rtype:     dict
+        :return:    The line and byte counters.
+        '''
+        return dict(
+            sent_lines      = self.sent_lines,
+            sent_bytes      = self.sent_bytes,
+            dropped_lines   = self.dropped_lines,
+            dropped_bytes   = self.dropped_bytes,
+        )
+    
+    
+    def write(self, data):
+        '''
+        Queue some encoded bytes to be sent.
+        
+        :rtype:     bool
+        :return:    `False` if the data was dropped, `True` otherwise.
+        '''
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("{} is closed".format(self))
+            
+            if len(self._queue) >= self.max_lines:
+                if self.overflow == OVERFLOW_DROP_NEWEST:
+                    self.dropped_lines += 1
+                    self.dropped_bytes += len(data)
+                    return False
+                
+                elif self.overflow == OVERFLOW_DROP_OLDEST:
+                    dropped = self._queue.popleft()
+                    self.dropped_lines += 1
+                    self.dropped_bytes += len(dropped)
+                
+                else:
+                    while (
+                        len(self._queue) >= self.max_lines and
+                        not self._closed
+                    ):
+                        self._condition.wait()
+                    
+                    # Closed while we waited - nothing's going to send it
+                    if self._closed:
+                        self.dropped_lines += 1
+                        self.dropped_bytes += len(data)
+                        return False
+            
+            self._queue.append(data)
+            self._condition.notify_all()
+        
+        return True
+    
+    
+    def flush(self, timeout=None):
+        '''
+        Wait for everything queued so far to be sent.
+        
+        :param timeout:     Seconds to give up after, `None` for no limit.
+        
+        :rtype:     bool
+        :return:    `True` if it all went.
+        '''
+        deadline = None if timeout is None else time.time() + timeout
+        
+        with self._condition:
+            while (self._queue or self._writing) and self._thread.is_alive():
+                wait = 0.1
+                if deadline is not None:
+                    wait = min(wait, deadline - time.time())
+                    if wait <= 0:
+                        return False
+                self._condition.wait(wait)
+        
+        return True
+    
+    
+    def close(self, timeout=None):
+        '''
+        Flush, then stop the writer thread. Safe to call more than once.
+        
+        :param timeout:     Seconds to wait for the flush, `None` for no
+                            limit. Lines still queued after that are counted
+                            as dropped, and the writer thread (a daemon) is
+                            left to it's `sendall`.
+        '''
+        with self._condition:
+            if self._closed:
+                return
+        
+        self.flush(timeout)
+        
+        with self._condition:
+            self._closed = True
+            while self._queue:
+                dropped = self._queue.popleft()
+                self.dropped_lines += 1
+                self.dropped_bytes += len(dropped)
+            self._condition.notify_all()
+        
+        self._thread.join(timeout)
+        _writers.discard(self)
+    
+    
+    def _take(self):
+        '''
+        Pull a chunk of lines off the queue, waiting if it's empty.
+        
+        :return:    `None` when closed and empty, otherwise a list of bytes.
+        '''
+        with self._condition:
+            while not self._queue and not self._closed:
+                self._condition.wait()
+            
+            if not self._queue:
+                return None
+            
+            chunk = []
+            size = 0
+            while self._queue and size < self.max_write_bytes:
+                data = self._queue.popleft()
+                chunk.append(data)
+                size += len(data)
+            
+            self._writing = True
+            self._condition.notify_all()
+            return chunk
+    
+    
+    def _run(self):
+        while True:
+            chunk = self._take()
+            
+            if chunk is None:
+                return
+            
+            data = b''.join(chunk)
+            
+            try:
+                if self.error is None:
+                    self.socket.sendall(data)
+                    sent = True
+                else:
+                    sent = False
+            except socket.error as error:
+                # Nothing we can do about it from here... remember it and
+                # count everything from now on as dropped.
+                self.error = error
+                sent = False
+            
+            with self._condition:
+                if sent:
+                    self.sent_lines += len(chunk)
+                    self.sent_bytes += len(data)
+                else:
+                    self.dropped_lines += len(chunk)
+                    self.dropped_bytes += len(data)
+                self._writing = False
+                self._condition.notify_all()
+
+
 class Connection:
     '''
     Port of Ruby `QB::IPC::STDIO::Client::Connection` class.
+    
+    Writes straight to the socket unless :meth:`buffer` has been called
+    (before connecting), in which case it writes through a
+    :class:`BufferedWriter`.
     '''
     
     def __init__(self, name, type):
@@ -37,6 +346,9 @@ class Connection:
         self.socket = None
         self.env_var_name = path_env_var_name(self.name)
         self.connected = False
+        self.buffer_options = None
+        self.writer = None
+        self.mux = None
     
     def __str__(self):
         attrs = ' '.join(
@@ -45,6 +357,26 @@ class Connection:
         )
         return "<qb.ipc.stdio.Connection {}>".format(attrs)
     
+    def buffer(self, **options):
+        '''
+        Turn on buffered mode for the next :meth:`connect`.
+        
+        :param options:     Passed to :class:`BufferedWriter`.
+        '''
+        if self.type != 'out':
+            raise ValueError("Can only buffer 'out' connections")
+        self.buffer_options = options
+    
+    def stats(self):
+        '''
+        :rtype:     dict
+        :return:    The :class:`BufferedWriter` counters, or `None` if not
+                    buffered.
+        '''
+        if self.writer is None:
+            return None
+        return self.writer.stats()
+    
     def get_path(self):
         if self.env_var_name in os.environ:
             self.path = os.environ[self.env_var_name]
@@ -61,10 +393,10 @@ class Connection:
         
         try:
             self.socket.connect(self.path)
-        except socket.error, msg:
-            if warngings is not None:
-                warning = 'Failed to connect to QB STDOUT stream at {}: {}'
-                warning = warning.format(qb_stdout_path, msg)
+        except socket.error as msg:
+            if warnings is not None:
+                warning = 'Failed to connect to QB {} stream at {}: {}'
+                warning = warning.format(self.name, self.path, msg)
                 warnings.append(warning)
             
             self.socket = None
@@ -72,15 +404,43 @@ class Connection:
         
         self.connected = True
         
+        if self.buffer_options is not None:
+            self.writer = BufferedWriter(
+                self.socket,
+                name="qb.ipc.stdio.{}".format(self.name),
+                **self.buffer_options
+            )
+        
         return True
     
+    def attach(self, mux):
+        '''
+        Write through a connected :class:`Multiplexer` instead of our own
+        socket.
+        '''
+        if self.connected:
+            raise RuntimeError("{} is already connected!".format(self))
+        
+        self.mux = mux
+        self.connected = True
+    
     def disconnect(self):
         if not self.connected:
             raise RuntimeError("{} is not connected!".format(self))
         
+        if self.mux is not None:
+            # The multiplexer isn't ours, just let go of it
+            self.mux = None
+            self.connected = False
+            return
+        
         # if self.type == 'out':
         #     self.socket.flush()
         
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        
         self.socket.close()
         self.socket = None
         self.connected = False
@@ -88,8 +448,55 @@ class Connection:
     def println(self, line):
         if not line.endswith( u"\n" ):
             line = line + u"\n"
-        self.socket.sendall(line.encode("utf-8"))
-        
+        if self.mux is not None:
+            self.mux.send(self.name, line.encode("utf-8"))
+        elif self.writer is None:
+            self.socket.sendall(line.encode("utf-8"))
+        else:
+            self.writer.write(line.encode("utf-8"))
+    
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
+
+
+class Multiplexer(Connection):
+    '''
+    Connection to the master's `QB::IPC::STDIO::Server::MuxService`, which
+    carries several streams over one socket as frames of
+    
+    1.  channel ID byte (see :data:`CHANNEL_IDS`),
+    2.  4-byte big-endian payload length,
+    3.  payload (an encoded line).
+    
+    :class:`Connection` instances write through it once they're
+    :meth:`Connection.attach`-ed, which :class:`Client` does when it's been
+    told to :meth:`Client.multiplex`.
+    
+    Lines are sent in the order they're written, regardless of stream.
+    '''
+    
+    def __init__(self):
+        Connection.__init__(self, name='mux', type='out')
+        self.lock = threading.Lock()
+    
+    def send(self, name, data):
+        '''
+        Send encoded `data` on channel `name`.
+        '''
+        framed = frame(name, data)
+        if self.writer is None:
+            # Hold the lock so frames from different threads don't interleave
+            with self.lock:
+                self.socket.sendall(framed)
+        else:
+            self.writer.write(framed)
+    
+    def println(self, line):
+        raise RuntimeError(
+            "Write to a stream attached to {}, not directly".format(self)
+        )
+
 
 class Client:
     def __init__(self):
@@ -98,19 +505,52 @@ class Client:
         self.stdout = Connection(name='out', type='out')
         self.stderr = Connection(name='err', type='out')
         self.log    = Connection(name='log', type='out')
+        self.mux    = Multiplexer()
+        self.multiplexed = False
     
     def connections(self):
         return [self.stdout, self.stderr, self.log]
     
+    def multiplex(self):
+        '''
+        Opt in to sending all streams over the master's single multiplexed
+        socket (see :class:`Multiplexer`) when :meth:`connect` is called.
+        
+        Falls back to a socket per stream if the master doesn't offer it.
+        '''
+        self.multiplexed = True
+        return self
+    
+    def buffer(self, **options):
+        '''
+        Turn on buffered mode for all connections - see
+        :meth:`Connection.buffer`. Call before :meth:`connect`.
+        '''
+        for connection in self.connections() + [self.mux]:
+            connection.buffer(**options)
+        return self
+    
+    def flush(self):
+        for connection in self.connections() + [self.mux]:
+            connection.flush()
+    
     def connect(self, warnings=None):
+        if self.multiplexed and not self.mux.connected:
+            self.mux.connect(warnings)
+        
         for connection in self.connections():
             if not connection.connected:
-                connection.connect(warnings)
+                if self.mux.connected:
+                    connection.attach(self.mux)
+                else:
+                    connection.connect(warnings)
         return self
     
-    def disconnect(sefl):
+    def disconnect(self):
         for connection in self.connections():
             if connection.connected:
                 connection.disconnect()
+        if self.mux.connected:
+            self.mux.disconnect()
 
 client = Client()
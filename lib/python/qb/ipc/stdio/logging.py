@@ -1,21 +1,206 @@
 from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 
+import os
+import re
+import copy
 import logging
 import threading
 import json
+import atexit
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 
 import qb.logging
 import qb.ipc.stdio
 
 
+# Constants
+# ============================================================================
+
+# ENV var names the master's `QB::IPC::STDIO::Server::LogService` exports its
+# effective level - and any per-logger-name levels, as a JSON object - in.
+LEVEL_ENV_VAR_NAME = 'QB_STDIO_LOG_LEVEL'
+LEVELS_ENV_VAR_NAME = 'QB_STDIO_LOG_LEVELS'
+
+# Default `level` for :func:`getLogger`, meaning "whatever the master says".
+MASTER_LEVEL = 'master'
+
+# Separators between "parent" and "child" logger names, like
+# `qb.ansible.modules` and `qb_docker_image:ImageManager`.
+NAME_SEPARATOR_RE = re.compile(r'[.:#]+')
+
+# Ruby SemanticLogger level names to Python ones. There's no `trace` in
+# Python, so it's just `DEBUG`.
+SEM_LOG_LEVELS = dict(
+    trace   = logging.DEBUG,
+    debug   = logging.DEBUG,
+    info    = logging.INFO,
+    warn    = logging.WARNING,
+    error   = logging.ERROR,
+    fatal   = logging.CRITICAL,
+)
+
+
+# Shared :class:`Handler` / :class:`QueueHandler` instances by `id` of their
+# `io_client` and if they're queued, so every logger uses the same one (and
+# queued loggers don't each spin up their own listener thread).
+_handlers = {}
+
+# :class:`qb.logging.Adapter` instances handed out by :func:`getLogger`, by
+# logger name.
+_adapters = {}
+
+
+# Functions
+# ============================================================================
+
+def master_level(name, env=os.environ):
+    '''
+    Figure out the Python log level for logger `name` from what the master
+    exported in `env`.
+    
+    Per-name levels win, and apply to "children" too (split on `.` and `:`):
+    
+    >>> env = {
+    ...     'QB_STDIO_LOG_LEVEL': 'info',
+    ...     'QB_STDIO_LOG_LEVELS': '{"qb_docker_image": "debug"}',
+    ... }
+    >>> master_level('qb_docker_image:ImageManager', env) == logging.DEBUG
+    True
+    >>> master_level('qb.strings', env) == logging.INFO
+    True
+    
+    Without anything from the master, it's `DEBUG` (which is what we always
+    used to do):
+    
+    >>> master_level('qb.strings', {}) == logging.DEBUG
+    True
+    '''
+    
+    levels = {}
+    if env.get(LEVELS_ENV_VAR_NAME):
+        try:
+            levels = json.loads(env[LEVELS_ENV_VAR_NAME])
+        except ValueError:
+            pass
+    
+    if levels:
+        names = [name] + [
+            name[:match.start()]
+            for match in reversed(list(NAME_SEPARATOR_RE.finditer(name)))
+        ]
+        
+        for candidate in names:
+            if levels.get(candidate) in SEM_LOG_LEVELS:
+                return SEM_LOG_LEVELS[levels[candidate]]
+    
+    return SEM_LOG_LEVELS.get(env.get(LEVEL_ENV_VAR_NAME), logging.DEBUG)
+
+
 # FIXME     After adding central logging stuff
-def getLogger(name, level=logging.DEBUG, io_client=qb.ipc.stdio.client):
+def getLogger(
+    name,
+    level=MASTER_LEVEL,
+    io_client=qb.ipc.stdio.client,
+    queued=False,
+):
+    '''
+    Get the logger for `name` that sends it's records to the QB master.
+    
+    Loggers are cached by name, and each one has exactly one of our shared
+    handlers attached, so asking for the same name again doesn't end up
+    sending every record twice:
+    
+    >>> name = 'qb.ipc.stdio.logging.doctest'
+    >>> getLogger(name) is getLogger(name, queued=True)
+    True
+    >>> len(logging.getLogger(name).handlers)
+    1
+    
+    :param level:   Python log level. By default, uses :func:`master_level`
+                    so that calls below what the master would show are
+                    dropped before doing any work. `None` leaves the level
+                    alone.
+    :param queued:  When `True`, use the shared :class:`QueueHandler` for
+                    `io_client` so that log calls just enqueue the record.
+    
+    :rtype:     :class:`qb.logging.Adapter`
+    '''
     logger = logging.getLogger(name)
+    
+    if level == MASTER_LEVEL:
+        level = master_level(name)
     if level is not None:
         logger.setLevel(level)
-    logger.addHandler(Handler(io_client=io_client))
-    return Adapter(logger, {})
+    
+    handler = get_handler(io_client, queued=queued)
+    
+    for existing in list(logger.handlers):
+        if isinstance(existing, Handler) and existing is not handler:
+            logger.removeHandler(existing)
+    
+    logger.addHandler(handler)
+    
+    if name not in _adapters:
+        _adapters[name] = qb.logging.Adapter(logger, {})
+    
+    return _adapters[name]
+
+
+def get_handler(io_client=qb.ipc.stdio.client, queued=False):
+    '''
+    Get the shared :class:`Handler` - or :class:`QueueHandler` if `queued` -
+    for `io_client`, creating it if needed.
+    '''
+    key = (id(io_client), queued)
+    if key not in _handlers:
+        if queued:
+            _handlers[key] = QueueHandler(io_client=io_client)
+        else:
+            _handlers[key] = Handler(io_client=io_client)
+    return _handlers[key]
+
+
+def get_queue_handler(io_client=qb.ipc.stdio.client):
+    '''
+    Get the shared :class:`QueueHandler` for `io_client`.
+    '''
+    return get_handler(io_client, queued=True)
+
+
+def stats():
+    '''
+    How much each logger has sent to the master, across the shared handlers.
+    
+    :rtype:     dict
+    :return:    Logger names to dicts of `records` and `bytes` counts.
+    '''
+    totals = {}
+    for handler in list(_handlers.values()):
+        for name, counts in handler.stats().items():
+            total = totals.setdefault(name, dict(records=0, bytes=0))
+            total['records'] += counts['records']
+            total['bytes'] += counts['bytes']
+    return totals
+
+
+@atexit.register
+def shutdown():
+    '''
+    Send any queued records and stop the :class:`QueueHandler` listeners.
+    
+    Registered with :mod:`atexit` - after `qb.ipc.stdio`'s hook, so it runs
+    *before* that closes the connections - so tail logs make it out when a
+    module calls `exit_json` / `fail_json`. Call it yourself if you want them
+    sent sooner.
+    '''
+    for handler in list(_handlers.values()):
+        if isinstance(handler, QueueHandler):
+            handler.close()
 
 
 class Handler(logging.Handler):
@@ -55,6 +240,42 @@ class Handler(logging.Handler):
         logging.Handler.__init__(self)
         self.io_client = io_client
         
+        # Records and bytes sent, by logger name (see :func:`stats`). Counted
+        # from whichever threads are logging - or the listener, for a
+        # :class:`QueueHandler` - so only touch them holding the lock.
+        self.counts = {}
+        self.counts_lock = threading.Lock()
+    
+    
+    def connected(self):
+        """
+        Is the :attr:`io_client` log stream connected?
+        """
+        return self.io_client.log.connected
+    
+    
+    def count(self, name, string):
+        """
+        Add a record that was sent for logger `name` to :attr:`counts`.
+        """
+        with self.counts_lock:
+            counts = self.counts.setdefault(name, dict(records=0, bytes=0))
+            counts['records'] += 1
+            # +1 for the newline
+            counts['bytes'] += len(string) + 1
+    
+    
+    def stats(self):
+        """
+        A copy of :attr:`counts`, safe to read while records are being sent.
+        
+        :rtype: dict
+        """
+        with self.counts_lock:
+            return dict(
+                (name, dict(counts)) for name, counts in self.counts.items()
+            )
+        
         
     def send(self, string):
         """
@@ -81,55 +302,197 @@ class Handler(logging.Handler):
             return 'info'
     
     
-    def emit(self, record):
+    def serialize(self, record):
         """
-        Emit a record.
-
-        Doc coppied in (TOOD re-write):
-
-        Pickles the record and writes it to the socket in binary format.
-        If there is an error with the socket, silently drop the packet.
-        If there was a problem with the socket, re-establishes the
-        socket.
+        Turn a record into the JSON line the master's
+        `QB::IPC::STDIO::Server::LogService` expects.
         
         record: https://docs.python.org/2/library/logging.html#logrecord-attributes
+        
+        :rtype:     str
+        """
+        
+        self.format(record)
+        
+        struct = dict(
+            level   = self.get_sem_log_level(record.levelname),
+            name    = record.name,
+            pid     = record.process,
+            # thread  = threading.current_thread().name,
+            thread  = record.threadName,
+            message = record.message,
+            # timestamp = record.asctime,
+        )
+        
+        # The `logging` stdlib module allows you to add extra values
+        # by providing a `extra` key to the `Logger#debug` call (and
+        # friends), which it just adds to the the keys and values to the
+        # `record` object's `#__dict__` (where they better not conflict
+        # with anything else or you'll be in trouble I guess).
+        # 
+        # We look for a `payload` key in there.
+        # 
+        # Example logging with a payload:
+        # 
+        #       logger.debug("My message", extras=dict(payload=dict(x=1)))
+        # 
+        # Yeah, it sucks... TODO extend Logger or something to make it a
+        # little easier to use?
+        # 
+        if 'payload' in record.__dict__:
+            struct['payload'] = record.__dict__['payload']
+        
+        return json.dumps(struct)
+    
+    
+    def emit(self, record):
+        """
+        Emit a record: serialize it and send it to the master (if
+        connected).
         """
         
+        if not self.connected():
+            return
+        
         try:
-            self.format(record)
-            
-            struct = dict(
-                level   = self.get_sem_log_level(record.levelname),
-                name    = record.name,
-                pid     = record.process,
-                # thread  = threading.current_thread().name,
-                thread  = record.threadName,
-                message = record.message,
-                # timestamp = record.asctime,
-            )
-            
-            # The `logging` stdlib module allows you to add extra values
-            # by providing a `extra` key to the `Logger#debug` call (and
-            # friends), which it just adds to the the keys and values to the
-            # `record` object's `#__dict__` (where they better not conflict
-            # with anything else or you'll be in trouble I guess).
-            # 
-            # We look for a `payload` key in there.
-            # 
-            # Example logging with a payload:
-            # 
-            #       logger.debug("My message", extras=dict(payload=dict(x=1)))
-            # 
-            # Yeah, it sucks... TODO extend Logger or something to make it a
-            # little easier to use?
-            # 
-            if 'payload' in record.__dict__:
-                struct['payload'] = record.__dict__['payload']
-            
-            string = json.dumps(struct)
+            string = self.serialize(record)
             self.send(string)
+            self.count(record.name, string)
         except (KeyboardInterrupt, SystemExit):
             raise
         except:
             raise
             # self.handleError(record)
+
+
+class QueueHandler(Handler):
+    """
+    A :class:`Handler` whose :meth:`emit` just puts the record on a queue.
+    
+    A listener thread takes records off the queue, serializes them and sends
+    them to the master, up to `max_batch` records per write. So the thread
+    that's logging only pays for creating the record (and copying it's
+    payload, see :meth:`emit`).
+    
+    Records that fail to serialize go to :meth:`logging.Handler.handleError`
+    (from the listener thread).
+    
+    Use :meth:`flush` to wait for everything queued so far to be sent, and
+    :meth:`close` (which :func:`shutdown` does at exit) to send the rest and
+    stop the listener.
+    """
+    
+    # Put on the queue to tell the listener to stop.
+    _STOP = object()
+    
+    
+    def __init__(self, io_client=qb.ipc.stdio.client, max_batch=64):
+        Handler.__init__(self, io_client=io_client)
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.closed = False
+        self.listener = threading.Thread(
+            target=self._listen,
+            name='qb.ipc.stdio.logging.QueueHandler',
+        )
+        self.listener.daemon = True
+        self.listener.start()
+    
+    
+    def emit(self, record):
+        """
+        Enqueue the record. That's it - other than taking a copy of it's
+        `payload`, since callers go on changing what they logged (results,
+        image entries) and it's serialized later, in the listener.
+        
+        >>> class Log:
+        ...     connected = True
+        ...     lines = []
+        ...     def println(self, line):
+        ...         self.lines.append(line)
+        >>> class Client:
+        ...     log = Log()
+        >>> handler = QueueHandler(io_client=Client())
+        >>> payload = dict(state='building')
+        >>> handler.emit(logging.makeLogRecord(dict(msg='x', payload=payload)))
+        >>> payload['state'] = 'built'
+        >>> handler.close()
+        >>> json.loads(Client.log.lines[0])['payload'] == dict(state='building')
+        True
+        """
+        if 'payload' in record.__dict__:
+            try:
+                record.payload = copy.deepcopy(record.payload)
+            except Exception:
+                self.handleError(record)
+                return
+        
+        self.queue.put_nowait(record)
+    
+    
+    def flush(self):
+        """
+        Wait for the listener to send everything queued so far.
+        """
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks and self.listener.is_alive():
+                self.queue.all_tasks_done.wait(0.1)
+    
+    
+    def close(self):
+        """
+        Send anything left in the queue and stop the listener. Safe to call
+        more than once.
+        """
+        if not self.closed:
+            self.closed = True
+            self.queue.put_nowait(self._STOP)
+            self.listener.join()
+        Handler.close(self)
+    
+    
+    def _take(self):
+        """
+        Block for a record, then grab up to :attr:`max_batch` total without
+        waiting.
+        """
+        records = [self.queue.get()]
+        
+        while len(records) < self.max_batch and records[-1] is not self._STOP:
+            try:
+                records.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        
+        return records
+    
+    
+    def _listen(self):
+        stop = False
+        
+        while not stop:
+            records = self._take()
+            names = []
+            lines = []
+            
+            for record in records:
+                if record is self._STOP:
+                    stop = True
+                    continue
+                try:
+                    lines.append(self.serialize(record))
+                    names.append(record.name)
+                except Exception:
+                    self.handleError(record)
+            
+            try:
+                if lines and self.connected():
+                    self.send("\n".join(lines))
+                    for name, line in zip(names, lines):
+                        self.count(name, line)
+            except Exception:
+                # Nowhere to report it really... the socket's probably gone.
+                pass
+            finally:
+                for _ in records:
+                    self.queue.task_done()
@@ -77,6 +77,41 @@ class Adapter(logging.LoggerAdapter):
 
     '''
     
+    # Level Methods
+    # ------------------------------------------------------------------------
+    # 
+    # Python 2's {logging.LoggerAdapter} calls {#process} *before* checking if
+    # the level is enabled, so disabled calls still pay to format the message
+    # with the payload. These check first.
+    # 
+    
+    def debug(self, msg, *args, **kwds):
+        self.log(logging.DEBUG, msg, *args, **kwds)
+    
+    def info(self, msg, *args, **kwds):
+        self.log(logging.INFO, msg, *args, **kwds)
+    
+    def warning(self, msg, *args, **kwds):
+        self.log(logging.WARNING, msg, *args, **kwds)
+    
+    warn = warning
+    
+    def error(self, msg, *args, **kwds):
+        self.log(logging.ERROR, msg, *args, **kwds)
+    
+    def exception(self, msg, *args, **kwds):
+        kwds['exc_info'] = 1
+        self.log(logging.ERROR, msg, *args, **kwds)
+    
+    def critical(self, msg, *args, **kwds):
+        self.log(logging.CRITICAL, msg, *args, **kwds)
+    
+    def log(self, level, msg, *args, **kwds):
+        if self.logger.isEnabledFor(level):
+            msg, kwds = self.process(msg, kwds)
+            self.logger.log(level, msg, *args, **kwds)
+    
+    
     def process(self, msg, kwds):
         payload = None
         if 'payload' in kwds:
@@ -0,0 +1,327 @@
+##############################################################################
+# In-process port of the bits of the Node `semver` package (5.x) that the
+# version filters use, so we don't have to fork `node` for every call.
+#
+# Matches `semver(version)` (parsing) and `semver --increment` (the CLI) as
+# closely as I could manage, including the weird bits (see `inc` doctests).
+##############################################################################
+
+# Imports
+# ============================================================================
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import re
+
+
+# Constants
+# ============================================================================
+
+# Same limits as `semver`'s `MAX_LENGTH` and JavaScript's
+# `Number.MAX_SAFE_INTEGER`.
+#
+MAX_LENGTH = 256
+MAX_SAFE_INTEGER = 2 ** 53 - 1
+
+# Built up the same way `semver` does it, so it's easy to compare.
+#
+NUMERIC_IDENTIFIER = r'0|[1-9]\d*'
+NON_NUMERIC_IDENTIFIER = r'\d*[a-zA-Z-][a-zA-Z0-9-]*'
+MAIN_VERSION = r'({n})\.({n})\.({n})'.format(n=NUMERIC_IDENTIFIER)
+PRERELEASE_IDENTIFIER = r'(?:{}|{})'.format(
+    NUMERIC_IDENTIFIER,
+    NON_NUMERIC_IDENTIFIER,
+)
+PRERELEASE = r'(?:-({id}(?:\.{id})*))'.format(id=PRERELEASE_IDENTIFIER)
+BUILD_IDENTIFIER = r'[0-9A-Za-z-]+'
+BUILD = r'(?:\+({id}(?:\.{id})*))'.format(id=BUILD_IDENTIFIER)
+
+FULL_RE = re.compile(
+    r'\Av?{}{}?{}?\Z'.format(MAIN_VERSION, PRERELEASE, BUILD)
+)
+
+NUMERIC_RE = re.compile(r'\A[0-9]+\Z')
+
+# Levels the `semver` CLI accepts for `--increment`; anything else becomes
+# `patch`.
+#
+CLI_INC_LEVELS = (
+    'major',
+    'minor',
+    'patch',
+    'prerelease',
+    'premajor',
+    'preminor',
+    'prepatch',
+)
+
+
+# Functions
+# ============================================================================
+
+def _is_string(value):
+    return isinstance(value, (str, type(u'')))
+
+
+def _prerelease_id(id):
+    '''
+    Numeric pre-release identifiers become integers (unless they're too big
+    to be safe in JavaScript, in which case they stay strings).
+    '''
+    if NUMERIC_RE.match(id):
+        num = int(id)
+        if num < MAX_SAFE_INTEGER:
+            return num
+    return id
+
+
+def _format(version):
+    '''
+    Set the `version` string from the parts, like `SemVer#format`.
+    '''
+    string = "{major}.{minor}.{patch}".format(**version)
+
+    if version['prerelease']:
+        string += '-' + '.'.join(str(id) for id in version['prerelease'])
+
+    version['version'] = string
+    return string
+
+
+def parse(version):
+    '''
+    Parse a version string into the same dict you get from
+    `JSON.stringify(require('semver')(version))`.
+
+    Raises :class:`ValueError` (with `semver`'s message) when the string is
+    not a valid version.
+
+    >>> v = parse('1.2.3-dev.4+build.5')
+    >>> [v[key] for key in ('major', 'minor', 'patch')]
+    [1, 2, 3]
+    >>> v['prerelease']
+    ['dev', 4]
+    >>> v['build']
+    ['build', '5']
+    >>> v['version']
+    '1.2.3-dev.4'
+
+    Leading `v` and surrounding whitespace are allowed, and `raw` is what you
+    gave it:
+
+    >>> v = parse(' v0.1.0 ')
+    >>> v['version'], v['raw']
+    ('0.1.0', ' v0.1.0 ')
+
+    >>> parse('1.2')
+    Traceback (most recent call last):
+        ...
+    ValueError: Invalid Version: 1.2
+
+    >>> parse('01.2.3')
+    Traceback (most recent call last):
+        ...
+    ValueError: Invalid Version: 01.2.3
+    '''
+
+    if not _is_string(version):
+        raise TypeError("Invalid Version: {}".format(version))
+
+    if len(version) > MAX_LENGTH:
+        raise TypeError(
+            "version is longer than {} characters".format(MAX_LENGTH)
+        )
+
+    match = FULL_RE.match(version.strip())
+
+    if not match:
+        raise ValueError("Invalid Version: {}".format(version))
+
+    result = dict(
+        raw     = version,
+        loose   = False,
+    )
+
+    for name, group in (('major', 1), ('minor', 2), ('patch', 3)):
+        result[name] = int(match.group(group))
+        if result[name] > MAX_SAFE_INTEGER:
+            raise ValueError("Invalid {} version".format(name))
+
+    if match.group(4):
+        result['prerelease'] = [
+            _prerelease_id(id) for id in match.group(4).split('.')
+        ]
+    else:
+        result['prerelease'] = []
+
+    if match.group(5):
+        result['build'] = match.group(5).split('.')
+    else:
+        result['build'] = []
+
+    _format(result)
+
+    return result
+# parse()
+
+
+def valid(version):
+    '''
+    Like `semver.valid`: the normalized version string, or `None`.
+
+    Unlike :func:`parse`, surrounding whitespace is **not** allowed.
+
+    >>> valid('v1.2.3+abc')
+    '1.2.3'
+    >>> valid(' 1.2.3') is None
+    True
+    '''
+    if not _is_string(version) or FULL_RE.match(version) is None:
+        return None
+    try:
+        return parse(version)['version']
+    except (TypeError, ValueError):
+        return None
+
+
+def _inc_pre(version, identifier):
+    prerelease = version['prerelease']
+
+    if len(prerelease) == 0:
+        version['prerelease'] = prerelease = [0]
+    else:
+        # Bump the right-most number, or tack a `0` on the end if there
+        # aren't any
+        for i in reversed(range(len(prerelease))):
+            if isinstance(prerelease[i], int):
+                prerelease[i] += 1
+                break
+        else:
+            prerelease.append(0)
+
+    if identifier:
+        if prerelease[0] == identifier:
+            if len(prerelease) < 2 or not isinstance(prerelease[1], int):
+                version['prerelease'] = [identifier, 0]
+        else:
+            version['prerelease'] = [identifier, 0]
+
+
+def _inc(version, release, identifier=None):
+    '''
+    Mutate a parsed `version` dict, like `SemVer#inc`.
+    '''
+
+    if release == 'premajor':
+        version['prerelease'] = []
+        version['patch'] = 0
+        version['minor'] = 0
+        version['major'] += 1
+        _inc(version, 'pre', identifier)
+
+    elif release == 'preminor':
+        version['prerelease'] = []
+        version['patch'] = 0
+        version['minor'] += 1
+        _inc(version, 'pre', identifier)
+
+    elif release == 'prepatch':
+        version['prerelease'] = []
+        _inc(version, 'patch', identifier)
+        _inc(version, 'pre', identifier)
+
+    elif release == 'prerelease':
+        if len(version['prerelease']) == 0:
+            _inc(version, 'patch', identifier)
+        _inc(version, 'pre', identifier)
+
+    elif release == 'major':
+        if (
+            version['minor'] != 0 or
+            version['patch'] != 0 or
+            len(version['prerelease']) == 0
+        ):
+            version['major'] += 1
+        version['minor'] = 0
+        version['patch'] = 0
+        version['prerelease'] = []
+
+    elif release == 'minor':
+        if version['patch'] != 0 or len(version['prerelease']) == 0:
+            version['minor'] += 1
+        version['patch'] = 0
+        version['prerelease'] = []
+
+    elif release == 'patch':
+        if len(version['prerelease']) == 0:
+            version['patch'] += 1
+        version['prerelease'] = []
+
+    elif release == 'pre':
+        _inc_pre(version, identifier)
+
+    else:
+        raise ValueError("invalid increment argument: {}".format(release))
+
+    version['raw'] = _format(version)
+    return version
+
+
+def inc(version, level=None, preid=None):
+    '''
+    Increment `version` the way
+
+        semver --increment <level> [--preid <preid>] <version>
+
+    does, returning the new version string.
+
+    Raises :class:`ValueError` if `version` isn't valid (where the CLI would
+    exit non-zero).
+
+    >>> inc('1.2.3', 'minor')
+    '1.3.0'
+    >>> inc('1.2.3-dev.0', 'patch')
+    '1.2.3'
+    >>> inc('1.2.3-dev.0', 'prerelease')
+    '1.2.3-dev.1'
+    >>> inc('1.2.3-rc.0', 'prerelease', preid='dev')
+    '1.2.3-dev.0'
+    >>> inc('1.2.3', 'premajor', preid='rc')
+    '2.0.0-rc.0'
+    >>> inc('1.0.0-alpha', 'prerelease')
+    '1.0.0-alpha.0'
+
+    Like the CLI, a missing or unknown `level` means `patch`, and build
+    metadata is dropped:
+
+    >>> inc('1.2.3+build.9')
+    '1.2.4'
+    >>> inc('1.2.3', 'pre')
+    '1.2.4'
+
+    >>> inc('blah', 'patch')
+    Traceback (most recent call last):
+        ...
+    ValueError: Invalid Version: blah
+    '''
+
+    if level not in CLI_INC_LEVELS:
+        level = 'patch'
+
+    # The CLI filters out invalid versions (no trimming allowed), then
+    # `semver.clean`s what's left.
+    if valid(version) is None:
+        raise ValueError("Invalid Version: {}".format(version))
+
+    parsed = parse(version)
+    parsed['build'] = []
+
+    return _inc(parsed, level, preid)['version']
+# inc()
+
+
+# testing - run the doctests
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -11,6 +11,7 @@ require 'cmds'
 require 'qb/util/bundler'
 require 'qb/ipc/stdio/server'
 require 'qb/ipc/rpc/server'
+require 'qb/ipc/docker_broker'
 
 
 # Namespace
@@ -239,7 +240,12 @@ class Playbook < Cmds
         rpc_server = QB::IPC::RPC::Server.new.start!
         
         status = QB::IPC::RPC::Server.run_around do
-          super *args, **kwds, &input_block
+          # Start the Docker broker with the same ENV additions as
+          # `ansible-playbook`, so it runs `qb_docker_image` like the module
+          # would
+          QB::IPC::DockerBroker.run_around env: env do
+            super *args, **kwds, &input_block
+          end
         end
 
         # ...and stop it
@@ -0,0 +1,237 @@
+# encoding: UTF-8
+# frozen_string_literal: true
+
+# Requirements
+# =======================================================================
+
+# Stdlib
+# -----------------------------------------------------------------------
+
+# Need {Dir.mktmpdir}
+require 'tmpdir'
+
+# Need {FileUtils.rm_rf}
+require 'fileutils'
+
+# Deps
+# -----------------------------------------------------------------------
+
+require 'nrser'
+
+# Project / Package
+# -----------------------------------------------------------------------
+
+require 'qb/python'
+
+
+# Namespace
+# =======================================================================
+
+module  QB
+module  IPC
+
+
+# Definitions
+# =======================================================================
+
+# Runs the Python Docker broker (`//lib/python/qb/ansible/modules/docker/
+# broker.py`) alongside `ansible-playbook`, so `qb_docker_image` tasks hand
+# their args to one long-lived process that already has docker-py loaded and
+# a client set up, instead of each starting from scratch.
+#
+# Modules find it through the {SOCKET_ENV_VAR_NAME} ENV var, and run
+# themselves like they always have when it's not set or they can't reach it -
+# so if the broker fails to start (no docker-py for {QB::Python.bin}, say)
+# nothing changes.
+#
+# It's off unless the {ENABLED_ENV_VAR_NAME} ENV var is `1`, `true`, `yes` or
+# `on`: forwarded tasks run in the broker, as the master's user, and while
+# modules running as someone else (`become`) or with another Python run
+# themselves, that's a different enough way of running tasks to ask for.
+#
+class DockerBroker
+
+  # Mixins
+  # ========================================================================
+
+  include NRSER::Log::Mixin
+
+
+  # Constants
+  # ========================================================================
+
+  SOCKET_ENV_VAR_NAME = 'QB_DOCKER_BROKER_SOCKET'
+
+  ENABLED_ENV_VAR_NAME = 'QB_DOCKER_BROKER'
+
+  ENABLED_VALUES = %w[ 1 true yes on ].freeze
+
+  # Seconds to wait for the broker to exit after asking it to before killing
+  # it.
+  #
+  # @return [Numeric]
+  #
+  STOP_TIMEOUT = 5
+
+
+  # Class Methods
+  # ========================================================================
+
+  # @return [Boolean]
+  #   `true` if the {ENABLED_ENV_VAR_NAME} ENV var turns the broker on.
+  #
+  def self.enabled? env = ENV
+    ENABLED_VALUES.include?( env[ ENABLED_ENV_VAR_NAME ].to_s.strip.downcase )
+  end # .enabled?
+
+
+  # Run a broker around a block, with it's socket path in the
+  # {SOCKET_ENV_VAR_NAME} ENV var for processes spawned from it.
+  #
+  # @param [Hash<String, #to_s>] env
+  #   ENV additions for the broker process - pass what `ansible-playbook`
+  #   gets, so the broker runs modules with the same `PYTHONPATH` and Docker
+  #   settings they'd have.
+  #
+  # @return
+  #   What the block returns.
+  #
+  def self.run_around env: {}, &block
+    return block.call unless enabled?
+
+    broker = new( env: env ).start!
+
+    ENV[ SOCKET_ENV_VAR_NAME ] = broker.socket_path.to_s
+
+    begin
+      block.call
+    ensure
+      ENV.delete SOCKET_ENV_VAR_NAME
+      broker.stop!
+    end
+  end # .run_around
+
+
+  # Attributes
+  # ========================================================================
+
+  # Temp dir where the socket goes.
+  #
+  # @return [Pathname]
+  #
+  attr_reader :socket_dir
+
+
+  # Absolute path to the socket file.
+  #
+  # @return [Pathname]
+  #
+  attr_reader :socket_path
+
+
+  # ENV additions for the broker process.
+  #
+  # @return [Hash<String, String>]
+  #
+  attr_reader :env
+
+
+  # The broker's PID while it's running.
+  #
+  # @return [nil | Integer]
+  #
+  attr_reader :pid
+
+
+  # Construction
+  # ========================================================================
+
+  def initialize env: {}
+    @env = env.map { |name, value| [ name.to_s, value.to_s ] }.to_h
+    @socket_dir = Dir.mktmpdir( 'qb-docker-broker' ).to_pn
+    @socket_path = socket_dir + 'socket'
+    @pid = nil
+  end # #initialize
+
+
+  # Instance Methods
+  # ========================================================================
+
+  # Spawn the broker. Doesn't wait for it to be listening - modules that get
+  # there first just run themselves.
+  #
+  # @return [self]
+  #
+  def start!
+    @pid = Process.spawn \
+      env,
+      QB::Python.bin,
+      '-m', 'qb.ansible.modules.docker.broker',
+      '--socket', socket_path.to_s,
+      in: File::NULL,
+      out: File::NULL,
+      err: File::NULL
+
+    logger.debug "Started Docker broker",
+      pid: pid,
+      socket_path: socket_path
+
+    self
+  end # #start!
+
+
+  # Ask the broker to exit (killing it if it won't) and remove the socket
+  # dir.
+  #
+  # @return [self]
+  #
+  def stop!
+    unless pid.nil?
+      logger.catch.warn( "Unable to stop Docker broker", pid: pid ) do
+        Process.kill 'TERM', pid
+
+        unless wait_for_exit STOP_TIMEOUT
+          Process.kill 'KILL', pid
+          Process.wait pid
+        end
+      end
+
+      @pid = nil
+    end
+
+    FileUtils.rm_rf( socket_dir ) if socket_dir.exist?
+
+    self
+  end # #stop!
+
+
+  protected
+  # ========================================================================
+
+    # @return [Boolean]
+    #   `true` if the broker exited (or was already gone) within `timeout`
+    #   seconds.
+    #
+    def wait_for_exit timeout
+      deadline = Time.now + timeout
+
+      while Time.now < deadline
+        return true if Process.wait( pid, Process::WNOHANG )
+        sleep 0.05
+      end
+
+      false
+    rescue Errno::ECHILD
+      true
+    end # #wait_for_exit
+
+  # end protected
+
+end # class DockerBroker
+
+
+# /Namespace
+# =======================================================================
+
+end # module IPC
+end # module QB
@@ -50,6 +50,29 @@ class Server
 
   CONTENT_TYPE_JSON = { 'Content-Type' => 'application/json' }.freeze
 
+
+  # Receiver names to the names of their methods that are *pure* - same args
+  # in, same result out, no side effects - so clients are free to cache their
+  # results.
+  # 
+  # `/send` responses for these calls have `pure: true`, which is what the
+  # Python client goes by (see `CallCache` in
+  # `//lib/python/qb/ipc/rpc/client.py`).
+  # 
+  # @return [Hash<String, Array<String>>]
+  # 
+  PURE_METHODS = {
+    'QB::Package::Version' => %w[ from from_string from_s extract ].freeze,
+    'QB::Package::Version::From' => %w[
+      object
+      string
+      s
+      semver
+      gemver
+      docker_tag
+    ].freeze,
+  }.freeze
+
   
   # Class Methods
   # ========================================================================
@@ -191,6 +214,8 @@ class Server
     case path
     when '/send'
       handle_send payload
+    when '/batch'
+      handle_batch payload
     when '/plugins/filters'
       handle_plugins_filters
     else
@@ -213,7 +238,16 @@ class Server
   end
 
 
-  def handle_send payload
+  # Unpack a `/send`-style payload - `receiver`, `method`, `args` and `kwds` -
+  # and send it.
+  # 
+  # @param [Hash<String, Object>] payload
+  #   Decoded JSON call.
+  # 
+  # @return [Object]
+  #   Whatever the method returned.
+  # 
+  def send_payload payload
     receiver = payload.fetch 'receiver'
     method = payload.fetch 'method'
     args = payload.fetch 'args', []
@@ -250,12 +284,77 @@ class Server
     # result = receiver.send method, *args, **kwds
     # 
     # So we do this (after conditionally appending kwds up top)
-    result = receiver.send method, *args
+    receiver.send method, *args
+  end # #send_payload
+
+
+  # Is a `/send`-style payload a call to one of the {PURE_METHODS}?
+  # 
+  # Only calls on constants named by strings count - instances loaded from
+  # data are never considered pure.
+  # 
+  # @param [Hash<String, Object>] payload
+  #   Decoded JSON call.
+  # 
+  # @return [Boolean]
+  # 
+  def pure? payload
+    receiver = payload['receiver']
+
+    return false unless String === receiver
+
+    methods = PURE_METHODS[ receiver.sub( /\A::/, '' ) ]
+
+    !methods.nil? && methods.include?( payload['method'].to_s )
+  end # #pure?
+
+
+  def handle_send payload
+    result = send_payload payload
 
     logger.trace "Got result, responding",
       result: result
 
-    respond_ok data: result
+    if pure? payload
+      respond_ok data: result, pure: true
+    else
+      respond_ok data: result
+    end
+  end
+
+
+  # Handle a `/batch` request, which is a list of `/send` payloads under
+  # `calls` that are sent in order.
+  # 
+  # Errors are caught per-call, so one failure doesn't take out the rest of
+  # the batch.
+  # 
+  # @param [Hash<String, Object>] payload
+  #   With a `calls` key holding an {Array} of `/send` payloads.
+  # 
+  # @return [Array]
+  #   Rack response, where `data` is an {Array} holding either a `data` or
+  #   `error` {Hash} for each call, in the order they were given.
+  # 
+  def handle_batch payload
+    calls = payload.fetch 'calls'
+
+    logger.trace "Sending batch",
+      count: calls.length
+
+    results = calls.map { |call|
+      begin
+        { data: send_payload( call ) }
+      rescue StandardError => error
+        logger.error "Error processing batch call",
+          { call: call },
+          error
+        
+        { error: { message: error.message, class: error.class.name } }
+      end
+    }
+
+    respond_ok data: results
   end
 
 
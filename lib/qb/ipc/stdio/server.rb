@@ -55,6 +55,11 @@ end
 # The protocol is simply text line-based, and modules - or any other process -
 # written in other languages can easily connect and write as well.
 # 
+# There is also a {MuxService}, which carries `out`, `err` and `log` over a
+# single connection using simple length-prefixed frames. Clients can opt in to
+# that to save connections and keep their lines in order across streams; the
+# per-stream sockets stay available either way.
+# 
 # @note
 #   This feature only works for `localhost`. I have no idea what it will do
 #   in other cases. It doesn't seem like it should break anything, but remotely
@@ -76,6 +81,7 @@ class QB::IPC::STDIO::Server
   require_relative './server/in_service'
   require_relative './server/out_service'
   require_relative './server/log_service'
+  require_relative './server/mux_service'
   
   
   # Mixins
@@ -181,6 +187,15 @@ class QB::IPC::STDIO::Server
     @log_service  = QB::IPC::STDIO::Server::LogService.new \
                       name: :log,
                       socket_dir: socket_dir
+    
+    @mux_service  = QB::IPC::STDIO::Server::MuxService.new \
+                      name: :mux,
+                      socket_dir: socket_dir,
+                      services: {
+                        out: @out_service,
+                        err: @err_service,
+                        log: @log_service,
+                      }
                       
     ObjectSpace.define_finalizer \
       self,
@@ -195,11 +210,11 @@ class QB::IPC::STDIO::Server
   # Instance Methods
   # ========================================================================
   
-  # @return [Array<(InService, OutService, OutService)>]
-  #   Array of in, out and err services.
+  # @return [Array<(InService, OutService, OutService, LogService, MuxService)>]
+  #   Array of in, out, err, log and mux services.
   # 
   def services
-    [ @in_service, @out_service, @err_service, @log_service ]
+    [ @in_service, @out_service, @err_service, @log_service, @mux_service ]
   end # #services
   
   
@@ -1,11 +1,43 @@
+require 'json'
 require 'nrser/core_ext/hash'
 require_relative './service'
 
 # QB STDIO Service to receive log lines in JSON format and forward them
 # on to the logger.
 # 
+# Also tells clients what will actually get logged, so they can skip the
+# work for anything that won't: the master's effective level goes in
+# {LEVEL_ENV_VAR_NAME} and per-logger-name levels - which you can set with a
+# JSON object in {LEVELS_ENV_VAR_NAME} when running `qb` - are applied here
+# and passed through. A name's level also covers it's "children" (names
+# that start with it followed by `.`, `:` or `#`).
+# 
 class QB::IPC::STDIO::Server::LogService < QB::IPC::STDIO::Server::Service
   
+  # Constants
+  # ========================================================================
+  
+  # ENV var holding the master's effective log level.
+  # 
+  # @return [String]
+  # 
+  LEVEL_ENV_VAR_NAME = 'QB_STDIO_LOG_LEVEL'
+  
+  
+  # ENV var holding a JSON object of logger names to levels.
+  # 
+  # @return [String]
+  # 
+  LEVELS_ENV_VAR_NAME = 'QB_STDIO_LOG_LEVELS'
+  
+  
+  # Separators between "parent" and "child" logger names.
+  # 
+  # @return [Regexp]
+  # 
+  NAME_SEPARATOR_RE = /[.:#]+/
+  
+  
   class Log < SemanticLogger::Log
     
     
@@ -91,18 +123,79 @@ class QB::IPC::STDIO::Server::LogService < QB::IPC::STDIO::Server::Service
   def initialize name:, socket_dir:
     super name: name, socket_dir: socket_dir
     @loggers = {}
+    @levels = load_levels
+  end
+  
+  
+  # The master's effective log level.
+  # 
+  # @return [Symbol]
+  # 
+  def level
+    SemanticLogger.default_level
+  end
+  
+  
+  # Open the service and export the levels for clients.
+  # 
+  # @return [void]
+  # 
+  def open!
+    super
+    
+    ENV[LEVEL_ENV_VAR_NAME] = level.to_s
+    
+    logger.debug "Set log level env vars",
+      LEVEL_ENV_VAR_NAME => ENV[LEVEL_ENV_VAR_NAME],
+      LEVELS_ENV_VAR_NAME => ENV[LEVELS_ENV_VAR_NAME]
+  end
+  
+  
+  def close!
+    ENV.delete LEVEL_ENV_VAR_NAME
+    super
+  end
+  
+  
+  # Find the configured level for a logger name, if any, checking the name
+  # and then it's "parents".
+  # 
+  # @param [String] name
+  # @return [String?]
+  # 
+  def level_for name
+    name = name.to_s
+    
+    cut_points = name.enum_for( :scan, NAME_SEPARATOR_RE ).map {
+      Regexp.last_match.begin 0
+    }
+    
+    [ name, *cut_points.reverse.map { |index| name[0...index] } ].
+      map { |candidate| @levels[candidate] }.
+      find { |candidate_level| !candidate_level.nil? }
   end
   
   def work_in_thread
     while (line = @socket.gets) do
-      logger.trace "received line",
-        line: line
-      
-      load_log_in_thread line
+      handle_line line
     end
   end
   
   
+  # Decode and log a JSON line received from a client. Also used by
+  # {MuxService} for lines on it's channel.
+  # 
+  # @param [String] line
+  # @return [void]
+  # 
+  def handle_line line
+    logger.trace "received line",
+      line: line
+    
+    load_log_in_thread line
+  end
+  
+  
   protected
   # ========================================================================
     
@@ -115,7 +208,25 @@ class QB::IPC::STDIO::Server::LogService < QB::IPC::STDIO::Server::Service
     # @return [NRSER::Log::Logger]
     # 
     def logger_for name
-      @loggers[name] ||= NRSER::Log[name]
+      @loggers[name] ||= NRSER::Log[name].tap { |new_logger|
+        if (name_level = level_for name)
+          new_logger.level = name_level.to_sym
+        end
+      }
+    end
+    
+    
+    # Load per-logger-name levels from {LEVELS_ENV_VAR_NAME}.
+    # 
+    # @return [Hash<String, String>]
+    # 
+    def load_levels
+      return {} if ENV[LEVELS_ENV_VAR_NAME].to_s.empty?
+      
+      logger.catch.warn(
+        "Unable to parse per-logger levels",
+        LEVELS_ENV_VAR_NAME => ENV[LEVELS_ENV_VAR_NAME],
+      ) { JSON.load ENV[LEVELS_ENV_VAR_NAME] } || {}
     end
     
     
@@ -0,0 +1,134 @@
+require_relative './service'
+
+# QB STDIO Service that carries the `out`, `err` and `log` streams over one
+# connection, so clients only need one socket (and their lines stay in the
+# order they were written across streams).
+#
+# The protocol is a sequence of frames, each of which is:
+#
+# 1.  One byte channel ID (see {CHANNELS}).
+# 2.  Four byte, big-endian, unsigned payload length.
+# 3.  The payload: one or more UTF-8 lines, same as would be written to the
+#     channel's own socket.
+#
+# Payloads are split into lines and each handed to the channel's service
+# through it's `#handle_line` method, so they end up in the same place (and
+# clients can batch several lines into one frame).
+#
+# Unlike the other services, which handle one connection at a time, each
+# accepted connection gets it's own reader thread so concurrent module
+# processes don't wait on each other.
+#
+class QB::IPC::STDIO::Server::MuxService < QB::IPC::STDIO::Server::Service
+
+  # Constants
+  # ========================================================================
+
+  # Channel IDs to the names of the services they go to. Must match
+  # `CHANNEL_IDS` in `//lib/python/qb/ipc/stdio/__init__.py`.
+  #
+  # @return [Hash<Integer, Symbol>]
+  #
+  CHANNELS = {
+    1 => :out,
+    2 => :err,
+    3 => :log,
+  }.freeze
+
+
+  # Frame header: channel ID byte and 32-bit big-endian length.
+  #
+  # @return [String]
+  #
+  HEADER_FORMAT = 'CN'
+
+
+  # @return [Integer]
+  #
+  HEADER_SIZE = 5
+
+
+  # Construction
+  # ========================================================================
+
+  # @param [Hash<Symbol, Service>] services
+  #   Services by name to dispatch {CHANNELS} to.
+  #
+  def initialize name:, socket_dir:, services:
+    super name: name, socket_dir: socket_dir
+    @services = services
+    @readers = []
+  end
+
+
+  # Instance Methods
+  # ========================================================================
+
+  def work_in_thread
+    socket = @socket
+
+    @readers.select! &:alive?
+    @readers << Thread.new do
+      Thread.current.name = "#{ name }:#{ @readers.length }"
+
+      begin
+        read_frames socket
+      ensure
+        socket.close unless socket.closed?
+      end
+    end
+  end
+
+
+  def close!
+    @readers.each { |reader| reader.kill if reader.alive? }
+    @readers = []
+    super
+  end
+
+
+  protected
+  # ========================================================================
+
+    # Read frames from a client socket until it hits EOF, dispatching each
+    # to it's service.
+    #
+    # @param [UNIXSocket] socket
+    # @return [void]
+    #
+    def read_frames socket
+      while (header = socket.read( HEADER_SIZE ))
+        break if header.bytesize < HEADER_SIZE
+
+        channel, length = header.unpack HEADER_FORMAT
+        payload = socket.read length
+
+        break if payload.nil? || payload.bytesize < length
+
+        dispatch channel, payload.force_encoding( Encoding::UTF_8 )
+      end
+    end
+
+
+    # Hand each line in a payload to the service for it's channel.
+    #
+    # @param [Integer] channel
+    # @param [String] payload
+    # @return [void]
+    #
+    def dispatch channel, payload
+      service = @services[ CHANNELS[ channel ] ]
+
+      if service.nil?
+        logger.warn "Received frame for unknown channel",
+          channel: channel,
+          payload: payload
+        return
+      end
+
+      payload.each_line { |line| service.handle_line line }
+    end
+
+  public # end protected ***************************************************
+
+end # MuxService
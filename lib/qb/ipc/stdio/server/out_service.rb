@@ -10,11 +10,22 @@ class QB::IPC::STDIO::Server::OutService < QB::IPC::STDIO::Server::Service
   
   def work_in_thread
     while (line = @socket.gets) do
-      logger.trace "received line",
-        line: line,
-        dest: @dest
-      
-      @dest.puts line
+      handle_line line
     end
   end
+  
+  
+  # Write a line received from a client to {#dest}. Also used by
+  # {MuxService} for lines on it's channel.
+  # 
+  # @param [String] line
+  # @return [void]
+  # 
+  def handle_line line
+    logger.trace "received line",
+      line: line,
+      dest: @dest
+    
+    @dest.puts line
+  end
 end # InService
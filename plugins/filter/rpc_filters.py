@@ -4,6 +4,11 @@
 # Does an RPC call it's self to get the mapping and coverts it a map of 
 # lambdas for {FilterModule}.
 # 
+# The mapping is cached on disk (see {qb.cache}) keyed by QB version and a
+# digest of `QB::Ansible::Plugins::Filters`, so loading the plugin doesn't need
+# the RPC round trip unless one of those changed. Set `QB_RPC_FILTERS_REFRESH`
+# (or call {refresh_map}) to fetch it again regardless.
+# 
 # Also adds the `send` filter to invoke arbitrary Ruby methods over RPC.
 # 
 ##
@@ -16,6 +21,8 @@ import sys
 
 from ansible.errors import AnsibleError
 
+import qb
+import qb.cache
 from qb import logging
 
 from qb.ansible.display_handler import DisplayHandler
@@ -26,6 +33,26 @@ logger = logging.getLogger('plugins/filter/rpc_filters')
 from qb.ipc.rpc import client
 
 
+# Constants
+# ============================================================================
+
+# Namespace for the data map in {qb.cache}.
+# 
+CACHE_NAMESPACE = 'rpc_filters'
+
+# Set this ENV var (to anything non-empty) to ignore the cached data map and
+# fetch a fresh one.
+# 
+REFRESH_ENV_VAR_NAME = 'QB_RPC_FILTERS_REFRESH'
+
+# Source of `QB::Ansible::Plugins::Filters`, which is what the data map comes
+# from.
+# 
+FILTERS_SRC_PATH = os.path.join(
+    qb.ROOT, 'lib', 'qb', 'ansible', 'plugins', 'filters.rb'
+)
+
+
 def qb_send(*args, **kwds):
     logger.warning(
         "DEPRECIATED - `qb_send` has been renamed `send`"
@@ -59,8 +86,53 @@ def _make_sender(receiver, method):
     )
 
 
-def get_map():
+def cache_key():
+    '''
+    Key for the data map in {qb.cache}: QB version plus (the start of) the
+    digest of the filters source.
+    
+    :rtype:     str
+    '''
+    return "{}-{}".format(
+        qb.cache.qb_version(),
+        qb.cache.file_digest(FILTERS_SRC_PATH)[:16],
+    )
+
+
+def get_data_map(refresh=False):
+    '''
+    Get the filter name -> `receiver` / `method` map, from the on-disk cache
+    if we can, otherwise from the QB master (and then cache it).
+    
+    :param refresh:     When `True`, skip the cache read.
+    :rtype:             dict
+    '''
+    refresh = refresh or bool(os.environ.get(REFRESH_ENV_VAR_NAME))
+    
+    try:
+        key = cache_key()
+    except (IOError, OSError) as error:
+        logger.debug(
+            "Can't compute rpc filters cache key, not caching",
+            payload = dict(error = str(error)),
+        )
+        key = None
+    
+    if key is not None and not refresh:
+        data_map = qb.cache.load(CACHE_NAMESPACE, key)
+        if data_map is not None:
+            return data_map
+    
     data_map = client.get('/plugins/filters')
+    
+    if key is not None:
+        qb.cache.dump(CACHE_NAMESPACE, key, data_map)
+    
+    return data_map
+
+
+def get_map(refresh=False):
+    data_map = get_data_map(refresh=refresh)
 
     filter_map = {}
 
@@ -91,6 +163,16 @@ def get_map_cached():
     return _map
 
 
+def refresh_map():
+    '''
+    Fetch the map from the QB master again, replacing both the on-disk and
+    in-process caches.
+    '''
+    global _map
+    _map = get_map(refresh=True)
+    return _map
+
+
 class FilterModule( object ):
     '''
     Ruby filters available via RPC with the QB master process.
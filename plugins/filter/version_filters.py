@@ -1,34 +1,25 @@
 from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 
-import subprocess
 import os
-import json
 import sys
 
 from ansible.errors import AnsibleError
 
 import qb
+import qb.semver
 from qb.ipc.rpc import client as rpc_client
 
 
-def get_semver_path():
-    bin_path = os.path.join(qb.ROOT, 'node_modules', 'semver', 'bin', 'semver')
-    
-    if not os.path.isfile(bin_path):
-        raise Exception("can't find semver at %s" % bin_path)
-    
-    return bin_path
-# get_semver_path()
-
-
 def semver_inc(version, level = None, preid = None):
     '''increment the version at level, with optional preid for pre- levels.
     
-    runs
+    does what
     
         semver --increment <level> [--preid <preid>] <version>
     
+    would, but in-process via :mod:`qb.semver` (used to actually run it, which
+    meant forking `node` every call).
     
     This does **not** do what you probably want... `preid` is ignored:
     
@@ -44,44 +35,37 @@ def semver_inc(version, level = None, preid = None):
     '1.0.1-dev.0'
     
     '''
-
-    cmd = [
-        get_semver_path(),
-        '--increment',
-    ]
-    
-    if not (level is None):
-        cmd.append(level)
-    
-    if not (preid is None):
-        cmd.append('--preid')
-        cmd.append(preid)
     
-    cmd.append(version)
-    
-    out = subprocess.check_output(cmd)
-    
-    return out.rstrip()
+    try:
+        return qb.semver.inc(version, level, preid = preid)
+    except ValueError as error:
+        raise AnsibleError(
+            "semver_inc failed for {!r}: {}".format(version, error)
+        )
 # semver_inc()
 
 
 def semver_parse(version):
     '''parse semver.
-    '''
     
-    stmt = (
-        '''console.log(JSON.stringify(require('semver')(%s), null, 2))''' %
-        json.dumps(version)
-    )
+    Same as `require('semver')(version)` (via :func:`qb.semver.parse`) plus
+    some QB extras:
     
-    cmd = ['node', '--eval', stmt]
+    >>> v = semver_parse('0.1.2-dev.3')
+    >>> v['is_dev'], v['level'], v['release']
+    (True, 'dev', '0.1.2')
     
-    out = subprocess.check_output(
-        cmd,
-        cwd = qb.ROOT
-    )
+    >>> v = semver_parse('1.0.0')
+    >>> v['is_release'], v['level'], v['type']
+    (True, 'release', 'release')
+    '''
     
-    version = json.loads(out)
+    try:
+        version = qb.semver.parse(version)
+    except (TypeError, ValueError) as error:
+        raise AnsibleError(
+            "semver_parse failed for {!r}: {}".format(version, error)
+        )
     
     version['is_release'] = len(version['prerelease']) == 0
     
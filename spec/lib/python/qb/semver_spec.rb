@@ -0,0 +1,172 @@
+##
+# Conformance tests for `//lib/python/qb/semver.py`, the in-process Python
+# port of the Node `semver` package used by the `semver_parse` and
+# `semver_inc` filters.
+#
+# Runs every case through both the Python port and the real thing in
+# `//node_modules/semver` (one process each) and expects the same answers.
+# Skipped if `node_modules/semver` isn't installed (`yarn install`).
+#
+# Increments go through the same calls `node_modules/semver/bin/semver` makes
+# for `--increment` (`valid`, then `clean`, then `inc`), since that CLI is what
+# `semver_inc` used to shell out to.
+#
+##
+
+require 'json'
+
+module SemverConformance
+
+  SEMVER_PATH = QB::ROOT / 'node_modules' / 'semver'
+
+  VERSIONS = [
+    '0.0.0',
+    '1.2.3',
+    'v1.2.3',
+    ' 1.2.3 ',
+    '=1.2.3',
+    '1.2.3-0',
+    '1.2.3-dev',
+    '1.2.3-dev.0',
+    '1.2.3-dev.4',
+    '1.2.3-rc.1.2',
+    '1.2.3-alpha.beta',
+    '1.2.3-alpha.1.beta',
+    '1.2.3+build',
+    '1.2.3-dev.1+b.2',
+    '1.0.0-x.7.z.92',
+    '1.2.3-1a',
+    '1.2.3-dev.0-x',
+    '10.20.30-9007199254740993',
+    '01.2.3',
+    '1.2.3-01',
+    '1.2',
+    '1.2.3.4',
+    '1.0.0-a..b',
+    'garbage',
+    '',
+  ]
+
+  # `nil` means "no level argument", which the CLI treats as `patch` (as it
+  # does any level it doesn't know, like `pre` and `bogus`).
+  LEVELS = [
+    nil,
+    'major',
+    'minor',
+    'patch',
+    'prerelease',
+    'premajor',
+    'preminor',
+    'prepatch',
+    'pre',
+    'bogus',
+  ]
+
+  PREIDS = [ nil, 'dev', 'rc', '0' ]
+
+  INC_CASES = VERSIONS.product( LEVELS, PREIDS )
+
+
+  PYTHON_SRC = <<~END
+    import json, sys
+    import qb.semver
+
+    cases = json.loads(sys.argv[1])
+
+    def attempt(fn, *args):
+        try:
+            return fn(*args)
+        except (TypeError, ValueError):
+            return None
+
+    print(json.dumps(dict(
+        parse = [attempt(qb.semver.parse, v) for v in cases['versions']],
+        inc = [attempt(qb.semver.inc, *case) for case in cases['inc']],
+    )))
+  END
+
+
+  NODE_SRC = <<~END
+    var semver = require('semver')
+    var cases = JSON.parse(process.argv[1])
+    var levels = [
+      'major', 'minor', 'patch', 'prerelease', 'premajor', 'preminor',
+      'prepatch'
+    ]
+
+    function parse (v) {
+      try {
+        var parsed = JSON.parse(JSON.stringify(semver(v)))
+        delete parsed.options
+        return parsed
+      } catch (er) {
+        return null
+      }
+    }
+
+    function inc (v, level, preid) {
+      if (!semver.valid(v)) return null
+      if (levels.indexOf(level) === -1) level = 'patch'
+      return semver.inc(semver.clean(v), level, preid || undefined)
+    }
+
+    console.log(JSON.stringify({
+      parse: cases.versions.map(parse),
+      inc: cases.inc.map(function (c) { return inc(c[0], c[1], c[2]) })
+    }))
+  END
+
+
+  def self.available?
+    SEMVER_PATH.directory?
+  end
+
+
+  def self.cases_json
+    JSON.dump versions: VERSIONS, inc: INC_CASES
+  end
+
+
+  def self.python_results
+    @python_results ||= JSON.load Cmds.new(
+      "<%= bin %> -c <%= src %> <%= cases %>",
+      env: { PYTHONPATH: QB::ROOT.join( 'lib', 'python' ).to_s },
+    ).out!( bin: QB::Python.bin, src: PYTHON_SRC, cases: cases_json )
+  end
+
+
+  def self.node_results
+    @node_results ||= JSON.load Cmds.new(
+      "node --eval <%= src %> <%= cases %>",
+      chdir: QB::ROOT.to_s,
+    ).out!( src: NODE_SRC, cases: cases_json )
+  end
+
+end # module SemverConformance
+
+
+describe "lib/python/qb/semver.py conformance with node semver",
+  skip: ( "node_modules/semver not installed" unless
+          SemverConformance.available? ) \
+do
+  describe "parse" do
+    SemverConformance::VERSIONS.each_with_index do |version, index|
+      it "parses #{ version.inspect } the same" do
+        expect(
+          SemverConformance.python_results['parse'][index]
+        ).to eq SemverConformance.node_results['parse'][index]
+      end
+    end
+  end
+
+  describe "inc" do
+    SemverConformance::INC_CASES.each_with_index do |(version, level, preid), index|
+      it "increments #{ version.inspect } #{ level.inspect } " \
+         "#{ preid.inspect } the same" do
+        expect(
+          SemverConformance.python_results['inc'][index]
+        ).to eq SemverConformance.node_results['inc'][index]
+      end
+    end
+  end
+end
@@ -0,0 +1,36 @@
+require 'spec_helper'
+
+require 'qb/ipc/docker_broker'
+
+describe QB::IPC::DockerBroker do
+  describe '.enabled?' do
+    name = QB::IPC::DockerBroker::ENABLED_ENV_VAR_NAME
+    
+    it "is off when the ENV var isn't set" do
+      expect( described_class.enabled?( {} ) ).to be false
+    end
+    
+    %w[ 1 true yes on YES ].each do |value|
+      it "is on for #{ value.inspect }" do
+        expect( described_class.enabled?( name => value ) ).to be true
+      end
+    end
+    
+    %w[ 0 false no off whatever ].each do |value|
+      it "is off for #{ value.inspect }" do
+        expect( described_class.enabled?( name => value ) ).to be false
+      end
+    end
+  end # .enabled?
+  
+  
+  describe '.run_around' do
+    it "just runs the block when it's off" do
+      allow( described_class ).to receive( :enabled? ).and_return false
+      expect( described_class ).not_to receive :new
+      
+      expect( described_class.run_around { :ran } ).to be :ran
+      expect( ENV[ QB::IPC::DockerBroker::SOCKET_ENV_VAR_NAME ] ).to be nil
+    end
+  end # .run_around
+end # QB::IPC::DockerBroker